@@ -5,6 +5,19 @@ SCREEN_WIDTH = int(os.getenv("SCREEN_WIDTH", 640))
 SCREEN_HEIGHT = int(os.getenv("SCREEN_HEIGHT", 480))
 
 OPENCV_DETECT_ON = int(os.getenv("OPENCV_DETECT_ON", 0))
+# 在独立进程中运行视觉处理（共享内存传帧），避免与服务器、串口线程争用 GIL
+VISION_WORKER = int(os.getenv("VISION_WORKER", 0))
+# 同一帧内的检测器在线程池中并发运行，超过截止时间的检测器沿用上一次结果
+PARALLEL_DETECTORS = int(os.getenv("PARALLEL_DETECTORS", 0))
+DETECTOR_DEADLINE_MS = float(os.getenv("DETECTOR_DEADLINE_MS", 50))
+# 启用的检测器（见 vision/detectors.py），以及限频 "name=Hz,..."
+DETECTORS = os.getenv("DETECTORS", "track_line,lights")
+DETECTOR_RATES = os.getenv("DETECTOR_RATES", "face=5")
+# 人脸检测：缩放比例、完整检测间隔（帧）、人脸边长范围（像素，0 为不限）
+FACE_SCALE = float(os.getenv("FACE_SCALE", 0.5))
+FACE_DETECT_INTERVAL = int(os.getenv("FACE_DETECT_INTERVAL", 5))
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", 40))
+FACE_MAX_SIZE = int(os.getenv("FACE_MAX_SIZE", 0))
 
 # 0: Don't Output 1: Output for ControlPanel, 2: Output with cs2.imshow()
 FRAME_OUTPUT_METHOD = int(os.getenv("FRAME_OUTPUT_METHOD", 1))
@@ -12,4 +25,70 @@ VIDEO_INPUT_PATH = os.getenv("VIDEO_INPUT_PATH", "")
 
 SHOW_TRACKBAR = int(os.getenv("SHOW_TRACKBAR", 0))
 ENABLE_TURN_ANGLE_UPDATE = int(os.getenv("ENABLE_TURN_ANGLE_UPDATE", 1))
-RECORD_VIDEO = int(os.getenv("RECORD_VIDEO", 0))
\ No newline at end of file
+RECORD_VIDEO = int(os.getenv("RECORD_VIDEO", 0))
+RECORD_DIR = os.getenv("RECORD_DIR", "recordings")
+# 片段切分：时长（秒）和大小（MB），0 表示不切分
+RECORD_SEGMENT_SECONDS = float(os.getenv("RECORD_SEGMENT_SECONDS", 300))
+RECORD_SEGMENT_MB = float(os.getenv("RECORD_SEGMENT_MB", 0))
+RECORD_QUEUE_SIZE = int(os.getenv("RECORD_QUEUE_SIZE", 64))
+# 同时保存未叠加的原始帧 / 每帧元数据
+RECORD_RAW = int(os.getenv("RECORD_RAW", 0))
+RECORD_META = int(os.getenv("RECORD_META", 1))
+# 跨帧跟踪中线，只在上一帧位置附近搜索
+LINE_TRACKING = int(os.getenv("LINE_TRACKING", 1))
+# 赛道线提取方式：canny（边缘 + 逐行平均）或 runs（逐行游程编码，按线宽过滤）
+LINE_EXTRACTOR = os.getenv("LINE_EXTRACTOR", "canny")
+# 鸟瞰图（逆透视变换），标定点顺序：左下 右下 右上 左上，"x1,y1,...,x4,y4"
+BIRDSEYE_ON = int(os.getenv("BIRDSEYE_ON", 0))
+BIRDSEYE_SRC = os.getenv("BIRDSEYE_SRC", "")
+BIRDSEYE_SCALE = float(os.getenv("BIRDSEYE_SCALE", 0.5))
+BIRDSEYE_MAP_CACHE = os.getenv("BIRDSEYE_MAP_CACHE", "birdseye_maps.npz")
+# 调试：统计视觉处理每帧的内存分配
+VISION_ALLOC_DEBUG = int(os.getenv("VISION_ALLOC_DEBUG", 0))
+# 每帧决策写入二进制运行日志（见 runlog.py）
+RUN_LOG = int(os.getenv("RUN_LOG", 0))
+RUN_LOG_DIR = os.getenv("RUN_LOG_DIR", "runlogs")
+# 串口：上次成功连接的端口缓存、就绪等待上限，以及断线自动重连（退避上限、断线期间最多暂存的命令数）
+SERIAL_PORT_CACHE = os.getenv("SERIAL_PORT_CACHE", "serial_port.json")
+SERIAL_READY_TIMEOUT_MS = int(os.getenv("SERIAL_READY_TIMEOUT_MS", 100))
+SERIAL_RECONNECT = int(os.getenv("SERIAL_RECONNECT", 1))
+SERIAL_RECONNECT_MAX_MS = int(os.getenv("SERIAL_RECONNECT_MAX_MS", 2000))
+SERIAL_PENDING_MAX = int(os.getenv("SERIAL_PENDING_MAX", 32))
+# WebSocket 遥控：move 命令按固定频率合并发送（0 为收到即转发），move_ack 每个节拍合并发送一次（0 为不发送）
+WS_CONTROL_HZ = int(os.getenv("WS_CONTROL_HZ", 20))
+WS_MOVE_ACK = int(os.getenv("WS_MOVE_ACK", 1))
+# 超过该时间没有收到 move 则发送 stop（毫秒，0 为关闭；持续发送摇杆数据的客户端才应开启）
+WS_DEADMAN_MS = int(os.getenv("WS_DEADMAN_MS", 0))
+# 日志级别，日志在后台线程输出（见 logutil.py）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# 视觉参数初始值，运行时可通过 WebSocket 修改（见 vision/params.py）
+ROI_TOP = int(os.getenv("ROI_TOP", 100))
+YELLOW_HSV_LOWER = os.getenv("YELLOW_HSV_LOWER", "10,40,120")
+YELLOW_HSV_UPPER = os.getenv("YELLOW_HSV_UPPER", "38,255,255")
+LIGHT_BRIGHTNESS_A = float(os.getenv("LIGHT_BRIGHTNESS_A", 0.3))
+LIGHT_BRIGHTNESS_B = float(os.getenv("LIGHT_BRIGHTNESS_B", (1 - 0.3) * 125))
+SIGNAL_THRESHOLD = int(os.getenv("SIGNAL_THRESHOLD", 500))
+BLUR_KSIZE = int(os.getenv("BLUR_KSIZE", 7))
+
+# 赛道检测在图像金字塔第 N 层（边长缩小 2^N）上运行，置信度低的行/帧回退到原分辨率；0 为始终使用原分辨率
+PYRAMID_LEVEL = int(os.getenv("PYRAMID_LEVEL", 1))
+PYRAMID_MAX_LEVEL = int(os.getenv("PYRAMID_MAX_LEVEL", 2))
+PYRAMID_MIN_CONFIDENCE = float(os.getenv("PYRAMID_MIN_CONFIDENCE", 0.5))
+# 按检测耗时和 CPU 温度（sysfs，毫摄氏度）在 PYRAMID_LEVEL..PYRAMID_MAX_LEVEL 之间调整层级（见 vision/governor.py）
+GOVERNOR_ON = int(os.getenv("GOVERNOR_ON", 1))
+GOVERNOR_TARGET_MS = float(os.getenv("GOVERNOR_TARGET_MS", 20))
+CPU_TEMP_PATH = os.getenv("CPU_TEMP_PATH", "/sys/class/thermal/thermal_zone0/temp")
+CPU_TEMP_SOFT = float(os.getenv("CPU_TEMP_SOFT", 70))
+CPU_TEMP_HARD = float(os.getenv("CPU_TEMP_HARD", 80))
+# 控制台静态资源：检查文件修改的间隔（毫秒，0 为只在启动时加载），Cache-Control max-age（秒，0 为每次验证 ETag）
+HTTP_ASSET_RELOAD_MS = int(os.getenv("HTTP_ASSET_RELOAD_MS", 1000))
+HTTP_ASSET_MAX_AGE = int(os.getenv("HTTP_ASSET_MAX_AGE", 0))
+# 串口往返时延探测：ping 间隔（毫秒，0 为关闭，需要固件回复 pong），STM32 时间戳的计数频率（见 serial_pi/clock.py）
+SERIAL_PING_MS = int(os.getenv("SERIAL_PING_MS", 0))
+SERIAL_CLOCK_HZ = float(os.getenv("SERIAL_CLOCK_HZ", 1000))
+# 转向延迟补偿：预测器（none / cv / kalman，见 steering.py），下位机收到命令到生效的时延（毫秒），最长外推时间（毫秒），
+# 每单位误差命令引起的误差变化率（1/秒，0 为不启用预测，可用 python steering.py <运行日志> 估计）
+STEER_PREDICT = os.getenv("STEER_PREDICT", "none")
+STEER_ACTUATION_MS = float(os.getenv("STEER_ACTUATION_MS", 20))
+STEER_MAX_HORIZON_MS = float(os.getenv("STEER_MAX_HORIZON_MS", 300))
+STEER_PLANT_GAIN = float(os.getenv("STEER_PLANT_GAIN", 0))
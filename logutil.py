@@ -0,0 +1,192 @@
+"""
+日志
+
+所有日志经 QueueHandler 放入队列，由后台线程的 QueueListener 写到终端；
+树莓派的串口/SSH 终端很慢，这样串口接收线程、服务器线程和主循环不会阻塞在终端输出上。
+
+高频事件（每帧、每条命令）不要逐条记录：
+  - log_throttled: 同一 key 每 interval 秒最多输出一次，并注明期间省略的条数
+  - log_sampled:   同一 key 每 n 次输出一次
+  - counters:      只计数，需要时 counters.report() 输出增量
+"""
+
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def setup(level=None, stream=None) -> logging.handlers.QueueListener:
+    """
+    为根日志器安装队列处理器（可重复调用，只生效一次）
+
+    :param level: 日志级别，默认读取 config.LOG_LEVEL
+    :param stream: 输出流，默认 stderr
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        if level is None:
+            import config
+            level = config.LOG_LEVEL
+
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter(FORMAT, "%H:%M:%S"))
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(level)
+        _listener.start()
+        atexit.register(shutdown)
+        return _listener
+
+
+def shutdown():
+    """停止后台线程，队列中剩余的日志会先写完"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class Throttle:
+    """每个 key 在 interval 秒内最多放行一次"""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> Optional[int]:
+        """放行时返回上次放行后被省略的次数，否则返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] += 1
+                return None
+            self._last[key] = now
+            return self._suppressed.pop(key, 0)
+
+
+_throttles: Dict[float, Throttle] = {}
+_samples: Dict[str, int] = collections.defaultdict(int)
+
+
+def log_throttled(logger: logging.Logger, key: str, msg: str, *args,
+                  interval: float = 1.0, level: int = logging.INFO, **kwargs):
+    """同一 key 每 interval 秒最多记录一次"""
+    if not logger.isEnabledFor(level):
+        return
+    throttle = _throttles.get(interval)
+    if throttle is None:
+        throttle = _throttles.setdefault(interval, Throttle(interval))
+    suppressed = throttle.allow(key)
+    if suppressed is None:
+        return
+    if suppressed:
+        msg = f"{msg}（省略 {suppressed} 条）"
+    logger.log(level, msg, *args, **kwargs)
+
+
+def log_sampled(logger: logging.Logger, key: str, msg: str, *args,
+                every: int = 100, level: int = logging.INFO, **kwargs):
+    """同一 key 每 every 次记录一次（第 1 次总会记录）"""
+    if not logger.isEnabledFor(level):
+        return
+    count = _samples[key]
+    _samples[key] = count + 1
+    if count % every == 0:
+        logger.log(level, f"{msg}（第 {count + 1} 次）", *args, **kwargs)
+
+
+class Counters:
+    """高频事件计数，代替逐条日志"""
+
+    def __init__(self):
+        self._counts: Dict[str, int] = collections.Counter()
+        self._reported: Dict[str, int] = {}
+
+    def inc(self, name: str, n: int = 1):
+        # Counter 的 += 在 GIL 下不是原子的，偶尔少计一次可以接受
+        self._counts[name] += n
+
+    def get(self, name: str) -> int:
+        return self._counts.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self._counts)
+
+    def report(self, logger: logging.Logger, level: int = logging.INFO):
+        """记录自上次 report 以来各计数的增量"""
+        current = self.snapshot()
+        deltas = {k: v - self._reported.get(k, 0) for k, v in current.items()}
+        self._reported = current
+        changed = {k: v for k, v in deltas.items() if v}
+        if changed:
+            logger.log(level, "计数: " + ", ".join(f"{k}={v}" for k, v in sorted(changed.items())))
+
+
+counters = Counters()
+
+
+if __name__ == "__main__":
+    # 在慢速终端（模拟 115200 波特率串口控制台）上对比同步输出与队列输出的调用延迟
+    import io
+    import numpy as np
+
+    class SlowStream(io.TextIOBase):
+        def __init__(self, baudrate: int = 115200):
+            self.seconds_per_char = 10 / baudrate
+
+        def write(self, s):
+            time.sleep(len(s) * self.seconds_per_char)
+            return len(s)
+
+    def measure(logger: logging.Logger, n: int = 200, gap: float = 0.01):
+        latencies = []
+        for i in range(n):
+            start = time.perf_counter()
+            logger.info("已发送电机命令: ta:%d,lv:50,rv:50", i)
+            latencies.append(time.perf_counter() - start)
+            time.sleep(gap)
+        latencies = np.array(latencies) * 1e6
+        return latencies.mean(), np.percentile(latencies, 99)
+
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    sync_logger.addHandler(logging.StreamHandler(SlowStream()))
+    sync_logger.setLevel(logging.INFO)
+    print("同步 StreamHandler: 平均 %.0f us, p99 %.0f us" % measure(sync_logger))
+
+    setup(logging.INFO, stream=SlowStream())
+    queued_logger = logging.getLogger("bench.queued")
+    print("QueueHandler:      平均 %.0f us, p99 %.0f us" % measure(queued_logger))
+
+    throttled_logger = logging.getLogger("bench.throttled")
+    start = time.perf_counter()
+    for i in range(10000):
+        log_throttled(throttled_logger, "move", "已发送电机命令: ta:%d", i)
+    print("log_throttled:     平均 %.2f us" % ((time.perf_counter() - start) / 10000 * 1e6))
+    start = time.perf_counter()
+    for i in range(10000):
+        counters.inc("ws.move")
+    print("counters.inc:      平均 %.2f us" % ((time.perf_counter() - start) / 10000 * 1e6))
+    shutdown()
@@ -1,106 +1,234 @@
-from dotenv import load_dotenv
+import time
+_PROCESS_START = time.perf_counter()
 
-from vision import curve_detector, light_detect, track_line
+from dotenv import load_dotenv
 load_dotenv()  # 必须在所有导入之前加载 .env 文件
 
-import cv2
-from cv2.mat_wrapper import Mat
-import numpy as np
-import server as server
-import asyncio
+import contextlib
 import threading
 import signal
 import sys
-import serial_pi.serial_io as serial_io
-import serial_pi.motor as motor
+import cv2
 import config
+import logging
+import logutil
+logutil.setup()
+_BASE_IMPORT_TIME = time.perf_counter() - _PROCESS_START
 
 UPTIME_START_WHEN = 0
 
-def nothing(x):
-    pass
+class StartupTimer:
+    """记录启动各阶段（导入、初始化）的耗时，启动完成后打印"""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - begin))
+
+    def report(self, title: str):
+        total = time.perf_counter() - self.start
+        logger.info(f"启动耗时 ({title}): {total * 1000:.0f} ms")
+        for name, elapsed in self.phases:
+            logger.info(f"  {name:<16}{elapsed * 1000:8.1f} ms")
+
+logger = logging.getLogger("main")
+startup = StartupTimer(_PROCESS_START)
+startup.phases.append(("base import", _BASE_IMPORT_TIME))
+server = None
 
 shutdown_flag = threading.Event()
 
 def signal_handler(signum, frame):
     """信号处理器 for Ctrl+C"""
-    print("\nReceived exit signal (Ctrl+C), shutting down gracefully...")
+    logger.info("Received exit signal (Ctrl+C), shutting down gracefully...")
     shutdown_flag.set()
-    server.cleanup_servers()
+    if server is not None:
+        server.cleanup_servers()
     sys.exit(0)
 
 def main():
+    global server
+    # 各子系统只在启用时导入和初始化
+    if config.FRAME_OUTPUT_METHOD == 0 or config.FRAME_OUTPUT_METHOD == 1 or config.OPENCV_DETECT_ON:
+        with startup.phase("serial import"):
+            import serial_pi.serial_io as serial_io
+            import serial_pi.motor as motor
     if(config.FRAME_OUTPUT_METHOD == 0 or config.FRAME_OUTPUT_METHOD == 1):
-        if not serial_io.init_stm32_io():
-            print("STM32 Serial IO initialization failed")
-            exit(1)
-        print("STM32 Serial IO initialized")
+        with startup.phase("serial init"):
+            if not serial_io.init_stm32_io():
+                logger.error("STM32 Serial IO initialization failed")
+                exit(1)
+        logger.info("STM32 Serial IO initialized")
     if(config.FRAME_OUTPUT_METHOD == 1):
         # 注册信号处理器
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
         
         # 启动服务器
-        server.start_servers()
-    
-    cap = cv2.VideoCapture(0)
-    # cap = cv2.VideoCapture("/Users/lingc/Documents/output1.avi")
-    # cap.set(cv2.CAP_PROP_BRIGHTNESS, 0.5)
-    # cap.set(cv2.CAP_PROP_CONTRAST, 0.6)
-    # cap.set(cv2.CAP_PROP_SATURATION, 3)
-    actual_fps = cap.get(cv2.CAP_PROP_FPS)
-    print(f"Camera actual FPS: {actual_fps}")
-
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # global server：这里的 import 同时绑定模块级的 server
+        with startup.phase("http import"):
+            import server.http_server
+        with startup.phase("websocket import"):
+            import server.websocket_server
+        with startup.phase("server start"):
+            server.start_servers()
+
+    with startup.phase("vision import"):
+        from vision import light_detect, track_line, workspace, overlay
+        if config.OPENCV_DETECT_ON and not config.VISION_WORKER:
+            from vision import detectors
+        if config.OPENCV_DETECT_ON and config.VISION_WORKER:
+            from vision.worker import VisionWorker
+
+    with startup.phase("camera"):
+        cap = cv2.VideoCapture(0)
+        # cap = cv2.VideoCapture("/Users/lingc/Documents/output1.avi")
+        # cap.set(cv2.CAP_PROP_BRIGHTNESS, 0.5)
+        # cap.set(cv2.CAP_PROP_CONTRAST, 0.6)
+        # cap.set(cv2.CAP_PROP_SATURATION, 3)
+        actual_fps = cap.get(cv2.CAP_PROP_FPS)
+        logger.info(f"Camera actual FPS: {actual_fps}")
 
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    recorder = None
     if config.RECORD_VIDEO:
-        out = cv2.VideoWriter('output.avi', cv2.VideoWriter_fourcc(*'MJPG'), actual_fps, (config.SCREEN_WIDTH, config.SCREEN_HEIGHT))
+        from vision.recorder import VideoRecorder
+        recorder = VideoRecorder(
+            config.RECORD_DIR,
+            (config.SCREEN_WIDTH, config.SCREEN_HEIGHT),
+            fps=actual_fps,
+            queue_size=config.RECORD_QUEUE_SIZE,
+            segment_seconds=config.RECORD_SEGMENT_SECONDS,
+            segment_bytes=int(config.RECORD_SEGMENT_MB * 1024 * 1024),
+            save_raw=bool(config.RECORD_RAW),
+            save_meta=bool(config.RECORD_META),
+        )
+        recorder.start()
 
     if config.SHOW_TRACKBAR:
+        # 滑条变化时通过回调写入参数，检测器不再每帧读取滑条
+        from vision.params import TRACKBARS, params
         cv2.namedWindow("Video Trackbar", cv2.WINDOW_NORMAL)
-        cv2.createTrackbar("H Lower", "Video Trackbar", 10, 179, nothing)
-        cv2.createTrackbar("H Upper", "Video Trackbar", 40, 179, nothing)
-        cv2.createTrackbar("S Lower", "Video Trackbar", 40, 255, nothing)
-        cv2.createTrackbar("S Upper", "Video Trackbar", 255, 255, nothing)
-        cv2.createTrackbar("V Lower", "Video Trackbar", 120, 255, nothing)
-        cv2.createTrackbar("V Upper", "Video Trackbar", 255, 255, nothing)
+        for bar, name in TRACKBARS.items():
+            spec = params.describe()[name]
+            cv2.createTrackbar(bar, "Video Trackbar", spec['value'], int(spec['max']),
+                               lambda value, name=name: params.set(name, value))
+
+    run_log = None
+    if config.RUN_LOG:
+        import runlog
+        run_log = runlog.open_run_log(config.RUN_LOG_DIR)
+
+    vision_worker = None
+    last_result_seq = -1
+
+    import steering
+    predictor = steering.from_config()
+
+    detector_runner = None
+    if config.OPENCV_DETECT_ON and not config.VISION_WORKER:
+        with startup.phase("detectors"):
+            detector_runner = detectors.from_config()
 
+    startup.report("初始化完成")
+
+    first_command = True
+    frame_index = 0
+    last_line_time = None
     try:
         while not shutdown_flag.is_set():
             ret, frame = cap.read()
             if not ret:
                 break
+            capture_time = time.monotonic()
+            frame_index += 1
 
             r_frame = cv2.resize(frame, (config.SCREEN_WIDTH, config.SCREEN_HEIGHT))
 
-            if config.OPENCV_DETECT_ON:
-                direction, error = track_line.handle_one_frame(r_frame, config.SCREEN_HEIGHT)
-
-                redCount, greenCount = light_detect.handle_lights(frame)
-
-                signal_v, signal_cmd = light_detect.process_signal(frame, redCount, greenCount)
+            line = None
+            lights = None
+            faces = None
+            signal_v = -1
+            if config.OPENCV_DETECT_ON and config.VISION_WORKER:
+                # 视觉处理在独立进程中进行，这里只提交帧并取回最新的结果
+                if vision_worker is None:
+                    vision_worker = VisionWorker(frame.shape, (config.SCREEN_WIDTH, config.SCREEN_HEIGHT))
+                    vision_worker.start()
+                vision_worker.submit(frame, capture_time)
+                result = vision_worker.latest(last_result_seq)
+                if result is not None:
+                    last_result_seq = int(result['seq'])
+                    direction = "left" if result['direction'] > 0 else "right"
+                    line = track_line.LineResult(direction, float(result['error']),
+                                                 capture_time=float(result['capture_time']))
+                    lights = light_detect.LightResult(int(result['red']), int(result['green']))
+            elif detector_runner is not None:
+                ctx = detectors.FrameContext(frame, r_frame, frame_index, capture_time)
+                with workspace.alloc_probe():
+                    results = detector_runner.run(ctx)
+                line = results.get('track_line')
+                lights = results.get('lights') or light_detect.LightResult()
+                faces = results.get('face')
 
-                  # if signal_v == 0:
-                #     cv2.putText(frame, f"red light {redCount}/{greenCount}", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 1)
-                # elif signal_v == 1:
-                #     cv2.putText(frame, f"green light {redCount}/{greenCount}", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)            
+            # 检测器未按时完成时拿到的是之前某帧的结果，不再重复发送、预测和记录
+            if line is not None and (line.capture_time is None or line.capture_time != last_line_time):
+                # 误差对应的采集时间，检测器或工作进程返回的是结果所属帧的采集时间
+                line_time = line.capture_time if line.capture_time is not None else capture_time
+                last_line_time = line_time
+                signal_v, signal_cmd = light_detect.process_signal(lights.red_count, lights.green_count)
 
-                command = f"cv:{error},{signal_cmd}\n"
+                steer = line.error
+                if predictor is not None:
+                    # 外推到命令预计生效的时刻，运行日志仍记录测得的误差
+                    stm32_io = serial_io.get_stm32_io()
+                    now = time.monotonic()
+                    delay = steering.actuation_delay(stm32_io.stats if stm32_io else None, config.STEER_ACTUATION_MS)
+                    steer = predictor.correct(line_time, line.error, now + delay, now=now)
+                command = f"cv:{steer},{signal_cmd}\n"
                 motor.get_motor_controller().send_command(command)
+                if first_command:
+                    first_command = False
+                    startup.report("首条控制命令")
 
-                cv2.putText(frame, f"dir: {direction}", (10, 18), cv2.FONT_HERSHEY_SIMPLEX, 0.4,(155,55,0), 1)
-                cv2.putText(frame, f"error: {error}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 30), 1)
+                if run_log is not None:
+                    stm32_io = serial_io.get_stm32_io()
+                    stats = stm32_io.stats if stm32_io else {}
+                    run_log.append(frame_index, line.error, line.direction, signal_v,
+                                   lights.red_count, lights.green_count,
+                                   stats.get('bytes_received', 0), stats.get('bytes_sent', 0),
+                                   command, timestamp=line_time)
 
-            if config.RECORD_VIDEO:
-                out.write(frame)
+            # 只有在需要输出画面时才绘制叠加层，绘制在输出用的拷贝上
+            if overlay.needed():
+                view = r_frame.copy()
+                light_scale = (r_frame.shape[1] / frame.shape[1], r_frame.shape[0] / frame.shape[0])
+                overlay.render(view, line, lights, signal_v, light_scale, faces)
 
-            if(config.FRAME_OUTPUT_METHOD == 1):
-                success, jpeg_data = cv2.imencode('.jpeg', r_frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-                if success:
-                    server.http_server.output.write(jpeg_data.tobytes())
-            elif(config.FRAME_OUTPUT_METHOD == 2):
-                cv2.imshow("Original", frame)
-                # cv2.imshow("Track Line", yellow_mask)
+                if recorder is not None:
+                    meta = {
+                        'frame': frame_index,
+                        'capture_time': capture_time,
+                        'error': line.error if line else None,
+                        'direction': line.direction if line else None,
+                        'signal': signal_v,
+                    }
+                    recorder.write(view, meta, raw=r_frame if config.RECORD_RAW else None)
+
+                if(config.FRAME_OUTPUT_METHOD == 1):
+                    success, jpeg_data = cv2.imencode('.jpeg', view, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                    if success:
+                        server.http_server.output.write(jpeg_data.tobytes())
+                elif(config.FRAME_OUTPUT_METHOD == 2):
+                    cv2.imshow("Original", view)
+                    # cv2.imshow("Track Line", yellow_mask)
 
             # 按'q'退出
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -108,10 +236,24 @@ def main():
     finally:
         # 清理资源
         cap.release()
+        if recorder is not None:
+            recorder.stop()
+        if run_log is not None:
+            run_log.close()
+        if vision_worker is not None:
+            vision_worker.stop()
+        if detector_runner is not None:
+            logger.info(detector_runner.report())
+            detector_runner.teardown()
+        logutil.counters.report(logger)
+        if config.OPENCV_DETECT_ON and not config.VISION_WORKER:
+            from vision.governor import get_governor
+            logger.info(f"赛道检测金字塔: {track_line.pyramid_stats}，层级调节: {get_governor().stats}")
         cv2.destroyAllWindows()
 
         # 关闭服务器
-        server.cleanup_servers()
+        if server is not None:
+            server.cleanup_servers()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,213 @@
+"""
+二进制运行日志
+
+主循环每帧追加一条定长记录（时间戳、帧号、误差、方向、红绿灯面积、信号、串口收发字节数、发送的命令），
+文件通过内存映射写入，开销可以忽略；读取时直接得到 NumPy 结构化数组便于分析，
+并支持把记录的命令按原始节奏回放给串口替身。
+
+用法:
+    python runlog.py summary runlogs/run_xxx.rvlog
+    python runlog.py replay runlogs/run_xxx.rvlog [--speed 2] [--port /dev/ttyUSB0]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from typing import Optional
+import numpy as np
+
+MAGIC = b"RVCLOG1\0"
+# 文件头：魔数 版本 记录长度 记录条数 开始时间(time.time) 开始时间(monotonic)
+HEADER = struct.Struct("<8sIIQdd")
+HEADER_SIZE = 64
+COUNT_OFFSET = 16
+
+COMMAND_SIZE = 40
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),      # time.monotonic()
+    ('frame', '<u4'),
+    ('error', '<f4'),
+    ('direction', 'i1'),       # 1 左转, -1 右转, 0 无
+    ('signal', 'i1'),          # -1 无效, 0 红灯, 1 绿灯
+    ('red', '<u4'),
+    ('green', '<u4'),
+    ('serial_in', '<u4'),      # 累计接收字节数
+    ('serial_out', '<u4'),     # 累计发送字节数
+    ('command', f'S{COMMAND_SIZE}'),
+])
+
+DIRECTIONS = {'left': 1, 'right': -1}
+
+
+class RunLogWriter:
+    """追加写入的内存映射日志"""
+
+    def __init__(self, path: str, grow_records: int = 4096):
+        """
+        :param path: 日志文件路径
+        :param grow_records: 文件每次扩容的记录条数
+        """
+        self.path = path
+        self.grow_records = grow_records
+        self.count = 0
+        self._capacity = 0
+        self._file = open(path, "w+b")
+        header = HEADER.pack(MAGIC, 1, RECORD_DTYPE.itemsize, 0, time.time(), time.monotonic())
+        self._file.write(header.ljust(HEADER_SIZE, b"\0"))
+        self._mmap: Optional[mmap.mmap] = None
+        self._records: Optional[np.ndarray] = None
+        self._grow()
+
+    def _grow(self):
+        self._release()
+        self._capacity += self.grow_records
+        self._file.truncate(HEADER_SIZE + self._capacity * RECORD_DTYPE.itemsize)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._records = np.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=self._capacity, offset=HEADER_SIZE)
+
+    def _release(self):
+        if self._mmap is not None:
+            # 先释放 NumPy 视图，mmap 才能关闭
+            self._records = None
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+    def append(self, frame: int, error: float = 0.0, direction: str = "", signal: int = -1,
+               red: int = 0, green: int = 0, serial_in: int = 0, serial_out: int = 0,
+               command: str = "", timestamp: Optional[float] = None):
+        if self._mmap is None:
+            return
+        if self.count >= self._capacity:
+            self._grow()
+        record = self._records[self.count]
+        record['timestamp'] = time.monotonic() if timestamp is None else timestamp
+        record['frame'] = frame
+        record['error'] = error
+        record['direction'] = DIRECTIONS.get(direction, 0)
+        record['signal'] = signal
+        record['red'] = red
+        record['green'] = green
+        record['serial_in'] = serial_in
+        record['serial_out'] = serial_out
+        record['command'] = command.encode("ascii", "replace")[:COMMAND_SIZE]
+        self.count += 1
+        # 条数写在文件头，进程异常退出时已写入的记录仍可读取
+        struct.pack_into("<Q", self._mmap, COUNT_OFFSET, self.count)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._release()
+        self._file.truncate(HEADER_SIZE + self.count * RECORD_DTYPE.itemsize)
+        self._file.close()
+
+
+def open_run_log(directory: str) -> RunLogWriter:
+    """在目录中按启动时间新建日志"""
+    os.makedirs(directory, exist_ok=True)
+    return RunLogWriter(os.path.join(directory, time.strftime("run_%Y%m%d_%H%M%S.rvlog")))
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        magic, version, record_size, count, start_wall, start_mono = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"不是运行日志文件: {path}")
+    if record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"记录长度不匹配: 文件 {record_size}, 当前 {RECORD_DTYPE.itemsize}")
+    return {'version': version, 'count': count, 'start_wall': start_wall, 'start_monotonic': start_mono}
+
+
+def load(path: str) -> np.ndarray:
+    """读取整个日志为 NumPy 结构化数组"""
+    header = read_header(path)
+    return np.fromfile(path, dtype=RECORD_DTYPE, count=header['count'], offset=HEADER_SIZE)
+
+
+def summary(records: np.ndarray) -> dict:
+    if len(records) == 0:
+        return {'records': 0}
+    duration = float(records['timestamp'][-1] - records['timestamp'][0])
+    return {
+        'records': len(records),
+        'duration_s': duration,
+        'fps': (len(records) - 1) / duration if duration > 0 else 0.0,
+        'error_mean': float(records['error'].mean()),
+        'error_std': float(records['error'].std()),
+        'green_signal_frames': int(np.count_nonzero(records['signal'] == 1)),
+        'red_signal_frames': int(np.count_nonzero(records['signal'] == 0)),
+        'serial_out_bytes': int(records['serial_out'][-1] - records['serial_out'][0]),
+    }
+
+
+def replay(path: str, port: Optional[str] = None, speed: float = 1.0) -> int:
+    """
+    按原始时间间隔把记录中的命令发送出去
+
+    :param port: 串口路径，为空时启动一个伪终端替身接收
+    :param speed: 回放速度倍率
+    :return: 发送的命令条数
+    """
+    from serial_pi.serial_io import STM32SerialIO
+    from serial_pi.standin import PtyStandIn
+
+    records = load(path)
+    standin = None
+    if not port:
+        standin = PtyStandIn()
+        port = standin.start()
+        print(f"串口替身: {port}")
+
+    io = STM32SerialIO(port)
+    if not io.connect():
+        raise RuntimeError(f"无法连接串口 {port}")
+
+    sent = 0
+    try:
+        start = time.monotonic()
+        t0 = records['timestamp'][0] if len(records) else 0.0
+        for record in records:
+            command = record['command'].decode("ascii", "replace")
+            if not command:
+                continue
+            due = start + (record['timestamp'] - t0) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            io.send_command(command)
+            sent += 1
+    finally:
+        io.disconnect()
+        if standin:
+            time.sleep(0.2)
+            standin.stop()
+            print(f"替身收到 {len(standin.commands)} 条命令，校验失败 {standin.bad_frames} 帧")
+    return sent
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="RaspVisionCar 运行日志工具")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p_summary = sub.add_parser("summary", help="打印日志统计")
+    p_summary.add_argument("path")
+    p_replay = sub.add_parser("replay", help="把记录的命令回放到串口")
+    p_replay.add_argument("path")
+    p_replay.add_argument("--port", default=None, help="串口路径，默认使用伪终端替身")
+    p_replay.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.action == "summary":
+        for key, value in summary(load(args.path)).items():
+            print(f"{key}: {value}")
+    elif args.action == "replay":
+        print(f"已回放 {replay(args.path, args.port, args.speed)} 条命令")
+
+
+if __name__ == "__main__":
+    import logutil
+    logutil.setup()
+    _main()
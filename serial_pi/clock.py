@@ -0,0 +1,178 @@
+"""
+串口往返时延与 STM32 时钟同步
+
+树莓派定期发送 ping:<序号>，下位机回复 pong:<序号>,<t2>,<t3>（收到 ping 和发出 pong 时的时钟计数），
+与树莓派一侧的发送时间 t1、接收时间 t4（time.monotonic()）组成一个 NTP 样本：
+
+    往返时延 = (t4 - t1) - (t3 - t2)
+    时钟偏差 = ((t2 - t1) + (t3 - t4)) / 2      （STM32 时间 - 树莓派时间）
+
+只回复 pong:<序号> 的固件也能测出往返时延，但无法估计时钟偏差。
+偏差随时间的变化（晶振误差）用往返时延最小的一半样本做最小二乘拟合，
+据此把带 ts:<计数>, 前缀的上报数据换算到树莓派的 time.monotonic()。
+"""
+
+import collections
+import threading
+from typing import Deque, Optional, Tuple
+
+
+def percentile(sorted_values, q: float) -> float:
+    """已排序序列的分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+class ClockSync:
+    """往返时延统计和时钟偏差/漂移估计"""
+
+    def __init__(self, tick_hz: float = 1000.0, wrap: int = 2 ** 32, window: int = 256, rtt_window: int = 256):
+        """
+        :param tick_hz: STM32 时钟计数频率（HAL_GetTick 为 1000）
+        :param wrap: 计数回绕的模，0 为不回绕
+        :param window: 参与偏差拟合的最近样本数
+        :param rtt_window: 参与往返时延统计的最近样本数
+        """
+        self.tick_hz = tick_hz
+        self.wrap = wrap
+        # (本地中点时间, 偏差, 往返时延)，单位秒
+        self.samples: Deque[Tuple[float, float, float]] = collections.deque(maxlen=window)
+        self.rtts: Deque[float] = collections.deque(maxlen=rtt_window)
+        self.offset: Optional[float] = None
+        self.drift = 0.0
+        self._ref = 0.0
+        self._epoch = 0
+        self._last_ticks: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _seconds(self, ticks: int) -> float:
+        """计数换算为秒，按上一次的计数展开回绕"""
+        if self.wrap:
+            if self._last_ticks is not None and ticks < self._last_ticks - self.wrap // 2:
+                self._epoch += self.wrap
+            elif self._last_ticks is not None and ticks > self._last_ticks + self.wrap // 2:
+                # 回绕前发出、回绕后才处理的旧计数
+                return (ticks + self._epoch - self.wrap) / self.tick_hz
+            self._last_ticks = ticks
+        return (ticks + self._epoch) / self.tick_hz
+
+    def add(self, t1: float, t4: float, t2: Optional[int] = None, t3: Optional[int] = None) -> float:
+        """
+        加入一次 ping/pong
+
+        :param t1: ping 发出时间（time.monotonic()）
+        :param t4: pong 收到时间（time.monotonic()）
+        :param t2: STM32 收到 ping 时的计数
+        :param t3: STM32 发出 pong 时的计数
+        :return: 往返时延（秒）
+        """
+        with self._lock:
+            if t2 is None or t3 is None:
+                rtt = t4 - t1
+                self.rtts.append(rtt)
+                return rtt
+            r2, r3 = self._seconds(t2), self._seconds(t3)
+            rtt = max((t4 - t1) - (r3 - r2), 0.0)
+            self.rtts.append(rtt)
+            self.samples.append(((t1 + t4) / 2, ((r2 - t1) + (r3 - t4)) / 2, rtt))
+            self._fit()
+            return rtt
+
+    def _fit(self):
+        # 排队、线程调度造成的往返延迟不对称，只用往返时延最小的一半样本
+        best = sorted(self.samples, key=lambda s: s[2])[:max(2, len(self.samples) // 2)]
+        n = len(best)
+        mean_x = sum(s[0] for s in best) / n
+        mean_y = sum(s[1] for s in best) / n
+        sxx = sum((s[0] - mean_x) ** 2 for s in best)
+        # 时间跨度太短时斜率没有意义，只估计偏差
+        if n < 4 or sxx < 1.0:
+            self.drift = 0.0
+        else:
+            self.drift = sum((s[0] - mean_x) * (s[1] - mean_y) for s in best) / sxx
+        self._ref = mean_x
+        self.offset = mean_y
+
+    def offset_at(self, local: float) -> Optional[float]:
+        """local 时刻的时钟偏差估计（秒），尚无样本时为 None"""
+        if self.offset is None:
+            return None
+        return self.offset + self.drift * (local - self._ref)
+
+    def to_local(self, ticks: int) -> Optional[float]:
+        """把 STM32 计数换算为树莓派 time.monotonic() 时间，尚未同步时为 None"""
+        with self._lock:
+            if self.offset is None:
+                return None
+            remote = self._seconds(ticks)
+            # 偏差随时间变化很慢，用一次迭代求解 local + offset(local) = remote
+            local = remote - self.offset_at(remote - self.offset)
+            return remote - self.offset_at(local)
+
+    def rtt_summary(self) -> dict:
+        """往返时延统计（毫秒）"""
+        values = sorted(self.rtts)
+        if not values:
+            return {'rtt_p50_ms': None, 'rtt_p95_ms': None, 'rtt_max_ms': None}
+        return {
+            'rtt_p50_ms': percentile(values, 0.5) * 1000,
+            'rtt_p95_ms': percentile(values, 0.95) * 1000,
+            'rtt_max_ms': values[-1] * 1000,
+        }
+
+
+if __name__ == "__main__":
+    # 用带已知时钟偏差和漂移的替身检验：往返时延分布、偏差/漂移估计误差、上报时间戳换算误差
+    import argparse
+    import time
+    import logutil
+    from serial_pi.serial_io import STM32SerialIO
+    from serial_pi.standin import EchoStandIn
+
+    parser = argparse.ArgumentParser(description="串口往返时延和时钟同步测试")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=0.05, help="ping 间隔（秒）")
+    parser.add_argument("--delay", type=float, default=0.002, help="替身回复延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.003, help="替身回复延迟的随机抖动（秒）")
+    parser.add_argument("--offset", type=float, default=1234.5, help="替身时钟偏差（秒）")
+    parser.add_argument("--drift", type=float, default=50, help="替身时钟漂移（ppm）")
+    parser.add_argument("--tick-hz", type=float, default=1_000_000)
+    args = parser.parse_args()
+    logutil.setup("WARNING")
+
+    standin = EchoStandIn(delay=args.delay, jitter=args.jitter, clock_offset=args.offset,
+                          drift_ppm=args.drift, tick_hz=args.tick_hz, telemetry_hz=50)
+    io = STM32SerialIO(standin.start(), ready_timeout=0, ping_interval=args.interval, clock_hz=args.tick_hz)
+    errors = []
+
+    def on_data(data):
+        seq = int(data.raw_data.split(b',')[1])
+        sent = standin.telemetry_sent.get(seq)
+        if data.device_time is not None and sent is not None:
+            errors.append(data.device_time - sent)
+
+    io.add_data_callback(on_data)
+    io.connect()
+    time.sleep(args.seconds)
+    io.disconnect()
+    standin.stop()
+
+    s = io.stats
+    now = time.monotonic()
+    true_offset = now * args.drift * 1e-6 + args.offset
+    # 替身计数按 wrap 回绕，ClockSync 从第一个样本所在的回绕周期展开，两者只在模 wrap 意义下可比
+    wrap_seconds = standin.wrap / args.tick_hz
+    offset_error = (io.clock.offset_at(now) - true_offset + wrap_seconds / 2) % wrap_seconds - wrap_seconds / 2
+    print(f"ping {s['pings_sent']} 次，pong {s['pongs_received']} 次，丢失 {s['pings_lost']} 次")
+    print(f"往返时延（已扣除替身处理时间）: p50 {s['rtt_p50_ms']:.3f} ms, p95 {s['rtt_p95_ms']:.3f} ms, "
+          f"最长 {s['rtt_max_ms']:.3f} ms")
+    print(f"时钟偏差误差 {offset_error * 1e6:.0f} us，"
+          f"漂移估计 {s['clock_drift_ppm']:.1f} ppm（实际 {args.drift} ppm）")
+    if errors:
+        errors = sorted(abs(e) for e in errors[len(errors) // 4:])
+        print(f"上报时间戳换算误差（后 3/4 样本）: p50 {percentile(errors, 0.5) * 1e6:.0f} us, "
+              f"p95 {percentile(errors, 0.95) * 1e6:.0f} us")
@@ -0,0 +1,97 @@
+"""
+STM32 命令帧编码
+
+帧格式：帧头(0xAA) 长度 数据 校验和
+长度包含帧头、长度和校验和本身，校验和为前面所有字节之和的低 8 位。
+"""
+
+import collections
+import threading
+
+FRAME_HEADER = 0xAA
+# 长度字段只有一个字节
+MAX_PAYLOAD = 0xFF - 3
+
+
+def _check_length(data: bytes) -> int:
+    length = len(data) + 3
+    if length > 0xFF:
+        raise ValueError(f"命令过长: {len(data)} 字节，最多 {MAX_PAYLOAD} 字节")
+    return length
+
+
+# 帧头 + 长度、校验和都只有 256 种取值，预先生成，编码时不再为它们构造 bytes
+_HEADERS = [bytes((FRAME_HEADER, length)) for length in range(256)]
+_CHECKSUMS = [bytes((value,)) for value in range(256)]
+
+
+def encode(data: bytes) -> bytes:
+    """打包成帧，sum() 在 C 层对字节求和"""
+    length = _check_length(data)
+    return _HEADERS[length] + data + _CHECKSUMS[(FRAME_HEADER + length + sum(data)) & 0xFF]
+
+
+class FrameEncoder:
+    """
+    命令帧编码器
+
+    start/stop/beep 等固定命令的完整帧缓存在 LRU 中，每次都不同的命令（cv:误差,信号）直接编码。
+    """
+
+    def __init__(self, cache_size: int = 64):
+        self.cache_size = cache_size
+        self._cache: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def frame(self, command: str) -> bytes:
+        """固定命令的完整帧（带缓存）"""
+        with self._lock:
+            frame = self._cache.get(command)
+            if frame is not None:
+                self._cache.move_to_end(command)
+                self.hits += 1
+                return frame
+        frame = encode(command.encode("ascii"))
+        with self._lock:
+            self.misses += 1
+            self._cache[command] = frame
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    @staticmethod
+    def encode(command: str) -> bytes:
+        return encode(command.encode("ascii"))
+
+
+if __name__ == "__main__":
+    # 对比原实现（逐字节循环求和 + 拼接）与编码器的单帧耗时
+    import timeit
+
+    def original(command: str) -> bytes:
+        data = bytes(command, "ascii")
+        header = 0xAA
+        length = len(data) + 3
+        checksum = header + length
+        for byte in data:
+            checksum += byte
+        checksum = checksum & 0xFF
+        return bytes([header, length]) + data + bytes([checksum])
+
+    encoder = FrameEncoder()
+    for command in ("stop\n", "cv:-12.3456,1\n"):
+        assert original(command) == encode(command.encode("ascii")) == encoder.frame(command) \
+            == encoder.encode(command)
+
+    number = 200000
+    cases = [
+        ("原实现 stop", lambda: original("stop\n")),
+        ("缓存帧 stop", lambda: encoder.frame("stop\n")),
+        ("原实现 cv", lambda: original("cv:-12.3456,1\n")),
+        ("编码 cv", lambda: encoder.encode("cv:-12.3456,1\n")),
+    ]
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        print(f"{name:<12}{best / number * 1e9:8.0f} ns/帧")
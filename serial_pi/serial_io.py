@@ -5,19 +5,35 @@ STM32串口IO统一模块
 
 import serial
 import serial.tools.list_ports
+import os
 import time
 import threading
 import json
 import queue
+import collections
 from typing import Optional, Dict, Any, List, Callable
 import logging
 from dataclasses import dataclass
 from datetime import datetime
+from serial_pi.clock import ClockSync
+from serial_pi.frame import FrameEncoder
+from logutil import log_throttled
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+# 日志输出由入口调用 logutil.setup() 配置
 logger = logging.getLogger(__name__)
 
+# 每帧都会重新发送的命令类别，断线期间不暂存
+STREAMED_COMMANDS = frozenset((b"cv", b"ta", b"ping"))
+# 互相覆盖的状态命令归为同一类别
+_COMMAND_KINDS = {b"start": b"run", b"stop": b"run"}
+
+
+def _command_kind(command_bytes: bytes) -> bytes:
+    """整帧（帧头、长度、内容、校验）的命令类别：冒号前的名称"""
+    name = command_bytes[2:-1].split(b":", 1)[0].strip()
+    return _COMMAND_KINDS.get(name, name)
+
+
 @dataclass
 class SerialData:
     """串口数据结构"""
@@ -25,11 +41,18 @@ class SerialData:
     raw_data: bytes
     parsed_data: Optional[Dict[str, Any]] = None
     data_type: str = "unknown"
+    # 收到这一行时的 time.monotonic()
+    monotonic: float = 0.0
+    # 行首 ts:<计数>, 的 STM32 时间换算到树莓派 time.monotonic()，未带时间戳或时钟尚未同步时为 None
+    device_time: Optional[float] = None
 
 class STM32SerialIO:
     """STM32串口IO统一控制器"""
     
-    def __init__(self, port: Optional[str] = None, baudrate: int = 115200, timeout: float = 1.0):
+    def __init__(self, port: Optional[str] = None, baudrate: int = 115200, timeout: float = 1.0,
+                 port_cache: Optional[str] = None, ready_timeout: float = 0.1,
+                 auto_reconnect: bool = False, reconnect_max_delay: float = 2.0, pending_max: int = 32,
+                 ping_interval: float = 0.0, clock_hz: float = 1000.0):
         """
         初始化STM32串口IO控制器
         
@@ -37,14 +60,46 @@ class STM32SerialIO:
             port: 串口端口，如果为None则自动检测
             baudrate: 波特率，默认115200
             timeout: 超时时间，默认1秒
+            port_cache: 保存上次成功连接端口的文件，连接时优先尝试，为None则不缓存
+            ready_timeout: 打开端口后等待下位机数据的最长时间（秒），静默的设备超时后视为就绪
+            auto_reconnect: 断线后是否在后台自动重连
+            reconnect_max_delay: 重连退避的最长间隔（秒）
+            pending_max: 断线期间最多暂存的命令数，重连后按顺序发出，超出时丢弃最旧的；
+                每帧发送的 cv/ta/ping 不暂存，其余命令每类只保留最新一条（见 _queue_pending）
+            ping_interval: ping 的间隔（秒），0 为不发送；往返时延和时钟偏差见 serial_pi/clock.py
+            clock_hz: STM32 时钟计数频率，用于换算 pong 和上报数据中的时间戳
         """
         self.port = port
+        self.requested_port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        self.port_cache = port_cache
+        self.ready_timeout = ready_timeout
         self.serial_conn: Optional[serial.Serial] = None
         self.connected = False
         self.lock = threading.Lock()
+        self.encoder = FrameEncoder()
+
+        # 断线重连相关
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_min_delay = 0.05
+        self.reconnect_max_delay = reconnect_max_delay
+        # (命令类别, 整帧)
+        self.pending_commands = collections.deque(maxlen=pending_max)
+        self._link_lost = threading.Event()
+        self._closing = threading.Event()
+        self._supervisor_thread: Optional[threading.Thread] = None
+        # 刚连上时接收缓冲可能从一行中间开始，丢弃到第一个换行
+        self._resync = False
         
+        # 往返时延探测和时钟同步
+        self.ping_interval = ping_interval
+        self.clock = ClockSync(tick_hz=clock_hz)
+        self._ping_seq = 0
+        # 序号 -> 发出时间，超时未回复的计为丢失
+        self._pings: Dict[int, float] = {}
+        self._ping_thread: Optional[threading.Thread] = None
+
         # 数据接收相关
         self.receive_thread: Optional[threading.Thread] = None
         self.receive_running = False
@@ -62,7 +117,20 @@ class STM32SerialIO:
             'last_command_time': None,
             'last_data_time': None,
             'bytes_received': 0,
-            'bytes_sent': 0
+            'bytes_sent': 0,
+            'reconnects': 0,
+            'pending_dropped': 0,
+            'last_disconnect_time': None,
+            'last_recovery_seconds': None,
+            'pings_sent': 0,
+            'pongs_received': 0,
+            'pings_lost': 0,
+            'rtt_last_ms': None,
+            'rtt_p50_ms': None,
+            'rtt_p95_ms': None,
+            'rtt_max_ms': None,
+            'clock_offset_ms': None,
+            'clock_drift_ppm': None
         }
     
     def find_stm32_port(self) -> Optional[str]:
@@ -74,10 +142,11 @@ class STM32SerialIO:
         """
         try:
             ports = serial.tools.list_ports.comports()
-            logger.info(f"发现 {len(ports)} 个串口设备:")
+            # 重连时会反复扫描，设备列表只在调试级别输出
+            logger.debug(f"发现 {len(ports)} 个串口设备:")
             
             for port in ports:
-                logger.info(f"  - {port.device}: {port.description}")
+                logger.debug(f"  - {port.device}: {port.description}")
                 # 常见的STM32设备描述关键词
                 stm32_keywords = ['STM32', 'USB Serial', 'Virtual COM Port', 'CH340', 'CP210']
                 if any(keyword in port.description for keyword in stm32_keywords):
@@ -97,58 +166,273 @@ class STM32SerialIO:
         
         return None
     
-    def connect(self) -> bool:
+    def _load_cached_port(self) -> Optional[str]:
+        if not self.port_cache:
+            return None
+        try:
+            with open(self.port_cache) as f:
+                return json.load(f).get('port')
+        except (OSError, ValueError):
+            return None
+
+    def _save_cached_port(self, port: str):
+        if not self.port_cache or self._load_cached_port() == port:
+            return
+        try:
+            tmp = self.port_cache + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({'port': port, 'time': time.time()}, f)
+            os.replace(tmp, self.port_cache)
+        except OSError as e:
+            logger.warning(f"保存串口缓存失败: {e}")
+
+    def _candidate_ports(self) -> List[str]:
+        """按优先级返回要尝试的端口：指定端口，或本次运行用过的端口、缓存的端口"""
+        if self.requested_port:
+            return [self.requested_port]
+        candidates = []
+        for port in (self.port, self._load_cached_port()):
+            if port and port not in candidates and os.path.exists(port):
+                candidates.append(port)
+        return candidates
+
+    def _wait_ready(self, conn: serial.Serial) -> bool:
         """
-        连接到STM32设备
-        
-        Returns:
-            连接是否成功
+        就绪检测：下位机有数据上报即视为就绪，静默的设备在 ready_timeout 后视为就绪；
+        端口不可用时 in_waiting 会抛出异常
         """
+        deadline = time.monotonic() + self.ready_timeout
+        while conn.is_open:
+            if conn.in_waiting > 0 or time.monotonic() >= deadline:
+                return True
+            time.sleep(0.005)
+        return False
+
+    def _open(self, port: str) -> bool:
+        """打开并检测端口，成功后替换当前连接"""
+        conn = None
         try:
-            # 如果没有指定端口，自动查找
-            if not self.port:
-                self.port = self.find_stm32_port()
-                if not self.port:
-                    logger.error("未找到可用的串口设备")
-                    return False
-            
-            # 创建串口连接
-            self.serial_conn = serial.Serial(
-                port=self.port,
+            conn = serial.Serial(
+                port=port,
                 baudrate=self.baudrate,
                 timeout=self.timeout,
                 write_timeout=self.timeout
             )
-            
-            # 等待连接稳定
-            time.sleep(0.5)
-            
-            # 测试连接
-            if self.serial_conn.is_open:
-                self.connected = True
-                self.stats['connection_time'] = time.time()
-                logger.info(f"成功连接到STM32设备: {self.port}")
-
-                # 启动数据接收线程
-                self.start_receiving()
+            if not self._wait_ready(conn):
+                conn.close()
+                return False
+            # 打开时下位机已在上报，缓冲区开头可能是半行
+            resync = conn.in_waiting > 0
+        except Exception as e:
+            logger.debug(f"打开串口 {port} 失败: {e}")
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            return False
+
+        with self.lock:
+            self.serial_conn = conn
+            self.port = port
+            self.data_buffer = b''
+            self._resync = resync
+            self.connected = True
+        self._save_cached_port(port)
+        return True
+
+    def _open_any(self) -> bool:
+        """依次尝试候选端口，都失败时（未指定端口的情况下）扫描串口设备"""
+        for port in self._candidate_ports():
+            if self._open(port):
                 return True
-            else:
-                logger.error("串口连接失败")
+        if self.requested_port:
+            return False
+        port = self.find_stm32_port()
+        return bool(port) and self._open(port)
+
+    def connect(self) -> bool:
+        """
+        连接到STM32设备
+        
+        Returns:
+            连接是否成功
+        """
+        try:
+            if not self._open_any():
+                logger.error("未找到可用的串口设备")
                 return False
+
+            self.stats['connection_time'] = time.time()
+            logger.info(f"成功连接到STM32设备: {self.port}")
+
+            # 启动数据接收线程
+            self.start_receiving()
+            if self.auto_reconnect:
+                self._start_supervisor()
+            if self.ping_interval > 0:
+                self._start_pinger()
+            return True
                 
         except Exception as e:
             logger.error(f"连接STM32设备失败: {e}")
             self.connected = False
             return False
-    
+
+    def _on_link_lost(self, reason: Exception):
+        """读写失败时调用，标记断线并通知重连线程"""
+        if not self.connected or self._closing.is_set():
+            return
+        self.connected = False
+        self.stats['last_disconnect_time'] = time.time()
+        logger.warning(f"STM32串口连接断开: {reason}")
+        if self.auto_reconnect:
+            self._link_lost.set()
+
+    def _start_supervisor(self):
+        if self._supervisor_thread and self._supervisor_thread.is_alive():
+            return
+        self._closing.clear()
+        self._supervisor_thread = threading.Thread(target=self._supervise, name="stm32-reconnect", daemon=True)
+        self._supervisor_thread.start()
+
+    def _start_pinger(self):
+        if self._ping_thread and self._ping_thread.is_alive():
+            return
+        self._closing.clear()
+        self._ping_thread = threading.Thread(target=self._ping_loop, name="stm32-ping", daemon=True)
+        self._ping_thread.start()
+
+    def _ping_loop(self):
+        """定期发送 ping，超过 max(1s, 5 个间隔) 未回复的计为丢失"""
+        timeout = max(1.0, 5 * self.ping_interval)
+        while not self._closing.wait(self.ping_interval):
+            now = time.monotonic()
+            with self.lock:
+                lost = [seq for seq, sent in self._pings.items() if now - sent > timeout]
+                for seq in lost:
+                    del self._pings[seq]
+            self.stats['pings_lost'] += len(lost)
+            if self.connected:
+                self.ping()
+
+    def ping(self) -> int:
+        """发送一次 ping，返回序号"""
+        with self.lock:
+            seq = self._ping_seq
+            self._ping_seq += 1
+        packet = self.encoder.encode(f"ping:{seq}\n")
+        sent = time.monotonic()
+        with self.lock:
+            self._pings[seq] = sent
+        self._send_raw_command(packet)
+        self.stats['pings_sent'] += 1
+        return seq
+
+    def _handle_pong(self, line: bytes, received: float):
+        """pong:<序号>[,<t2>,<t3>]"""
+        fields = line[5:].split(b',')
+        try:
+            seq = int(fields[0])
+            t2, t3 = (int(fields[1]), int(fields[2])) if len(fields) >= 3 else (None, None)
+        except ValueError:
+            self.stats['errors'] += 1
+            return
+        with self.lock:
+            sent = self._pings.pop(seq, None)
+        if sent is None:
+            return
+        rtt = self.clock.add(sent, received, t2, t3)
+        self.stats['pongs_received'] += 1
+        self.stats['rtt_last_ms'] = rtt * 1000
+        self.stats.update(self.clock.rtt_summary())
+        offset = self.clock.offset_at(received)
+        if offset is not None:
+            self.stats['clock_offset_ms'] = offset * 1000
+            self.stats['clock_drift_ppm'] = self.clock.drift * 1e6
+
+    def _close_conn(self):
+        with self.lock:
+            conn, self.serial_conn = self.serial_conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _supervise(self):
+        """断线后按指数退避重连，回调和暂存的命令保留在本对象上"""
+        while not self._closing.is_set():
+            if not self._link_lost.wait(timeout=0.5):
+                continue
+            if self._closing.is_set():
+                break
+            self._link_lost.clear()
+            lost_at = time.monotonic()
+            delay = self.reconnect_min_delay
+            self._close_conn()
+            while not self._closing.is_set() and not self.connected:
+                if self._open_any():
+                    break
+                self._wait_for_device(delay)
+                delay = min(delay * 2, self.reconnect_max_delay)
+            if not self.connected:
+                continue
+            self.stats['reconnects'] += 1
+            self.stats['last_recovery_seconds'] = time.monotonic() - lost_at
+            logger.info(f"STM32串口已重连: {self.port}，耗时 {self.stats['last_recovery_seconds']:.2f}s")
+            self._flush_pending()
+
+    def _wait_for_device(self, delay: float):
+        """退避等待，期间端口文件重新出现（USB 重新枚举）则立即返回"""
+        before = set(self._candidate_ports())
+        deadline = time.monotonic() + delay
+        while not self._closing.is_set() and time.monotonic() < deadline:
+            if set(self._candidate_ports()) - before:
+                return
+            self._closing.wait(0.02)
+
+    def _queue_pending(self, command_bytes: bytes):
+        """
+        断线期间暂存命令，重连后发出
+
+        每帧都会重新发送的转向命令（cv/ta）和 ping 过时即无用，重连后按几秒前的误差转向反而危险，直接丢弃；
+        start/stop/beep 等设置状态的命令每类只保留最新一条（start 和 stop 视为同一类）。
+        丢弃的命令都计入 pending_dropped。
+        """
+        kind = _command_kind(command_bytes)
+        if kind in STREAMED_COMMANDS:
+            self.stats['pending_dropped'] += 1
+            return
+        with self.lock:
+            for item in list(self.pending_commands):
+                if item[0] == kind:
+                    self.pending_commands.remove(item)
+                    self.stats['pending_dropped'] += 1
+            if len(self.pending_commands) == self.pending_commands.maxlen:
+                self.stats['pending_dropped'] += 1
+            self.pending_commands.append((kind, command_bytes))
+
+    def _flush_pending(self):
+        while self.pending_commands and self.connected:
+            try:
+                _, command_bytes = self.pending_commands.popleft()
+            except IndexError:
+                break
+            self._send_raw_command(command_bytes)
+
     def disconnect(self):
         """断开连接"""
+        self._closing.set()
+        self._link_lost.set()
+        if self._supervisor_thread and self._supervisor_thread.is_alive():
+            self._supervisor_thread.join(timeout=2.0)
+        if self._ping_thread and self._ping_thread.is_alive():
+            self._ping_thread.join(timeout=2.0)
+        # 接收线程处理 pong 时会获取 self.lock，不能持锁等待它退出
+        self.connected = False
+        self.stop_receiving()
         with self.lock:
-            self.connected = False
-            
-            # 停止接收线程
-            self.stop_receiving()
-            
             if self.serial_conn and self.serial_conn.is_open:
                 try:
                     self.serial_conn.close()
@@ -179,31 +463,47 @@ class STM32SerialIO:
         """数据接收循环"""
         logger.info("开始持续读取STM32数据...")
         
-        while self.receive_running and self.connected:
+        # 断线期间线程保持运行，重连后继续读取
+        while self.receive_running:
+            conn = self.serial_conn
+            if not self.connected or not conn or not conn.is_open:
+                time.sleep(0.01)
+                continue
             try:
-                if not self.serial_conn or not self.serial_conn.is_open:
-                    time.sleep(0.1)
-                    continue
-                
-                # 读取可用数据
-                if self.serial_conn.in_waiting > 0:
-                    data = self.serial_conn.read(self.serial_conn.in_waiting)
-                    if data:
-                        self._process_received_data(data)
-                else:
-                    time.sleep(0.01)  # 短暂休眠避免CPU占用过高
+                # 阻塞读取，至少等待 1 字节（最长 timeout）
+                data = conn.read(conn.in_waiting or 1)
+                if data:
+                    self._process_received_data(data, time.monotonic())
                     
             except Exception as e:
-                logger.error(f"接收数据时出错: {e}")
+                if not self.receive_running or conn is not self.serial_conn:
+                    continue
+                log_throttled(logger, "serial.receive_error", f"接收数据时出错: {e}", level=logging.ERROR)
                 self.stats['errors'] += 1
-                time.sleep(0.1)
+                self._on_link_lost(e)
+                if not self.auto_reconnect:
+                    time.sleep(0.1)
     
-    def _process_received_data(self, data: bytes):
-        """处理接收到的数据"""
+    def _process_received_data(self, data: bytes, received: Optional[float] = None):
+        """
+        处理接收到的数据
+
+        Args:
+            received: 读到这些数据时的 time.monotonic()
+        """
+        if received is None:
+            received = time.monotonic()
         try:
             self.data_buffer += data
             self.stats['bytes_received'] += len(data)
             self.stats['last_data_time'] = time.time()
+
+            if self._resync:
+                line_end = self.data_buffer.find(b'\n')
+                if line_end < 0:
+                    return
+                self.data_buffer = self.data_buffer[line_end + 1:]
+                self._resync = False
             
             # 处理完整的数据包
             while b'\n' in self.data_buffer:
@@ -211,22 +511,30 @@ class STM32SerialIO:
                 line = self.data_buffer[:line_end].strip()
                 self.data_buffer = self.data_buffer[line_end + 1:]
                 
-                if line:
-                    self._parse_and_queue_data(line)
+                if line.startswith(b'pong:'):
+                    self._handle_pong(line, received)
+                elif line:
+                    self._parse_and_queue_data(line, received)
                     
         except Exception as e:
-            logger.error(f"处理接收数据时出错: {e}")
+            log_throttled(logger, "serial.process_error", f"处理接收数据时出错: {e}", level=logging.ERROR)
             self.stats['errors'] += 1
     
-    def _parse_and_queue_data(self, data: bytes):
+    def _parse_and_queue_data(self, data: bytes, received: float = 0.0):
         """解析并队列化数据"""
         try:
             # 创建串口数据对象
             serial_data = SerialData(
                 timestamp=time.time(),
                 raw_data=data,
-                data_type="unknown"
+                data_type="unknown",
+                monotonic=received
             )
+            # 带 STM32 时间戳的上报：ts:<计数>,...
+            if data.startswith(b'ts:'):
+                ticks, _, _ = data[3:].partition(b',')
+                if ticks.isdigit():
+                    serial_data.device_time = self.clock.to_local(int(ticks))
 
             # 尝试解析数据
             data_str = data.decode('ascii')
@@ -248,10 +556,10 @@ class STM32SerialIO:
                 try:
                     callback(serial_data)
                 except Exception as e:
-                    logger.error(f"数据回调函数执行失败: {e}")
+                    log_throttled(logger, "serial.callback_error", f"数据回调函数执行失败: {e}", level=logging.ERROR)
                     
         except Exception as e:
-            logger.error(f"解析数据时出错: {e}")
+            log_throttled(logger, "serial.parse_error", f"解析数据时出错: {e}", level=logging.ERROR)
             self.stats['errors'] += 1
     
     def add_data_callback(self, callback: Callable[[SerialData], None]):
@@ -374,7 +682,11 @@ class STM32SerialIO:
             响应内容，如果没有响应或出错返回None
         """
         if not self.connected or not self.serial_conn:
-            logger.error("串口未连接")
+            if self.auto_reconnect and not self._closing.is_set():
+                # 断线期间暂存，重连后发出
+                self._queue_pending(command_bytes)
+                return None
+            log_throttled(logger, "serial.not_connected", "串口未连接", level=logging.ERROR)
             return None
 
         with self.lock:
@@ -386,32 +698,32 @@ class STM32SerialIO:
                 self.serial_conn.write(command_bytes)
                 self.serial_conn.flush()
 
-                # self.stats['commands_sent'] += 1
-                # self.stats['bytes_sent'] += len(command_bytes)
-                # self.stats['last_command_time'] = time.time()
+                self.stats['commands_sent'] += 1
+                self.stats['bytes_sent'] += len(command_bytes)
+                self.stats['last_command_time'] = time.time()
                 return None
                 
             except Exception as e:
-                logger.error(f"发送命令失败: {e}")
+                log_throttled(logger, "serial.send_error", f"发送命令失败: {e}", level=logging.ERROR)
                 self.stats['errors'] += 1
-                return None
+                self._on_link_lost(e)
+        # 暂存需要再次获取 self.lock，在释放后进行
+        if self.auto_reconnect:
+            self._queue_pending(command_bytes)
+        return None
 
-    def send_command(self, command: str):
+    def send_command(self, command: str, constant: bool = False):
         """
         加入帧头和帧尾
-        """
-        data = bytes(command, "ascii")
-
-        header = 0xAA
-        length = len(data) + 3 # contains header, len and checksum
-        
-        # 计算校验和：header + length + 所有data字节的和
-        checksum = header + length
-        for byte in data:
-            checksum += byte
-        checksum = checksum & 0xFF  # 取最后一字节
 
-        packet = bytes([header, length]) + data + bytes([checksum])
+        Args:
+            command: 命令内容
+            constant: 是否为 start/stop 等固定命令，固定命令的整帧会被缓存
+        """
+        if constant:
+            packet = self.encoder.frame(command)
+        else:
+            packet = self.encoder.encode(command)
         self._send_raw_command(packet)
    
 # 全局STM32控制器实例
@@ -429,9 +741,19 @@ def init_stm32_io(port: Optional[str] = None, baudrate: int = 115200) -> bool:
         初始化是否成功
     """
     global _stm32_io
+    import config
     
     try:
-        _stm32_io = STM32SerialIO(port, baudrate)
+        _stm32_io = STM32SerialIO(
+            port, baudrate,
+            port_cache=config.SERIAL_PORT_CACHE or None,
+            ready_timeout=config.SERIAL_READY_TIMEOUT_MS / 1000,
+            auto_reconnect=bool(config.SERIAL_RECONNECT),
+            reconnect_max_delay=config.SERIAL_RECONNECT_MAX_MS / 1000,
+            pending_max=config.SERIAL_PENDING_MAX,
+            ping_interval=config.SERIAL_PING_MS / 1000,
+            clock_hz=config.SERIAL_CLOCK_HZ,
+        )
         return _stm32_io.connect()
     except Exception as e:
         logger.error(f"初始化STM32 IO控制器失败: {e}")
@@ -456,6 +778,8 @@ def cleanup_stm32_io():
 
 if __name__ == '__main__':
     # 测试代码
+    import logutil
+    logutil.setup()
     print("STM32串口IO测试...")
     
     # 数据接收回调函数
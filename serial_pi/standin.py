@@ -0,0 +1,279 @@
+"""
+STM32 串口替身
+
+用伪终端（pty）模拟下位机：STM32SerialIO 连接替身的从端路径，
+替身从主端读取并解析带帧头/校验的命令帧，可选择回写数据。
+用于回放、测试和压测，无需真实硬件。
+"""
+
+import os
+import random
+import select
+import threading
+import time
+import tty
+from typing import Callable, List, Optional, Tuple
+from serial_pi.frame import FRAME_HEADER
+
+
+def decode_frames(buffer: bytearray) -> Tuple[List[bytes], int]:
+    """
+    从缓冲区中解析完整的命令帧（帧头 长度 数据 校验和）
+
+    Returns:
+        (解析出的数据列表, 校验失败的帧数)，已消费的字节会从 buffer 中移除
+    """
+    commands = []
+    bad = 0
+    while True:
+        start = buffer.find(bytes([FRAME_HEADER]))
+        if start < 0:
+            buffer.clear()
+            break
+        if start:
+            del buffer[:start]
+        if len(buffer) < 2:
+            break
+        length = buffer[1]
+        if length < 3:
+            del buffer[:1]
+            bad += 1
+            continue
+        if len(buffer) < length:
+            break
+        frame = bytes(buffer[:length])
+        if (sum(frame[:-1]) & 0xFF) == frame[-1]:
+            commands.append(frame[2:-1])
+            del buffer[:length]
+        else:
+            # 校验失败，跳过这个帧头继续寻找
+            del buffer[:1]
+            bad += 1
+    return commands, bad
+
+
+class PtyStandIn:
+    """基于伪终端的 STM32 替身"""
+
+    def __init__(self, on_command: Optional[Callable[[bytes], Optional[bytes]]] = None,
+                 link: Optional[str] = None):
+        """
+        :param on_command: 收到命令时的回调，返回的字节（如有）会回写给树莓派一侧
+        :param link: 固定的符号链接路径（类似 /dev/serial/by-id），重新 start() 后指向新的伪终端
+        """
+        self.on_command = on_command
+        self.link = link
+        self.master_fd: Optional[int] = None
+        self.slave_fd: Optional[int] = None
+        self.port: Optional[str] = None
+        self.commands: List[Tuple[float, bytes]] = []
+        self.bad_frames = 0
+        self.bytes_received = 0
+        self._buffer = bytearray()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._write_lock = threading.Lock()
+
+    def start(self) -> str:
+        """创建伪终端并开始读取，返回供 STM32SerialIO 使用的端口路径"""
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        if self.link:
+            tmp = self.link + ".tmp"
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            os.symlink(self.port, tmp)
+            os.replace(tmp, self.link)
+            self.port = self.link
+        self._buffer.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, name="stm32-standin", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master_fd = self.slave_fd = None
+        # 模拟设备拔出：固定路径随之消失
+        if self.link and os.path.lexists(self.link):
+            os.unlink(self.link)
+
+    def write(self, data: bytes):
+        """向树莓派一侧发送数据（模拟下位机上报）"""
+        if self.master_fd is None:
+            return
+        with self._write_lock:
+            os.write(self.master_fd, data)
+
+    def _handle(self, command: bytes):
+        self.commands.append((time.monotonic(), command))
+        if self.on_command:
+            reply = self.on_command(command)
+            if reply:
+                self.write(reply)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+                if not ready:
+                    continue
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                # 从端全部关闭时主端读取会返回 EIO，稍后重试
+                time.sleep(0.05)
+                continue
+            if not data:
+                continue
+            self.bytes_received += len(data)
+            self._buffer += data
+            commands, bad = decode_frames(self._buffer)
+            self.bad_frames += bad
+            for command in commands:
+                self._handle(command)
+
+
+class EchoStandIn(PtyStandIn):
+    """
+    回复 ping 的替身，下位机时钟带有偏差和漂移，回复延迟可配置
+
+    收到 ping:<序号> 后经过 delay（加上 0..jitter 的随机抖动）回复 pong:<序号>,<t2>,<t3>，
+    t2 / t3 为替身时钟在收到 ping 和发出 pong 时的计数。telemetry_hz > 0 时按该频率上报 ts:<计数>,<序号>。
+    """
+
+    def __init__(self, delay: float = 0.0, jitter: float = 0.0, clock_offset: float = 0.0,
+                 drift_ppm: float = 0.0, tick_hz: float = 1000.0, wrap: int = 2 ** 32,
+                 telemetry_hz: float = 0.0, link: Optional[str] = None):
+        """
+        :param delay: 收到 ping 到回复 pong 的延迟（秒），模拟固件处理时间
+        :param jitter: 额外的随机延迟上限（秒）
+        :param clock_offset: 替身时钟相对 time.monotonic() 的偏差（秒）
+        :param drift_ppm: 替身时钟的频率误差（百万分之一）
+        :param tick_hz: 计数频率
+        :param wrap: 计数回绕的模
+        :param telemetry_hz: 带时间戳上报的频率，0 为不上报
+        """
+        super().__init__(on_command=self._on_ping, link=link)
+        self.delay = delay
+        self.jitter = jitter
+        self.clock_offset = clock_offset
+        self.drift_ppm = drift_ppm
+        self.tick_hz = tick_hz
+        self.wrap = wrap
+        self.telemetry_hz = telemetry_hz
+        # 上报序号 -> 上报时的 time.monotonic()，用于检验换算结果
+        self.telemetry_sent = {}
+        self._rng = random.Random(0)
+
+    def ticks(self, now: Optional[float] = None) -> int:
+        """替身时钟的当前计数"""
+        now = time.monotonic() if now is None else now
+        remote = now * (1 + self.drift_ppm * 1e-6) + self.clock_offset
+        return int(remote * self.tick_hz) % self.wrap
+
+    def _on_ping(self, command: bytes) -> Optional[bytes]:
+        if not command.startswith(b"ping:"):
+            return None
+        t2 = self.ticks()
+        seq = command[5:].strip().decode()
+        delay = self.delay + self._rng.uniform(0, self.jitter)
+        if delay <= 0:
+            return f"pong:{seq},{t2},{self.ticks()}\n".encode()
+
+        def reply():
+            time.sleep(delay)
+            if self._running:
+                self.write(f"pong:{seq},{t2},{self.ticks()}\n".encode())
+
+        threading.Thread(target=reply, daemon=True).start()
+        return None
+
+    def _telemetry_loop(self):
+        seq = 0
+        interval = 1.0 / self.telemetry_hz
+        while self._running:
+            now = time.monotonic()
+            self.telemetry_sent[seq] = now
+            self.write(f"ts:{self.ticks(now)},{seq}\n".encode())
+            seq += 1
+            time.sleep(interval)
+
+    def start(self) -> str:
+        port = super().start()
+        if self.telemetry_hz > 0:
+            threading.Thread(target=self._telemetry_loop, name="stm32-standin-telemetry", daemon=True).start()
+        return port
+
+
+if __name__ == "__main__":
+    # 测量首条命令耗时，以及替身消失后重新出现时的恢复时间
+    import json
+    import tempfile
+    import logutil
+    from serial_pi.serial_io import STM32SerialIO
+
+    logutil.setup()
+    tmp_dir = tempfile.mkdtemp()
+    link = os.path.join(tmp_dir, "ttySTM32")
+    cache = os.path.join(tmp_dir, "serial_port.json")
+    with open(cache, "w") as f:
+        json.dump({'port': link}, f)
+
+    standin = PtyStandIn(link=link)
+    standin.start()
+
+    def wait_for_command(after: int, timeout: float = 10.0) -> float:
+        deadline = time.monotonic() + timeout
+        while len(standin.commands) <= after and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return standin.commands[after][0] if len(standin.commands) > after else float("nan")
+
+    start = time.monotonic()
+    io = STM32SerialIO(port_cache=cache, auto_reconnect=True)
+    io.connect()
+    io.send_command("cv:0,\n")
+    first = wait_for_command(0)
+    print(f"首条命令: {(first - start) * 1000:.1f} ms（缓存端口 {io.port}，就绪等待上限 {io.ready_timeout * 1000:.0f} ms）")
+
+    sending = True
+
+    def sender():
+        i = 0
+        while sending:
+            io.send_command(f"cv:{i},\n")
+            i += 1
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    for outage in (0.2, 0.5, 1.0):
+        time.sleep(0.2)
+        standin.stop()
+        gone = time.monotonic()
+        # 断线期间的状态命令：重连后只应补发最新的一条 start/stop
+        time.sleep(outage / 2)
+        io.send_command("stop\n", constant=True)
+        io.send_command("start\n", constant=True)
+        time.sleep(outage / 2)
+        count = len(standin.commands)
+        standin.start()
+        back = time.monotonic()
+        received = wait_for_command(count)
+        time.sleep(0.05)
+        replayed = [c.strip().decode() for t, c in standin.commands[count:] if t < received + 0.005]
+        print(f"断开 {outage * 1000:.0f} ms: 重新出现后 {(received - back) * 1000:.1f} ms 恢复发送，"
+              f"断线共 {(received - gone) * 1000:.0f} ms，恢复后最先收到 {replayed}")
+    sending = False
+    thread.join()
+    print(f"重连 {io.stats['reconnects']} 次，丢弃暂存命令 {io.stats['pending_dropped']} 条")
+    io.disconnect()
+    standin.stop()
@@ -1,7 +1,17 @@
-import server.http_server as http_server
-import server.websocket_server as websocket_server
+# http_server（Flask）和 websocket_server（websockets）导入较慢，只在启动服务器时导入
+import importlib
+import logging
 import threading
 
+_SUBMODULES = ("http_server", "websocket_server")
+
+logger = logging.getLogger(__name__)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # 全局变量存储服务器线程
 http_thread = None
 ws_thread = None
@@ -9,31 +19,37 @@ ws_thread = None
 def start_servers():
     """启动HTTP和WebSocket服务器"""
     global http_thread, ws_thread
+    from server import http_server, websocket_server
     
     # 在单独线程中启动HTTP服务器（Flask是阻塞的）
     http_thread = threading.Thread(target=http_server.start_http_server, daemon=False)
     http_thread.start()
-    print("HTTP Server started in background thread")
+    logger.info("HTTP Server started in background thread")
 
     # 在单独线程中启动WebSocket服务器（asyncio.run是阻塞的）
     ws_thread = threading.Thread(target=websocket_server.start_websocket_server, daemon=False)
     ws_thread.start()
-    print("WebSocket Server started in background thread")
+    logger.info("WebSocket Server started in background thread")
 
 def cleanup_servers():
     """清理服务器资源"""
     global http_thread, ws_thread
+
+    # 从未启动过则无需清理，也不为此导入 Flask / websockets
+    if http_thread is None and ws_thread is None:
+        return
+    from server import http_server, websocket_server
     
-    print("\n正在关闭服务器...")
+    logger.info("正在关闭服务器...")
     
     # 停止HTTP服务器
     try:
         http_server.stop_http_server()
     except Exception as e:
-        print(f"关闭HTTP服务器时出错: {e}")
+        logger.error(f"关闭HTTP服务器时出错: {e}")
     
     # 停止WebSocket服务器
     try:
         websocket_server.stop_websocket_server()
     except Exception as e:
-        print(f"关闭WebSocket服务器时出错: {e}")
\ No newline at end of file
+        logger.error(f"关闭WebSocket服务器时出错: {e}")
\ No newline at end of file
@@ -1,13 +1,22 @@
 # HTTP Flask server for RaspVisionCar console
 # should be running on Raspberry Pi
 
-from flask import Flask, Response, request, send_file
+from flask import Flask, Response, request
 import threading
 import io
 import sys
 import os
 import serial_pi.serial_io as serial_io
 from werkzeug.serving import make_server
+import logging
+from logutil import counters, log_throttled
+import config
+from server.static_cache import StaticCache, choose_encoding, etag_matches
+
+logger = logging.getLogger(__name__)
+
+# /control 接受的命令
+CONTROL_COMMANDS = ("start", "stop", "beep")
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,14 +25,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 try:
     from serial_pi.motor import Motor_Controller
     motor_controller = Motor_Controller()
-    print("电机控制器初始化成功")
+    logger.info("电机控制器初始化成功")
 except ImportError as e:
-    print(f"无法导入电机控制器: {e}")
+    logger.error(f"无法导入电机控制器: {e}")
     motor_controller = None
 
 app = Flask(__name__)
 
-ASSETS_DIR = "assets"
+# 控制台页面，启动时读入内存并预压缩（见 static_cache.py）
+assets = StaticCache(files={
+    "auth.html": "text/html; charset=utf-8",
+    "index.html": "text/html; charset=utf-8",
+    "main.js": "application/javascript; charset=utf-8",
+}, reload_interval=config.HTTP_ASSET_RELOAD_MS / 1000)
 
 # Global variable for streaming output
 output = None
@@ -41,24 +55,47 @@ class StreamingOutput(io.BufferedIOBase):
             self.frame = buf
             self.condition.notify_all()
 
+def _cache_control() -> str:
+    if config.HTTP_ASSET_MAX_AGE > 0:
+        return f"public, max-age={config.HTTP_ASSET_MAX_AGE}"
+    # 每次使用前向服务器验证，未修改时只返回 304
+    return "no-cache"
+
+def send_asset(name: str):
+    """返回缓存的静态资源；If-None-Match 命中时返回不带内容的 304"""
+    asset = assets.get(name)
+    encoding = choose_encoding(asset, request.headers.get('Accept-Encoding', ''))
+    headers = {
+        'ETag': asset.etags[encoding],
+        'Cache-Control': _cache_control(),
+        'Vary': 'Accept-Encoding',
+    }
+    if etag_matches(request.headers.get('If-None-Match', ''), asset):
+        counters.inc("http.asset.not_modified")
+        return Response(status=304, headers=headers)
+    counters.inc("http.asset.sent")
+    if encoding != "identity":
+        headers['Content-Encoding'] = encoding
+    return Response(asset.bodies[encoding], mimetype=asset.mimetype, headers=headers)
+
 @app.route('/')
 def auth():
     try:
-        return send_file(f"{ASSETS_DIR}/auth.html")
+        return send_asset("auth.html")
     except FileNotFoundError:
         return "HTML file not found", 404
 
 @app.route('/dashboard')
 def dashboard():
     try:
-        return send_file(f"{ASSETS_DIR}/index.html")
+        return send_asset("index.html")
     except FileNotFoundError:
         return "HTML file not found", 404
 
 @app.route('/main.js')
 def main_js():
     try:
-        return send_file(f"{ASSETS_DIR}/main.js", mimetype='application/javascript')
+        return send_asset("main.js")
     except FileNotFoundError:
         return "JavaScript file not found", 404
 
@@ -66,13 +103,15 @@ def main_js():
 def control():
     command = request.args.get('command', '')
 
-    print(f"HTTP Command: {command}")
+    # 计数键只取已知命令，避免任意参数让计数器无限增长
+    counters.inc(f"http.control.{command}" if command in CONTROL_COMMANDS else "http.control.unknown")
+    logger.debug(f"HTTP Command: {command}")
     if command == 'start':
-        serial_io.get_stm32_io().send_command('start\n')
+        serial_io.get_stm32_io().send_command('start\n', constant=True)
     elif command == 'stop':
-        serial_io.get_stm32_io().send_command('stop\n')
+        serial_io.get_stm32_io().send_command('stop\n', constant=True)
     elif command == 'beep':
-        serial_io.get_stm32_io().send_command('beep\n')
+        serial_io.get_stm32_io().send_command('beep\n', constant=True)
 
     response = Response('OK')
     response.headers['Access-Control-Allow-Origin'] = '*'
@@ -99,7 +138,7 @@ def stream():
                 # time.sleep(0.033)  # ~30 FPS
                 
         except Exception as e:
-            print(f"Stream error: {e}")
+            log_throttled(logger, "http.stream_error", f"Stream error: {e}", level=logging.ERROR)
     
     return Response(
         generate(),
@@ -116,10 +155,11 @@ def start_http_server(host='0.0.0.0', port=8080, debug=False):
     """Start HTTP server"""
     global output, server
     output = StreamingOutput()
+    assets.load_all()
 
     # 创建可控制的服务器实例
     server = make_server(host, port, app, threaded=True)
-    print(f'HTTP Server started running on http://{host}:{port}')
+    logger.info(f'HTTP Server started running on http://{host}:{port}')
     
     # 启动服务器（阻塞调用）
     server.serve_forever()
@@ -129,11 +169,11 @@ def stop_http_server():
     global server, output
     
     if server is None:
-        print("HTTP Server is not running")
+        logger.error("HTTP Server is not running")
         return
     
     try:
-        print("正在关闭HTTP服务器...")
+        logger.info("正在关闭HTTP服务器...")
         # 关闭服务器
         server.shutdown()
         server = None
@@ -145,10 +185,12 @@ def stop_http_server():
                 output.condition.notify_all()
             output = None
         
-        print("HTTP Server已停止")
+        logger.info("HTTP Server已停止")
     except Exception as e:
-        print(f"关闭HTTP服务器时出错: {e}")
+        logger.error(f"关闭HTTP服务器时出错: {e}")
         raise
 
 if __name__ == '__main__':
+    import logutil
+    logutil.setup()
     start_http_server()
\ No newline at end of file
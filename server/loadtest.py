@@ -0,0 +1,447 @@
+"""
+服务器压测
+
+用 PtyStandIn 代替 STM32，在本机启动服务器后压测，有两种场景：
+
+move: 多个客户端高频发送 move，统计串口字节率、控制节拍延迟和 ping 往返延迟。
+      分别以"收到即转发"和"按节拍合并"两种方式各跑一遍。
+
+    python -m server.loadtest --clients 2 --rate 120 --seconds 5
+
+viewers: 控制台观看者。同时启动 HTTP 和 WebSocket 服务器，用合成画面代替摄像头跑视觉主循环
+         （赛道检测、JPEG 编码、写入 MJPEG 输出、发送串口命令），先空载测一段作为基线，
+         再打开 N 个 MJPEG / WebSocket 客户端：正常读取、慢速读取（小接收缓冲，模拟弱网）、
+         反复断开重连。统计每个客户端实际收到的帧率、服务器进程的 CPU 和内存，以及视觉主循环帧耗时的变化。
+         客户端在单独的低优先级进程中运行，尽量不占用服务器进程的 CPU。
+
+    python -m server.loadtest viewers --mjpeg 4 --slow 2 --storm 2 --ws 4 --ws-storm 2 --seconds 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+import websockets
+
+import config
+import logutil
+import serial_pi.serial_io as serial_io
+from serial_pi.standin import PtyStandIn
+from server import websocket_server
+
+
+async def _client(url: str, rate: float, seconds: float, rtts: list, counts: dict):
+    async with websockets.connect(url) as ws:
+        pending = {}
+
+        async def reader():
+            async for message in ws:
+                data = json.loads(message)
+                counts[data['type']] = counts.get(data['type'], 0) + 1
+                if data['type'] == 'pong' and data.get('id') in pending:
+                    rtts.append(time.perf_counter() - pending.pop(data['id']))
+
+        read_task = asyncio.create_task(reader())
+        interval = 1.0 / rate
+        start = time.monotonic()
+        next_send = start
+        next_ping = start
+        i = 0
+        while time.monotonic() - start < seconds:
+            now = time.monotonic()
+            if now >= next_ping:
+                pending[i] = time.perf_counter()
+                await ws.send(json.dumps({'type': 'ping', 'id': i}))
+                next_ping += 0.1
+            await ws.send(json.dumps({
+                'type': 'move', 'turn_angle': i % 60 - 30, 'left_speed': 50, 'right_speed': 50,
+            }))
+            i += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+        await ws.send(json.dumps({'type': 'stop'}))
+        await asyncio.sleep(0.3)
+        read_task.cancel()
+
+
+async def _flood(url: str, clients: int, rate: float, seconds: float):
+    rtts, counts = [], {}
+    await asyncio.gather(*(_client(url, rate, seconds, rtts, counts) for _ in range(clients)))
+    return rtts, counts
+
+
+def _wait_for_server(url: str, timeout: float = 10.0):
+    async def probe():
+        async with websockets.connect(url):
+            pass
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            asyncio.run(probe())
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run_ws(clients: int, rate: float, seconds: float, control_hz: int, ack: int, port: int = 5600) -> dict:
+    """启动服务器和替身，压测一轮并返回统计"""
+    config.WS_CONTROL_HZ = control_hz
+    config.WS_MOVE_ACK = ack
+    for key in websocket_server.control_stats:
+        websocket_server.control_stats[key] = 0
+
+    standin = PtyStandIn()
+    io = serial_io.STM32SerialIO(standin.start(), ready_timeout=0)
+    io.connect()
+    serial_io._stm32_io = io
+
+    thread = threading.Thread(target=websocket_server.start_websocket_server, args=("127.0.0.1", port), daemon=True)
+    thread.start()
+    url = f"ws://127.0.0.1:{port}"
+    _wait_for_server(url)
+
+    bytes_before = standin.bytes_received
+    start = time.monotonic()
+    rtts, counts = asyncio.run(_flood(url, clients, rate, seconds))
+    elapsed = time.monotonic() - start
+
+    websocket_server.stop_websocket_server()
+    thread.join(timeout=3.0)
+    uart_bytes = standin.bytes_received - bytes_before
+    io.disconnect()
+    standin.stop()
+    serial_io._stm32_io = None
+
+    stats = dict(websocket_server.control_stats)
+    rtt_ms = np.array(rtts) * 1000 if rtts else np.zeros(1)
+    return {
+        'uart_bytes_per_s': uart_bytes / elapsed,
+        'uart_frames': len(standin.commands),
+        'moves_received': stats['moves_received'],
+        'moves_sent': stats['moves_sent'],
+        'acks': counts.get('move_ack', 0),
+        'rtt_avg_ms': float(rtt_ms.mean()),
+        'rtt_p95_ms': float(np.percentile(rtt_ms, 95)),
+        'rtt_max_ms': float(rtt_ms.max()),
+        'tick_lag_avg_ms': stats['tick_lag_total_ms'] / stats['ticks'] if stats['ticks'] else 0.0,
+        'tick_lag_max_ms': stats['tick_lag_max_ms'],
+    }
+
+
+def _print(title: str, r: dict):
+    print(f"{title}: 串口 {r['uart_bytes_per_s']:.0f} B/s（{r['uart_frames']} 帧），"
+          f"收到 move {r['moves_received']} 条、发出 {r['moves_sent']} 条、ack {r['acks']} 条；"
+          f"ping 往返 平均 {r['rtt_avg_ms']:.2f} ms / p95 {r['rtt_p95_ms']:.2f} ms / 最长 {r['rtt_max_ms']:.2f} ms；"
+          f"节拍延迟 平均 {r['tick_lag_avg_ms']:.2f} ms / 最长 {r['tick_lag_max_ms']:.2f} ms")
+
+
+# ---- viewers 场景 ----
+
+def _vision_loop(stop: threading.Event, fps: float, frame_ms: list):
+    """合成画面的视觉主循环，与 main.py 相同的每帧工作，记录每帧耗时（不含等待下一帧的时间）"""
+    from server import http_server
+    from vision import track_line
+    w, h = config.SCREEN_WIDTH, config.SCREEN_HEIGHT
+    frame = np.zeros((h, w, 3), dtype=np.uint8)
+    interval = 1.0 / fps
+    next_frame = time.monotonic()
+    i = 0
+    while not stop.is_set():
+        start = time.monotonic()
+        # 左右摆动的两条赛道线
+        shift = int(w / 16 * math.sin(i / 15))
+        frame[:] = 40
+        cv2.line(frame, (w * 5 // 16 + shift, h), (w * 7 // 16 + shift, 100), (0, 220, 230), 10)
+        cv2.line(frame, (w * 11 // 16 + shift, h), (w * 9 // 16 + shift, 100), (0, 220, 230), 10)
+        line = track_line.handle_one_frame(frame, h)
+        success, jpeg_data = cv2.imencode('.jpeg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if success and http_server.output is not None:
+            http_server.output.write(jpeg_data.tobytes())
+        stm32_io = serial_io.get_stm32_io()
+        if stm32_io is not None and line is not None:
+            stm32_io.send_command(f"cv:{line.error},0\n")
+        frame_ms.append((time.monotonic() - start) * 1000)
+        i += 1
+        next_frame += interval
+        now = time.monotonic()
+        if next_frame < now:
+            # 处理不过来时不补帧，与摄像头丢帧一致
+            next_frame = now
+        time.sleep(next_frame - now)
+
+
+def _mjpeg_client(port: int, seconds: float, mode: str, slow_fps: float = 5.0) -> dict:
+    """
+    读取 /stream.mjpg
+
+    :param mode: normal 持续读取；slow 每秒只读 slow_fps 帧且接收缓冲很小；storm 每次连接读 3 帧后断开重连
+    """
+    result = {'kind': 'mjpeg', 'mode': mode, 'frames': 0, 'bytes': 0, 'connects': 0, 'errors': 0}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if mode == "slow":
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8192)
+        sock.settimeout(2.0)
+        try:
+            sock.connect(("127.0.0.1", port))
+            result['connects'] += 1
+            # HTTP/1.0 请求，服务器不使用分块编码
+            sock.sendall(b"GET /stream.mjpg HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n")
+            f = sock.makefile("rb")
+            while f.readline() not in (b"\r\n", b""):
+                pass
+            per_connection = 0
+            while time.monotonic() < deadline and not (mode == "storm" and per_connection >= 3):
+                header = f.readline()
+                if not header:
+                    break
+                if not header.lower().startswith(b"content-length:"):
+                    continue
+                length = int(header.split(b":", 1)[1])
+                f.readline()
+                result['bytes'] += len(f.read(length))
+                result['frames'] += 1
+                per_connection += 1
+                if mode == "slow":
+                    time.sleep(1.0 / slow_fps)
+        except OSError:
+            result['errors'] += 1
+        finally:
+            sock.close()
+    result['seconds'] = seconds
+    return result
+
+
+async def _ws_viewer(url: str, seconds: float, mode: str) -> dict:
+    """WebSocket 观看者：normal 每 0.2 s ping 一次；storm 每次连接 ping 一次后断开重连"""
+    result = {'kind': 'ws', 'mode': mode, 'frames': 0, 'connects': 0, 'errors': 0, 'rtts': []}
+    deadline = time.monotonic() + seconds
+    i = 0
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(url, open_timeout=2.0) as ws:
+                result['connects'] += 1
+                await ws.recv()
+                while time.monotonic() < deadline:
+                    sent = time.perf_counter()
+                    await ws.send(json.dumps({'type': 'ping', 'id': i}))
+                    i += 1
+                    while json.loads(await asyncio.wait_for(ws.recv(), 2.0)).get('type') != 'pong':
+                        pass
+                    result['rtts'].append(time.perf_counter() - sent)
+                    result['frames'] += 1
+                    if mode == "storm":
+                        break
+                    await asyncio.sleep(0.2)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            result['errors'] += 1
+    result['seconds'] = seconds
+    return result
+
+
+def _load_clients(http_port: int, ws_port: int, seconds: float, counts: dict, queue):
+    """客户端进程入口，结果列表放入 queue"""
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+    results = []
+    lock = threading.Lock()
+
+    def run_mjpeg(mode):
+        r = _mjpeg_client(http_port, seconds, mode)
+        with lock:
+            results.append(r)
+
+    threads = [threading.Thread(target=run_mjpeg, args=(mode,))
+               for mode in ("normal", "slow", "storm") for _ in range(counts.get(mode, 0))]
+
+    async def run_ws():
+        url = f"ws://127.0.0.1:{ws_port}"
+        modes = ["normal"] * counts.get("ws", 0) + ["storm"] * counts.get("ws_storm", 0)
+        return await asyncio.gather(*(_ws_viewer(url, seconds, mode) for mode in modes))
+
+    # 模块导入完成后才开始计时
+    queue.put("ready")
+    for thread in threads:
+        thread.start()
+    ws_results = asyncio.run(run_ws())
+    for thread in threads:
+        thread.join()
+    queue.put(results + list(ws_results))
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # 非 Linux 只能取峰值（macOS 为字节，Linux 为 KB）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _PeakSampler:
+    """每 interval 秒采样一次线程数和内存，取峰值（服务器每个 HTTP 连接一个线程，结束后线程即退出）"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.threads = 0
+        self.rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.threads = max(self.threads, threading.active_count())
+            self.rss_mb = max(self.rss_mb, _rss_mb())
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _phase_stats(frame_ms: list, elapsed: float, cpu: float, peaks: _PeakSampler) -> dict:
+    ms = np.array(frame_ms) if frame_ms else np.zeros(1)
+    return {
+        'loop_fps': len(frame_ms) / elapsed,
+        'frame_avg_ms': float(ms.mean()),
+        'frame_p95_ms': float(np.percentile(ms, 95)),
+        'frame_max_ms': float(ms.max()),
+        'cpu_percent': cpu / elapsed * 100,
+        'rss_mb': peaks.rss_mb,
+        'threads': peaks.threads,
+    }
+
+
+def run_viewers(counts: dict, seconds: float, fps: float = 30.0, http_port: int = 5680, ws_port: int = 5600) -> dict:
+    """
+    启动服务器、串口替身和合成视觉主循环，先空载运行 seconds 秒，再在客户端进程压测 seconds 秒
+
+    :param counts: 各类客户端数：normal / slow / storm（MJPEG），ws / ws_storm（WebSocket）
+    :return: {'baseline': 空载统计, 'loaded': 压测统计, 'clients': 每个客户端的结果}
+    """
+    from werkzeug.serving import make_server
+    from server import http_server
+
+    config.WS_CONTROL_HZ = 0
+    # 每个请求一行的访问日志本身就有开销，也会淹没结果
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    standin = PtyStandIn()
+    io = serial_io.STM32SerialIO(standin.start(), ready_timeout=0)
+    io.connect()
+    serial_io._stm32_io = io
+
+    http_server.output = http_server.StreamingOutput()
+    http_server.assets.load_all()
+    http_server.server = make_server("127.0.0.1", http_port, http_server.app, threaded=True)
+    http_thread = threading.Thread(target=http_server.server.serve_forever, daemon=True)
+    http_thread.start()
+    ws_thread = threading.Thread(target=websocket_server.start_websocket_server, args=("127.0.0.1", ws_port), daemon=True)
+    ws_thread.start()
+    _wait_for_server(f"ws://127.0.0.1:{ws_port}")
+
+    stop = threading.Event()
+    frame_ms = []
+    vision_thread = threading.Thread(target=_vision_loop, args=(stop, fps, frame_ms), daemon=True)
+    vision_thread.start()
+
+    phases = {}
+    clients = []
+    try:
+        # 先跑一会儿再开始统计，避开启动和首帧的开销
+        time.sleep(1.0)
+        for phase in ("baseline", "loaded"):
+            if phase == "loaded":
+                ctx = multiprocessing.get_context("spawn")
+                queue = ctx.Queue()
+                process = ctx.Process(target=_load_clients, args=(http_port, ws_port, seconds, counts, queue))
+                process.start()
+                queue.get(timeout=60)
+            frame_ms.clear()
+            peaks = _PeakSampler()
+            cpu, start = _cpu_seconds(), time.monotonic()
+            if phase == "loaded":
+                clients = queue.get(timeout=seconds + 60)
+                process.join()
+            else:
+                time.sleep(seconds)
+            elapsed = time.monotonic() - start
+            peaks.stop()
+            phases[phase] = _phase_stats(list(frame_ms), elapsed, _cpu_seconds() - cpu, peaks)
+    finally:
+        stop.set()
+        vision_thread.join(timeout=3.0)
+        http_server.stop_http_server()
+        websocket_server.stop_websocket_server()
+        ws_thread.join(timeout=3.0)
+        io.disconnect()
+        standin.stop()
+        serial_io._stm32_io = None
+    return {**phases, 'clients': clients}
+
+
+def _print_viewers(r: dict):
+    for phase, title in (("baseline", "空载"), ("loaded", "压测")):
+        p = r[phase]
+        print(f"{title}: 视觉主循环 {p['loop_fps']:.1f} fps，帧耗时 平均 {p['frame_avg_ms']:.2f} ms / "
+              f"p95 {p['frame_p95_ms']:.2f} ms / 最长 {p['frame_max_ms']:.2f} ms；"
+              f"服务器进程 CPU {p['cpu_percent']:.0f}%，内存峰值 {p['rss_mb']:.0f} MB，线程峰值 {p['threads']}")
+    groups = {}
+    for c in r['clients']:
+        groups.setdefault((c['kind'], c['mode']), []).append(c)
+    for (kind, mode), items in sorted(groups.items()):
+        rates = sorted(c['frames'] / c['seconds'] for c in items)
+        unit = "帧/s" if kind == "mjpeg" else "pong/s"
+        line = (f"  {kind:<5} {mode:<6} x{len(items)}: {unit} 最低 {rates[0]:.1f} / 中位 {rates[len(rates) // 2]:.1f} / "
+                f"最高 {rates[-1]:.1f}，连接 {sum(c['connects'] for c in items)} 次，错误 {sum(c['errors'] for c in items)} 次")
+        rtts = [t for c in items for t in c.get('rtts', [])]
+        if rtts:
+            line += f"，ping 往返 p95 {np.percentile(np.array(rtts) * 1000, 95):.2f} ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="服务器压测")
+    parser.add_argument("scenario", nargs="?", choices=("move", "viewers"), default="move")
+    parser.add_argument("--clients", type=int, default=2, help="move: 客户端数")
+    parser.add_argument("--rate", type=float, default=120, help="move: 每个客户端每秒发送的 move 数")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--hz", type=int, default=config.WS_CONTROL_HZ, help="move: 合并发送的控制频率")
+    parser.add_argument("--mjpeg", type=int, default=4, help="viewers: 正常读取的 MJPEG 客户端数")
+    parser.add_argument("--slow", type=int, default=2, help="viewers: 慢速读取的 MJPEG 客户端数")
+    parser.add_argument("--storm", type=int, default=2, help="viewers: 反复重连的 MJPEG 客户端数")
+    parser.add_argument("--ws", type=int, default=4, help="viewers: WebSocket 客户端数")
+    parser.add_argument("--ws-storm", type=int, default=2, help="viewers: 反复重连的 WebSocket 客户端数")
+    parser.add_argument("--fps", type=float, default=30, help="viewers: 合成画面帧率")
+    args = parser.parse_args()
+    logutil.setup("WARNING")
+
+    if args.scenario == "viewers":
+        counts = {'normal': args.mjpeg, 'slow': args.slow, 'storm': args.storm,
+                  'ws': args.ws, 'ws_storm': args.ws_storm}
+        _print_viewers(run_viewers(counts, args.seconds, fps=args.fps))
+        raise SystemExit
+
+    _print("收到即转发", run_ws(args.clients, args.rate, args.seconds, control_hz=0, ack=1))
+    _print(f"{args.hz} Hz 合并", run_ws(args.clients, args.rate, args.seconds, control_hz=args.hz, ack=config.WS_MOVE_ACK))
@@ -0,0 +1,190 @@
+"""
+控制台静态资源缓存
+
+auth.html / index.html / main.js 在启动时读入内存，并预先压缩（gzip，安装了 brotli 时另存 br），
+按 Accept-Encoding 返回最小的版本，带强 ETag 和 Cache-Control，If-None-Match 命中时返回 304。
+文件修改后自动重新加载：每个文件至多每 reload_interval 秒 stat 一次，请求不再读取磁盘。
+资源目录相对于本包解析，与启动时的工作目录无关。
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+
+@dataclass
+class Asset:
+    name: str
+    mimetype: str
+    mtime_ns: int
+    size: int
+    # 编码 -> 内容，"identity" 为原文，压缩后不更小的编码不保存
+    bodies: Dict[str, bytes] = field(default_factory=dict)
+    # 编码 -> ETag，同一内容的不同编码使用不同的强 ETag
+    etags: Dict[str, str] = field(default_factory=dict)
+    checked: float = 0.0
+
+
+def _compress(body: bytes) -> Dict[str, bytes]:
+    bodies = {"identity": body}
+    # mtime=0 使压缩结果只取决于内容
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(gz) < len(body):
+        bodies["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(body, quality=11)
+        if len(br) < len(body):
+            bodies["br"] = br
+    return bodies
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    """解析 Accept-Encoding，返回 编码 -> q 值"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(asset: Asset, accept_encoding: str) -> str:
+    """在客户端接受的编码中选内容最小的"""
+    accepted = _accepted(accept_encoding or "")
+    best = "identity"
+    for coding, body in asset.bodies.items():
+        if coding == "identity":
+            continue
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0 and len(body) < len(asset.bodies[best]):
+            best = coding
+    return best
+
+
+def etag_matches(if_none_match: str, asset: Asset) -> bool:
+    """If-None-Match 是否命中当前内容（任一编码的 ETag 都算命中）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in tags for etag in asset.etags.values())
+
+
+class StaticCache:
+    """按文件名缓存静态资源"""
+
+    def __init__(self, directory: str = ASSETS_DIR, files: Optional[Dict[str, str]] = None,
+                 reload_interval: float = 1.0):
+        """
+        :param directory: 资源目录
+        :param files: 文件名 -> MIME 类型
+        :param reload_interval: 检查文件是否修改的最短间隔（秒），0 为不检查
+        """
+        self.directory = directory
+        self.files = dict(files or {})
+        self.reload_interval = reload_interval
+        self._assets: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'stats': 0}
+
+    def _load(self, name: str, st: os.stat_result) -> Asset:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        asset = Asset(name, self.files[name], st.st_mtime_ns, st.st_size, _compress(body))
+        asset.etags = {coding: f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"'
+                       for coding in asset.bodies}
+        self.stats['loads'] += 1
+        return asset
+
+    def load_all(self):
+        """启动时加载全部文件，缺失的文件在请求时返回 404"""
+        for name in self.files:
+            try:
+                self.get(name)
+            except FileNotFoundError:
+                pass
+
+    def get(self, name: str) -> Asset:
+        """取缓存的资源，文件修改过则重新加载；文件不存在时抛出 FileNotFoundError"""
+        now = time.monotonic()
+        asset = self._assets.get(name)
+        if asset is not None and (not self.reload_interval or now - asset.checked < self.reload_interval):
+            return asset
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset is not None and (not self.reload_interval or now - asset.checked < self.reload_interval):
+                return asset
+            if name not in self.files:
+                raise FileNotFoundError(name)
+            self.stats['stats'] += 1
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                self._assets.pop(name, None)
+                raise
+            if asset is None or (asset.mtime_ns, asset.size) != (st.st_mtime_ns, st.st_size):
+                asset = self._load(name, st)
+            asset.checked = now
+            self._assets[name] = asset
+            return asset
+
+
+if __name__ == "__main__":
+    # 对比 send_file 与缓存：首次加载和带 If-None-Match 的刷新各传输多少字节、读取多少次磁盘
+    import builtins
+    from flask import Flask, send_file
+    from server import http_server
+
+    opens = 0
+    _open = builtins.open
+
+    def counting_open(*args, **kwargs):
+        global opens
+        opens += 1
+        return _open(*args, **kwargs)
+
+    builtins.open = counting_open
+    legacy = Flask("legacy")
+    legacy.add_url_rule("/dashboard", "dashboard", lambda: send_file(os.path.join(ASSETS_DIR, "index.html")))
+    legacy.add_url_rule("/main.js", "main_js", lambda: send_file(os.path.join(ASSETS_DIR, "main.js")))
+    http_server.assets.load_all()
+    browser = {"Accept-Encoding": "gzip, deflate, br"}
+
+    for title, app in (("send_file", legacy), ("缓存", http_server.app)):
+        client = app.test_client()
+        etags = {}
+        for phase in ("首次加载", "刷新"):
+            opens = 0
+            sent = 0
+            for path in ("/dashboard", "/main.js"):
+                headers = dict(browser)
+                if path in etags:
+                    headers["If-None-Match"] = etags[path]
+                response = client.get(path, headers=headers)
+                # send_file 以流的方式返回，读完内容才会真正读取文件
+                sent += len(response.get_data())
+                etags[path] = response.headers.get("ETag") or ""
+                response.close()
+            print(f"{title:<10}{phase}: 内容 {sent:6d} 字节，打开文件 {opens} 次")
+    builtins.open = _open
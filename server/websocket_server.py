@@ -7,24 +7,54 @@ import json
 import sys
 import os
 import threading
+import time
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import config
+import logging
 import serial_pi.serial_io as serial_io
+from logutil import log_throttled
+from vision.params import params
+
+logger = logging.getLogger(__name__)
 
 # 导入电机控制器
 try:
     from serial_pi.motor import Motor_Controller, get_motor_controller
     motor_controller = get_motor_controller()
-    print("电机控制器初始化成功")
+    logger.info("电机控制器初始化成功")
 except ImportError as e:
-    print(f"无法导入电机控制器: {e}")
+    logger.error(f"无法导入电机控制器: {e}")
     motor_controller = None
 
 # 存储连接的客户端
 connected_clients = set()
 
+class ClientControl:
+    """单个客户端的遥控状态：未发出的 move 只保留最新一条"""
+
+    def __init__(self):
+        self.latest = None          # (turn_angle, left_speed, right_speed)
+        self.coalesced = 0          # 上次发出后被覆盖的 move 数
+        self.last_move_time = 0.0
+        self.driving = False        # 发出过 move 且尚未 stop
+
+# websocket -> ClientControl
+client_controls = {}
+
+control_stats = {
+    'moves_received': 0,
+    'moves_sent': 0,
+    'moves_coalesced': 0,
+    'acks_sent': 0,
+    'deadman_stops': 0,
+    'ticks': 0,
+    'tick_lag_total_ms': 0.0,
+    'tick_lag_max_ms': 0.0,
+}
+
 # 全局变量用于控制服务器
 websocket_server = None
 server_loop = None
@@ -34,8 +64,9 @@ async def handle_client(websocket):
     """处理客户端 WebSocket 连接"""
     # 添加客户端到连接集合
     connected_clients.add(websocket)
+    control = client_controls[websocket] = ClientControl()
     client_address = websocket.remote_address
-    print(f"[WebSocket] 新客户端连接: {client_address}")
+    logger.info(f"[WebSocket] 新客户端连接: {client_address}")
     
     try:
         # 发送欢迎消息
@@ -55,20 +86,23 @@ async def handle_client(websocket):
                     turn_angle = data.get('turn_angle', 0)
                     left_speed = data.get('left_speed', 50)
                     right_speed = data.get('right_speed', 50)
+                    control_stats['moves_received'] += 1
 
-                    # 发送命令到STM32
                     stm32_io = serial_io.get_stm32_io()
                     if stm32_io and stm32_io.connected:
-                        command = f'ta:{turn_angle},lv:{left_speed},rv:{right_speed}\n'
-                        stm32_io.send_command(command)
-                        print(f"已发送电机命令: {command.strip()}")
-                        
-                        # 发送确认消息
-                        await websocket.send(json.dumps({
-                            'type': 'move_ack',
-                            'turn_angle': turn_angle,
-                            'status': 'success'
-                        }))
+                        move = (turn_angle, left_speed, right_speed)
+                        if config.WS_CONTROL_HZ > 0:
+                            # 交给控制节拍发送，未发出的旧值直接被覆盖
+                            if control.latest is not None:
+                                control.coalesced += 1
+                            control.latest = move
+                            control.last_move_time = time.monotonic()
+                        else:
+                            send_move(stm32_io, move)
+                            control.driving = True
+                            control.last_move_time = time.monotonic()
+                            if config.WS_MOVE_ACK:
+                                await send_move_ack(websocket, move, 0)
                     else:
                         await websocket.send(json.dumps({
                             'type': 'error',
@@ -77,18 +111,20 @@ async def handle_client(websocket):
                 
                 elif command_type == 'stop':
                     # 停止命令
-                    print("收到停止命令")
+                    logger.info("收到停止命令")
+                    control.latest = None
+                    control.driving = False
                     if motor_controller:
                         try:
                             stm32_io = serial_io.get_stm32_io()
                             if stm32_io and stm32_io.connected:
-                                stm32_io.send_command('stop\n')
+                                stm32_io.send_command('stop\n', constant=True)
                                 await websocket.send(json.dumps({
                                     'type': 'stop_ack',
                                     'status': 'success'
                                 }))
                         except Exception as e:
-                            print(f"发送停止命令失败: {e}")
+                            logger.error(f"发送停止命令失败: {e}")
                             await websocket.send(json.dumps({
                                 'type': 'error',
                                 'message': f'发送停止命令失败: {str(e)}'
@@ -96,23 +132,54 @@ async def handle_client(websocket):
                 
                 elif command_type == 'start':
                     # 启动命令
-                    print("收到启动命令")
+                    logger.info("收到启动命令")
                     if motor_controller:
                         try:
                             stm32_io = serial_io.get_stm32_io()
                             if stm32_io and stm32_io.connected:
-                                stm32_io.send_command('start\n')
+                                stm32_io.send_command('start\n', constant=True)
                                 await websocket.send(json.dumps({
                                     'type': 'start_ack',
                                     'status': 'success'
                                 }))
                         except Exception as e:
-                            print(f"发送启动命令失败: {e}")
+                            logger.error(f"发送启动命令失败: {e}")
                             await websocket.send(json.dumps({
                                 'type': 'error',
                                 'message': f'发送启动命令失败: {str(e)}'
                             }))
                 
+                elif command_type == 'params':
+                    # 查询运行时参数
+                    await websocket.send(json.dumps({
+                        'type': 'params',
+                        'version': params.version,
+                        'params': params.describe()
+                    }))
+
+                elif command_type == 'set_params':
+                    # 修改运行时参数，例如 {"type": "set_params", "values": {"roi_top": 120}}
+                    try:
+                        changed = params.update(data.get('values') or {})
+                    except (KeyError, ValueError, TypeError) as e:
+                        await websocket.send(json.dumps({
+                            'type': 'error',
+                            'message': f'修改参数失败: {e}'
+                        }))
+                    else:
+                        if changed:
+                            logger.info(f"参数已修改: {data.get('values')}，版本 {params.version}")
+                        await websocket.send(json.dumps({
+                            'type': 'params_ack',
+                            'version': params.version,
+                            'changed': changed,
+                            'values': params.snapshot()
+                        }))
+
+                elif command_type == 'ping':
+                    # 用于测量往返延迟
+                    await websocket.send(json.dumps({'type': 'pong', 'id': data.get('id')}))
+
                 else:
                     # 未知命令类型
                     await websocket.send(json.dumps({
@@ -126,31 +193,100 @@ async def handle_client(websocket):
                     'message': '无效的 JSON 格式'
                 }))
             except Exception as e:
-                print(f"处理消息时出错: {e}")
+                log_throttled(logger, "ws.message_error", f"处理消息时出错: {e}", level=logging.ERROR)
                 await websocket.send(json.dumps({
                     'type': 'error',
                     'message': f'处理消息失败: {str(e)}'
                 }))
     
     except websockets.exceptions.ConnectionClosed:
-        print(f"客户端断开连接: {client_address}")
+        logger.info(f"客户端断开连接: {client_address}")
     except Exception as e:
-        print(f"[WebSocket] 处理客户端 {client_address} 时发生错误: {e}")
+        logger.error(f"[WebSocket] 处理客户端 {client_address} 时发生错误: {e}")
         import traceback
         traceback.print_exc()
     finally:
         # 从连接集合中移除
         connected_clients.discard(websocket)
+        client_controls.pop(websocket, None)
+        if config.WS_DEADMAN_MS > 0 and control.driving:
+            # 遥控中的客户端断开，立即停车
+            deadman_stop(websocket, control, "disconnect")
+
+def send_move(stm32_io, move):
+    turn_angle, left_speed, right_speed = move
+    stm32_io.send_command(f'ta:{turn_angle},lv:{left_speed},rv:{right_speed}\n')
+    control_stats['moves_sent'] += 1
+
+async def send_move_ack(websocket, move, coalesced):
+    try:
+        await websocket.send(json.dumps({
+            'type': 'move_ack',
+            'turn_angle': move[0],
+            'coalesced': coalesced,
+            'status': 'success'
+        }))
+        control_stats['acks_sent'] += 1
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+def deadman_stop(websocket, control, reason: str):
+    """
+    停车并清除该客户端的遥控状态
+
+    :param reason: "timeout" 超时未收到 move，"disconnect" 遥控中断开连接
+    """
+    control.latest = None
+    control.driving = False
+    stm32_io = serial_io.get_stm32_io()
+    if stm32_io and stm32_io.connected:
+        stm32_io.send_command('stop\n', constant=True)
+    control_stats['deadman_stops'] += 1
+    if reason == "timeout":
+        logger.info(f"[WebSocket] {websocket.remote_address} 超过 {config.WS_DEADMAN_MS} ms 未收到 move，已发送 stop")
+    else:
+        logger.info(f"[WebSocket] {websocket.remote_address} 遥控中断开连接，已发送 stop")
+
+async def control_loop():
+    """固定频率的控制节拍：发出每个客户端最新的 move，并检查死人开关"""
+    # 不合并 move 时节拍只用于检查死人开关
+    interval = 1.0 / config.WS_CONTROL_HZ if config.WS_CONTROL_HZ > 0 else config.WS_DEADMAN_MS / 4000
+    next_tick = time.monotonic() + interval
+    while not shutdown_event.is_set():
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        now = time.monotonic()
+        lag_ms = (now - next_tick) * 1000
+        control_stats['ticks'] += 1
+        control_stats['tick_lag_total_ms'] += lag_ms
+        control_stats['tick_lag_max_ms'] = max(control_stats['tick_lag_max_ms'], lag_ms)
+        # 落后太多时不补发错过的节拍
+        next_tick = max(next_tick + interval, now)
+
+        stm32_io = serial_io.get_stm32_io()
+        for websocket, control in list(client_controls.items()):
+            move = control.latest
+            if move is not None:
+                control.latest = None
+                coalesced, control.coalesced = control.coalesced, 0
+                control_stats['moves_coalesced'] += coalesced
+                if stm32_io and stm32_io.connected:
+                    send_move(stm32_io, move)
+                    control.driving = True
+                    if config.WS_MOVE_ACK:
+                        await send_move_ack(websocket, move, coalesced)
+            elif (config.WS_DEADMAN_MS > 0 and control.driving
+                  and (now - control.last_move_time) * 1000 > config.WS_DEADMAN_MS):
+                deadman_stop(websocket, control, "timeout")
 
 async def main(host='0.0.0.0', port=5000):
     """启动 WebSocket 服务器"""
     global websocket_server, server_loop
     
-    print(f'WebSocket 服务器启动: ws://{host}:{port}')
+    logger.info(f'WebSocket 服务器启动: ws://{host}:{port}')
     
     # 初始化STM32串口连接
     if not serial_io.get_stm32_io():
-        print("正在初始化 STM32 串口连接...")
+        logger.info("正在初始化 STM32 串口连接...")
         serial_io.init_stm32_io()
     
     # 启动 WebSocket 服务器
@@ -158,24 +294,29 @@ async def main(host='0.0.0.0', port=5000):
         async with websockets.serve(handle_client, host, port) as server:
             websocket_server = server
             server_loop = asyncio.get_event_loop()
-            print(f"✅ WebSocket 服务器运行中，等待客户端连接...")
+            logger.info(f"✅ WebSocket 服务器运行中，等待客户端连接...")
+            control_task = None
+            if config.WS_CONTROL_HZ > 0 or config.WS_DEADMAN_MS > 0:
+                control_task = asyncio.create_task(control_loop())
             
             # 等待关闭事件
             while not shutdown_event.is_set():
                 await asyncio.sleep(0.1)
+            if control_task is not None:
+                await control_task
                 
     except OSError as e:
         if "Address already in use" in str(e):
-            print(f"错误: 端口 {port} 已被占用")
+            logger.error(f"错误: 端口 {port} 已被占用")
         else:
-            print(f"WebSocket 服务器启动失败: {e}")
+            logger.error(f"WebSocket 服务器启动失败: {e}")
         raise
     except asyncio.CancelledError:
-        print("WebSocket 服务器收到取消信号")
+        logger.info("WebSocket 服务器收到取消信号")
     finally:
         # 关闭所有客户端连接
         if connected_clients:
-            print(f"正在关闭 {len(connected_clients)} 个客户端连接...")
+            logger.info(f"正在关闭 {len(connected_clients)} 个客户端连接...")
             tasks = [client.close() for client in connected_clients.copy()]
             if tasks:
                 await asyncio.gather(*tasks, return_exceptions=True)
@@ -190,9 +331,13 @@ def start_websocket_server(host='0.0.0.0', port=5000, debug=False):
         asyncio.set_event_loop(server_loop)
         server_loop.run_until_complete(main(host, port))
     except KeyboardInterrupt:
-        print("\nWebSocket 服务器收到中断信号")
+        logger.info("WebSocket 服务器收到中断信号")
     except Exception as e:
-        print(f"WebSocket 服务器错误: {e}")
+        logger.error(f"WebSocket 服务器错误: {e}")
+
+async def _close_server(server):
+    server.close()
+    await server.wait_closed()
 
 def stop_websocket_server():
     """停止WebSocket服务器"""
@@ -200,7 +345,7 @@ def stop_websocket_server():
     if not server_loop:
         return
         
-    print("正在关闭WebSocket服务器...")
+    logger.info("正在关闭WebSocket服务器...")
     
     # 设置关闭事件
     shutdown_event.set()
@@ -209,18 +354,20 @@ def stop_websocket_server():
     if websocket_server and server_loop and not server_loop.is_closed() and server_loop.is_running():
         try:
             # 在事件循环中关闭服务器
-            future = asyncio.run_coroutine_threadsafe(websocket_server.close(), server_loop)
+            future = asyncio.run_coroutine_threadsafe(_close_server(websocket_server), server_loop)
             # 等待最多1秒
             try:
                 future.result(timeout=1.0)
             except Exception:
                 pass
         except Exception as e:
-            print(f"关闭WebSocket服务器时出错: {e}")
+            logger.error(f"关闭WebSocket服务器时出错: {e}")
     
     websocket_server = None
-    print("WebSocket服务器已关闭")
+    logger.info("WebSocket服务器已关闭")
 
 if __name__ == '__main__':
+    import logutil
+    logutil.setup()
     start_websocket_server()
 
@@ -0,0 +1,360 @@
+"""
+转向误差的延迟补偿
+
+误差在帧采集时刻测得，经过处理、串口传输和下位机控制周期后才作用到舵机，
+车速较快时下位机按过时的几何转向，容易来回摆动。预测器记录每帧的采集时间和误差，
+把误差外推到预计生效的时刻再发送：
+
+  - cv:     恒速模型，赛道变化率取相邻帧估计值的指数平均
+  - kalman: 以 [误差, 赛道变化率, 赛道曲率（变化率的导数）] 为状态的卡尔曼滤波，同时滤除检测噪声（推荐）
+
+外推时扣除已发出命令的作用（见 Predictor），需要 STEER_PLANT_GAIN：可用本模块的回放从
+STEER_PREDICT=none 时录制的运行日志估计。闭环回放中该值偏大一倍仍有改善，偏小则可能振荡，
+为 0（不扣除）时直接外推会发散，因此未设置时不启用预测。
+
+生效时刻 = 发送时刻 + 串口单程时延（有 ping 统计时取往返时延中位数的一半）+ STEER_ACTUATION_MS。
+
+评估（用运行日志中的误差作为赛道输入做闭环回放，对比各预测器的误差和摆动）:
+    python steering.py runlogs/run_xxx.rvlog
+    python steering.py            # 无日志时生成一段模拟运行
+"""
+
+import argparse
+import collections
+import logging
+import math
+from typing import Deque, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Predictor:
+    """
+    预测器基类；本类本身不做预测，原样返回测量值
+
+    测得的误差变化率中包含车辆响应已生效命令的部分，直接外推会把自己的修正再算一遍，时延较大时反而加剧摆动。
+    因此只估计和外推赛道几何引起的变化率（及其变化，即曲率），已发出但尚未生效或正在生效的命令
+    按 de/dt = 赛道变化率 - plant_gain * 命令 扣除（Smith 预估器）。
+    plant_gain 可由 estimate_plant_gain() 从运行日志估计，为 0 时退化为单纯的运动学外推（闭环中不稳定）。
+    """
+    name = "none"
+
+    def __init__(self, plant_gain: float = 0.0, max_horizon: float = 0.3, reset_gap: float = 0.5):
+        """
+        :param plant_gain: 每单位误差命令引起的误差变化率（1/秒）
+        :param max_horizon: 最长外推时间（秒），超出部分不外推
+        :param reset_gap: 两帧间隔超过该值（如丢线、暂停）时重置状态
+        """
+        self.plant_gain = plant_gain
+        self.max_horizon = max_horizon
+        self.reset_gap = reset_gap
+        self.last_time: Optional[float] = None
+        # 采集到发送的时延（秒），指数平均
+        self.latency: Optional[float] = None
+        # 已发出的命令 (生效时间, 命令)，按生效时间递增
+        self._schedule: Deque[Tuple[float, float]] = collections.deque()
+
+    def reset(self):
+        self.last_time = None
+
+    def _update(self, t: float, error: float, dt: Optional[float], applied: float):
+        """
+        :param applied: 上一帧到本帧之间生效命令的积分（命令 × 秒）
+        """
+
+    def _extrapolate(self, error: float, horizon: float, applied: float) -> float:
+        return error
+
+    def _applied(self, t0: float, t1: float) -> float:
+        """[t0, t1] 内生效命令的积分，命令在下一条生效前保持不变"""
+        total = 0.0
+        schedule = self._schedule
+        for i, (start, command) in enumerate(schedule):
+            end = schedule[i + 1][0] if i + 1 < len(schedule) else math.inf
+            lo, hi = max(start, t0), min(end, t1)
+            if hi > lo:
+                total += command * (hi - lo)
+        return total
+
+    def correct(self, capture_time: float, error: float, actuation_time: float,
+                now: Optional[float] = None) -> float:
+        """
+        加入一帧测量并返回外推到 actuation_time 的误差（即本帧应发送的命令）
+
+        :param capture_time: 帧采集时间（time.monotonic()）
+        :param error: 该帧测得的误差
+        :param actuation_time: 本帧命令预计生效的时间（time.monotonic()）
+        :param now: 当前时间，仅用于统计处理时延
+        """
+        if now is not None:
+            latency = now - capture_time
+            self.latency = latency if self.latency is None else self.latency + 0.1 * (latency - self.latency)
+        dt = None if self.last_time is None else capture_time - self.last_time
+        if dt is not None and (dt <= 0 or dt > self.reset_gap):
+            self.reset()
+            dt = None
+        applied = self._applied(self.last_time, capture_time) if dt is not None else 0.0
+        self._update(capture_time, error, dt, applied)
+        self.last_time = capture_time
+
+        horizon = min(max(actuation_time - capture_time, 0.0), self.max_horizon)
+        pending = self._applied(capture_time, capture_time + horizon)
+        command = self._extrapolate(error, horizon, pending)
+
+        # 只保留本帧采集时刻仍在生效的命令及之后的命令
+        while len(self._schedule) > 1 and self._schedule[1][0] <= capture_time:
+            self._schedule.popleft()
+        if self._schedule and actuation_time < self._schedule[-1][0]:
+            actuation_time = self._schedule[-1][0]
+        self._schedule.append((actuation_time, command))
+        return command
+
+
+class ConstantVelocityPredictor(Predictor):
+    """恒速外推：赛道变化率取相邻帧的估计值的指数平均"""
+    name = "cv"
+
+    def __init__(self, alpha: float = 0.2, **kwargs):
+        """
+        :param alpha: 变化率指数平均的系数，越小越平滑、滞后越大
+        """
+        super().__init__(**kwargs)
+        self.alpha = alpha
+        self.rate = 0.0
+        self._last_error = 0.0
+
+    def reset(self):
+        super().reset()
+        self.rate = 0.0
+
+    def _update(self, t: float, error: float, dt: Optional[float], applied: float):
+        if dt is not None:
+            road_rate = (error - self._last_error + self.plant_gain * applied) / dt
+            self.rate += self.alpha * (road_rate - self.rate)
+        self._last_error = error
+
+    def _extrapolate(self, error: float, horizon: float, applied: float) -> float:
+        return error + self.rate * horizon - self.plant_gain * applied
+
+
+class KalmanPredictor(Predictor):
+    """卡尔曼滤波，状态为 [误差, 赛道变化率, 赛道曲率（变化率的导数）]，已生效的命令作为已知输入"""
+    name = "kalman"
+
+    def __init__(self, jerk: float = 300.0, noise: float = 2.0, **kwargs):
+        """
+        :param jerk: 过程噪声，赛道曲率变化的标准差（像素/秒^3）
+        :param noise: 测量噪声标准差（像素）
+        """
+        super().__init__(**kwargs)
+        self.q = jerk ** 2
+        self.r = noise ** 2
+        self.x = np.zeros(3)
+        self.P = np.eye(3)
+
+    def reset(self):
+        super().reset()
+        self.x = np.zeros(3)
+        self.P = np.diag([self.r, 1e4, 1e6])
+
+    def _update(self, t: float, error: float, dt: Optional[float], applied: float):
+        if dt is None:
+            self.reset()
+            self.x[0] = error
+            return
+        F = np.array([[1.0, dt, dt * dt / 2], [0.0, 1.0, dt], [0.0, 0.0, 1.0]])
+        # 白噪声加加速度模型的离散过程噪声
+        Q = self.q * np.array([
+            [dt ** 5 / 20, dt ** 4 / 8, dt ** 3 / 6],
+            [dt ** 4 / 8, dt ** 3 / 3, dt ** 2 / 2],
+            [dt ** 3 / 6, dt ** 2 / 2, dt],
+        ])
+        x = F @ self.x
+        x[0] -= self.plant_gain * applied
+        P = F @ self.P @ F.T + Q
+        # 只测量误差，H = [1, 0, 0]
+        s = P[0, 0] + self.r
+        k = P[:, 0] / s
+        self.x = x + k * (error - x[0])
+        self.P = P - np.outer(k, P[0, :])
+
+    def _extrapolate(self, error: float, horizon: float, applied: float) -> float:
+        e, rate, curvature = self.x
+        return float(e + rate * horizon + curvature * horizon * horizon / 2 - self.plant_gain * applied)
+
+
+PREDICTORS = {cls.name: cls for cls in (Predictor, ConstantVelocityPredictor, KalmanPredictor)}
+
+
+def create(name: str, **kwargs) -> Predictor:
+    if name not in PREDICTORS:
+        raise ValueError(f"未知预测器: {name}，可用: {', '.join(PREDICTORS)}")
+    return PREDICTORS[name](**kwargs)
+
+
+def actuation_delay(stats: Optional[dict], actuation_ms: float) -> float:
+    """发送后到生效的时延（秒）：串口单程（往返时延中位数的一半）+ 下位机控制周期"""
+    serial_ms = 0.0
+    if stats and stats.get('rtt_p50_ms') is not None:
+        serial_ms = stats['rtt_p50_ms'] / 2
+    return (serial_ms + actuation_ms) / 1000
+
+
+def from_config() -> Optional[Predictor]:
+    """STEER_PREDICT 为 none 或未设置 STEER_PLANT_GAIN 时返回 None，主循环直接发送测量值"""
+    import config
+    if config.STEER_PREDICT == "none":
+        return None
+    if config.STEER_PLANT_GAIN <= 0:
+        logger.warning("未设置 STEER_PLANT_GAIN，不启用转向预测（可用 python steering.py <运行日志> 估计）")
+        return None
+    return create(config.STEER_PREDICT, plant_gain=config.STEER_PLANT_GAIN,
+                  max_horizon=config.STEER_MAX_HORIZON_MS / 1000)
+
+
+def estimate_plant_gain(times: np.ndarray, errors: np.ndarray, commands: np.ndarray,
+                        delay: float, block: float = 0.5) -> float:
+    """
+    从运行记录粗略估计 plant_gain
+
+    按 de/dt = 赛道变化率 - plant_gain * 生效中的命令 回归：赛道变化率在 block 秒内近似线性，
+    每段内从误差变化率和命令中去掉线性趋势后合并做最小二乘。命令中含检测噪声，直接回归会偏小，
+    用前一帧的命令作为工具变量。估计值偏大比偏小安全（见模块说明），结果仅供设置 STEER_PLANT_GAIN 参考。
+
+    :param commands: 每帧发送的命令（未补偿时即测得的误差）
+    :param delay: 采集到命令生效的总时延（秒）
+    """
+    mids = (times[:-1] + times[1:]) / 2
+    rates = np.diff(errors) / np.diff(times)
+    # 区间中点时生效的是 delay 之前最近一帧的命令
+    index = np.searchsorted(times, mids - delay, side="right") - 1
+    valid = index >= 1
+    mids, rates = mids[valid], rates[valid]
+    applied, instrument = commands[index[valid]], commands[index[valid] - 1]
+    blocks = ((mids - mids[0]) // block).astype(int)
+    numerator = denominator = 0.0
+    for b in np.unique(blocks):
+        m = blocks == b
+        if np.count_nonzero(m) < 5:
+            continue
+        x = mids[m] - mids[m].mean()
+        basis = np.vstack([np.ones_like(x), x]).T
+
+        def detrend(y):
+            return y - basis @ np.linalg.lstsq(basis, y, rcond=None)[0]
+
+        z = detrend(instrument[m])
+        numerator += float(np.dot(detrend(rates[m]), z))
+        denominator += float(np.dot(detrend(applied[m]), z))
+    return max(0.0, -numerator / denominator) if denominator else 0.0
+
+
+def simulate(times: np.ndarray, road: np.ndarray, predictor: Predictor, gain: float,
+             latency: float, actuation: float, noise: np.ndarray, step: float = 0.001) -> dict:
+    """
+    闭环回放
+
+    被控对象为带时延的积分环节：de/dt = 赛道输入的变化率 - gain * 生效中的误差命令。
+    每帧在采集时刻测量 e + noise，经过 latency 发送，再经过 actuation 生效。
+
+    :param times: 帧采集时间
+    :param road: 每帧的赛道输入（取自日志中的误差，代表赛道几何引起的偏移）
+    :param noise: 每帧的测量噪声
+    """
+    road_rate = np.gradient(road, times)
+    n_steps = int((times[-1] - times[0]) / step)
+    # 按生效时间排序的 (生效时间, 命令)
+    pending = []
+    command = 0.0
+    e = 0.0
+    frame = 0
+    errors = np.empty(n_steps)
+    measurements = []
+    commands = []
+    predictor.reset()
+    for i in range(n_steps):
+        t = times[0] + i * step
+        while frame < len(times) and times[frame] <= t:
+            measured = e + noise[frame]
+            effective = times[frame] + latency + actuation
+            predicted = predictor.correct(times[frame], measured, effective)
+            measurements.append(measured)
+            pending.append((effective, predicted))
+            commands.append(predicted)
+            frame += 1
+        while pending and pending[0][0] <= t:
+            command = pending.pop(0)[1]
+        rate_index = min(frame, len(times) - 1)
+        e += (road_rate[rate_index] - gain * command) * step
+        errors[i] = e
+    commands = np.array(commands)
+    duration = times[-1] - times[0]
+    signs = np.sign(commands[np.abs(commands) > 1.0])
+    return {
+        'rms_error': float(np.sqrt(np.mean(errors ** 2))),
+        'max_error': float(np.abs(errors).max()),
+        # 命令换向次数，来回摆动时显著增多
+        'reversals_per_s': float(np.count_nonzero(np.diff(signs)) / duration) if len(signs) > 1 else 0.0,
+        'command_std': float(commands.std()),
+        'measurements': np.array(measurements),
+        'commands': commands,
+    }
+
+
+def synthetic_run(seconds: float = 60.0, fps: float = 30.0, seed: int = 0):
+    """模拟一段运行：S 弯赛道输入加检测噪声，采集间隔有抖动"""
+    rng = np.random.default_rng(seed)
+    intervals = 1 / fps + rng.normal(0, 0.004, int(seconds * fps))
+    times = np.cumsum(np.clip(intervals, 0.01, None))
+    road = 60 * np.sin(2 * math.pi * times / 6) + 25 * np.sin(2 * math.pi * times / 2.3)
+    return times, road + rng.normal(0, 2.0, len(times))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="转向延迟补偿闭环回放")
+    parser.add_argument("path", nargs="?", help="运行日志（runlog），省略时使用模拟运行")
+    parser.add_argument("--latency", type=float, default=None,
+                        help="采集到发送的时延（毫秒），默认取日志的平均帧间隔")
+    parser.add_argument("--actuation", type=float, default=20.0, help="发送到生效的时延（毫秒）")
+    parser.add_argument("--loop", type=float, default=1.0,
+                        help="环路增益 × 总时延（弧度），越接近 pi/2 越容易振荡")
+    args = parser.parse_args()
+
+    if args.path:
+        import runlog
+        records = runlog.load(args.path)
+        times = records['timestamp'].astype(np.float64)
+        errors = records['error'].astype(np.float64)
+        print(f"日志 {args.path}: {len(records)} 帧")
+        # 实车的 plant_gain 用日志中实际发送的命令估计（cv:<误差>,<信号>）
+        sent = np.array([float(c.split(b":", 1)[1].split(b",", 1)[0]) for c in records['command']])
+        delay = (args.latency if args.latency is not None else 0.0) / 1000 + args.actuation / 1000
+        print(f"按日志估计 STEER_PLANT_GAIN={estimate_plant_gain(times, errors, sent, delay):.1f}")
+    else:
+        times, errors = synthetic_run()
+        print(f"模拟运行: {len(times)} 帧")
+
+    # 日志中的误差 = 赛道输入的平滑部分 + 检测噪声（与 5 帧滑动平均的残差）
+    kernel = np.ones(5) / 5
+    road = np.convolve(errors, kernel, mode="same")
+    noise = errors - road
+    latency = (args.latency / 1000) if args.latency is not None else float(np.mean(np.diff(times)))
+    actuation = args.actuation / 1000
+    gain = args.loop / (latency + actuation + float(np.mean(np.diff(times))) / 2)
+    print(f"处理时延 {latency * 1000:.1f} ms，生效时延 {actuation * 1000:.1f} ms，环路增益 {gain:.1f} /s")
+
+    # 与实车一样不直接使用 gain，而是从未补偿的运行记录中估计
+    baseline = simulate(times, road, create("none"), gain, latency, actuation, noise)
+    n = len(baseline['commands'])
+    plant_gain = estimate_plant_gain(times[:n], baseline['measurements'], baseline['commands'], latency + actuation)
+    print(f"估计 plant_gain {plant_gain:.1f} /s")
+
+    for name in PREDICTORS:
+        r = simulate(times, road, create(name, plant_gain=plant_gain), gain, latency, actuation, noise)
+        print(f"{name:<8} 误差 RMS {r['rms_error']:6.2f} px，最大 {r['max_error']:6.2f} px，"
+              f"命令换向 {r['reversals_per_s']:5.2f} 次/s，命令标准差 {r['command_std']:6.2f}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,149 @@
+"""
+鸟瞰图（逆透视变换）
+
+标定一次得到透视变换，预先计算 cv2.remap 所需的映射表并缓存到磁盘，
+每帧只对 ROI 区域做一次低分辨率的 remap，使中线和误差在地面坐标下测量。
+
+缓存文件名带有标定点和输出尺寸的摘要，不同标定各占一个文件；只有启动时创建的第一个变换会写盘，
+运行中通过 set_params 修改 roi_top 引起的重建只保留在内存中，不在帧循环里写文件。
+"""
+
+import hashlib
+import logging
+import os
+import cv2
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_src_points(text: str, width: int, height: int, roi_top: int) -> np.ndarray:
+    """
+    解析标定点，顺序与 get_roi 一致：左下 右下 右上 左上
+
+    :param text: "x1,y1,x2,y2,x3,y3,x4,y4"，为空时按 ROI 取一个默认梯形
+    """
+    if text:
+        values = [float(v) for v in text.split(",")]
+        if len(values) != 8:
+            raise ValueError(f"BIRDSEYE_SRC 需要 8 个数值，实际为 {len(values)}")
+        return np.array(values, dtype=np.float32).reshape(4, 2)
+    return np.array([
+        [0, height],
+        [width, height],
+        [width * 0.75, roi_top],
+        [width * 0.25, roi_top],
+    ], dtype=np.float32)
+
+
+class BirdseyeWarp:
+    """缓存映射表的鸟瞰变换"""
+
+    def __init__(self, src_points: np.ndarray, out_size: tuple[int, int], cache_path: str = "", save: bool = True):
+        """
+        :param src_points: 原图中的四个标定点（左下 右下 右上 左上）
+        :param out_size: 鸟瞰图尺寸 (宽, 高)
+        :param cache_path: 映射表缓存文件，实际文件名在扩展名前加上摘要；为空则不持久化
+        :param save: 缓存不存在时是否写盘，为 False 时只读取已有的缓存
+        """
+        self.src_points = np.asarray(src_points, dtype=np.float32)
+        self.out_size = out_size
+        self.save = save
+        self.loaded_from_cache = False
+        key = self._cache_key()
+        if cache_path:
+            root, ext = os.path.splitext(cache_path)
+            cache_path = f"{root}_{key[:12]}{ext}"
+        self.cache_path = cache_path
+        # 鸟瞰图坐标 -> 原图坐标，用于把结果画回原图
+        self.ground_to_frame = cv2.getPerspectiveTransform(self._dst_points(), self.src_points)
+        self.map1, self.map2 = self._load_or_build(key)
+
+    def _cache_key(self) -> str:
+        h = hashlib.sha1()
+        h.update(self.src_points.tobytes())
+        h.update(np.array(self.out_size, dtype=np.int32).tobytes())
+        h.update(cv2.__version__.encode())
+        return h.hexdigest()
+
+    def _dst_points(self) -> np.ndarray:
+        out_w, out_h = self.out_size
+        return np.array([
+            [0, out_h - 1],
+            [out_w - 1, out_h - 1],
+            [out_w - 1, 0],
+            [0, 0],
+        ], dtype=np.float32)
+
+    def _build_maps(self):
+        out_w, out_h = self.out_size
+        grid_x, grid_y = np.meshgrid(np.arange(out_w, dtype=np.float32), np.arange(out_h, dtype=np.float32))
+        grid = np.stack([grid_x, grid_y], axis=-1).reshape(-1, 1, 2)
+        mapped = cv2.perspectiveTransform(grid, self.ground_to_frame).reshape(out_h, out_w, 2)
+        # 定点格式的映射表 remap 速度更快
+        return cv2.convertMaps(mapped[..., 0], mapped[..., 1], cv2.CV_16SC2)
+
+    def _load_or_build(self, key: str):
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with np.load(self.cache_path) as cache:
+                    if str(cache["key"]) == key:
+                        self.loaded_from_cache = True
+                        return cache["map1"], cache["map2"]
+            except Exception as e:
+                logger.warning(f"读取鸟瞰映射表缓存失败: {e}")
+
+        map1, map2 = self._build_maps()
+        if self.cache_path and self.save:
+            try:
+                np.savez(self.cache_path, key=key, map1=map1, map2=map2)
+            except OSError as e:
+                logger.warning(f"保存鸟瞰映射表缓存失败: {e}")
+        return map1, map2
+
+    def warp(self, image, dst=None):
+        """将原图（或其 HSV 等同尺寸图像）变换到鸟瞰图"""
+        return cv2.remap(image, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst)
+
+    def to_frame(self, points: np.ndarray) -> np.ndarray:
+        """把鸟瞰图中的点 (N, 2) 变换回原图坐标"""
+        if len(points) == 0:
+            return points
+        mapped = cv2.perspectiveTransform(points.reshape(-1, 1, 2).astype(np.float32), self.ground_to_frame)
+        return mapped.reshape(-1, 2).astype(np.int32)
+
+    def scale_x(self, frame_width: int) -> float:
+        """鸟瞰图横向像素到原图宽度的比例，用于把误差换算回原有量纲"""
+        return frame_width / self.out_size[0]
+
+
+_warps: dict = {}
+
+
+def get_birdseye(width: int, height: int, roi_top: int) -> BirdseyeWarp:
+    """
+    按分辨率和 roi_top 获取（并缓存）鸟瞰变换
+
+    只有第一个变换（启动时）会写映射表缓存，之后运行中的重建只读取已有缓存。
+    """
+    key = (width, height, roi_top)
+    warp = _warps.get(key)
+    if warp is None:
+        src = parse_src_points(config.BIRDSEYE_SRC, width, height, roi_top)
+        out_size = (max(1, int(width * config.BIRDSEYE_SCALE)), max(1, int((height - roi_top) * config.BIRDSEYE_SCALE)))
+        warp = BirdseyeWarp(src, out_size, config.BIRDSEYE_MAP_CACHE, save=not _warps)
+        _warps[key] = warp
+    return warp
+
+
+if __name__ == "__main__":
+    import time
+
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    warp = BirdseyeWarp(parse_src_points("", 640, 480, 100), (320, 190))
+    out = np.empty((190, 320, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    for _ in range(1000):
+        warp.warp(frame, dst=out)
+    print(f"remap: {(time.perf_counter() - start):.3f} ms/帧")
@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-from collections import deque
 
 class CurveDetector:
     def __init__(self, window=5, smooth_len=10):
@@ -9,7 +8,11 @@ class CurveDetector:
         :param smooth_len: 平滑历史长度（越大越稳但响应慢）
         """
         self.window = window
-        self.curv_hist = deque(maxlen=smooth_len)
+        # 固定长度环形缓冲区，维护滑动和，避免每帧重新求平均
+        self.curv_hist = np.zeros(smooth_len, dtype=np.float64)
+        self._hist_idx = 0
+        self._hist_count = 0
+        self._hist_sum = 0.0
 
     @staticmethod
     def curvature_three_points(p1, p2, p3):
@@ -24,28 +27,55 @@ class CurveDetector:
             return 0
         return 4 * area / (a * b * c)
 
+    @staticmethod
+    def curvature_batch(p1, p2, p3):
+        """
+        批量三点求曲率
+
+        :param p1, p2, p3: (N, 2) 数组
+        :return: (曲率数组, 叉积数组)，叉积 > 0 为左弯
+        """
+        d12 = p2 - p1
+        d23 = p3 - p2
+        d31 = p1 - p3
+        # 叉积的绝对值为三角形面积的两倍，与海伦公式等价但只需一次运算
+        cross = d12[:, 0] * d23[:, 1] - d12[:, 1] * d23[:, 0]
+        abc = np.hypot(d12[:, 0], d12[:, 1]) * np.hypot(d23[:, 0], d23[:, 1]) * np.hypot(d31[:, 0], d31[:, 1])
+        kappa = np.zeros_like(abc)
+        np.divide(2 * np.abs(cross), abc, out=kappa, where=abc != 0)
+        return kappa, cross
+
+    def _push_hist(self, value):
+        """写入环形缓冲区并返回平滑后的曲率"""
+        if not np.isfinite(value):
+            # NaN/inf 会一直留在滑动和里，丢弃该帧，沿用当前的平滑值
+            return self._hist_sum / self._hist_count if self._hist_count else 0.0
+        size = self.curv_hist.shape[0]
+        if self._hist_count == size:
+            self._hist_sum -= self.curv_hist[self._hist_idx]
+        else:
+            self._hist_count += 1
+        self.curv_hist[self._hist_idx] = value
+        self._hist_sum += value
+        self._hist_idx = (self._hist_idx + 1) % size
+        return self._hist_sum / self._hist_count
+
     def calc_curve(self, edge_points):
         """计算平均曲率和方向"""
-        curvatures = []
-        directions = []
         w = self.window
-        n = len(edge_points)
+        pts = np.asarray(edge_points, dtype=np.float64).reshape(-1, 2)
+        n = len(pts)
         if n < w + 1:
             return 0, "straight"
 
-        for i in range(0, n - w, w):
-            p1, p2, p3 = edge_points[i], edge_points[i + w // 2], edge_points[i + w]
-            kappa = self.curvature_three_points(p1, p2, p3)
-            # 判断方向：用向量叉积
-            cross = np.cross(p2 - p1, p3 - p2)
-            direction = "left" if cross > 0 else "right"
-            curvatures.append(kappa)
-            directions.append(direction)
+        # 与逐点循环相同的采样：i, i + w//2, i + w，i 以 w 为步长
+        idx = np.arange(0, n - w, w)
+        kappa, cross = self.curvature_batch(pts[idx], pts[idx + w // 2], pts[idx + w])
 
-        mean_curv = np.mean(curvatures)
-        mean_dir = max(set(directions), key=directions.count)
-        self.curv_hist.append(mean_curv)
-        smooth_curv = np.mean(self.curv_hist)
+        mean_curv = kappa.mean()
+        # 判断方向：叉积符号投票
+        mean_dir = "left" if np.count_nonzero(cross > 0) * 2 > len(cross) else "right"
+        smooth_curv = self._push_hist(mean_curv)
         return smooth_curv, mean_dir
 
     def visualize(self, frame, edge_points, curvature, direction):
@@ -0,0 +1,203 @@
+"""
+检测器插件
+
+每个检测器实现 setup() / process(ctx) / teardown()，通过 @register 注册名称，
+由 DETECTORS 配置启用，无需修改主循环。DetectorRunner 负责计时和限频，
+可选交给 DetectorExecutor 在线程池中并发执行。
+"""
+
+import importlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+import config
+from logutil import log_throttled
+
+logger = logging.getLogger(__name__)
+
+_REGISTRY: Dict[str, type] = {}
+
+# 内置检测器所在模块，首次创建检测器时导入完成注册
+_PLUGIN_MODULES = ["vision.face_detection_cv"]
+
+
+def register(name: str):
+    """类装饰器：以 name 注册检测器"""
+    def wrap(cls):
+        cls.name = name
+        _REGISTRY[name] = cls
+        return cls
+    return wrap
+
+
+@dataclass
+class FrameContext:
+    """一帧的输入，检测器之间共享，不应被修改"""
+    frame: np.ndarray           # 摄像头原始帧
+    small: np.ndarray           # 缩放到 SCREEN_WIDTH x SCREEN_HEIGHT 的帧
+    index: int = 0
+    capture_time: float = 0.0
+    _gray: Dict[float, np.ndarray] = field(default_factory=dict, repr=False)
+
+    def gray(self, scale: float = 1.0) -> np.ndarray:
+        """缩放后的灰度图，同一帧内按比例缓存"""
+        img = self._gray.get(scale)
+        if img is None:
+            src = self.frame
+            if scale != 1.0:
+                src = cv2.resize(src, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            img = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+            self._gray[scale] = img
+        return img
+
+
+class Detector:
+    """检测器基类"""
+    name = ""
+
+    def setup(self):
+        """启动时调用一次"""
+
+    def process(self, ctx: FrameContext) -> Any:
+        raise NotImplementedError
+
+    def teardown(self):
+        """退出时调用一次"""
+
+
+@register("track_line")
+class TrackLineDetector(Detector):
+    def process(self, ctx: FrameContext):
+        from vision import track_line
+        line = track_line.handle_one_frame(ctx.small, ctx.small.shape[0])
+        line.capture_time = ctx.capture_time
+        return line
+
+
+@register("lights")
+class LightDetector(Detector):
+    def process(self, ctx: FrameContext):
+        from vision import light_detect
+        return light_detect.handle_lights(ctx.frame)
+
+
+def available() -> List[str]:
+    for module in _PLUGIN_MODULES:
+        importlib.import_module(module)
+    return sorted(_REGISTRY)
+
+
+def create(name: str) -> Detector:
+    if name not in _REGISTRY:
+        available()
+    if name not in _REGISTRY:
+        raise ValueError(f"未知检测器: {name}，可用: {', '.join(available())}")
+    return _REGISTRY[name]()
+
+
+def parse_rates(text: str) -> Dict[str, float]:
+    """解析 "face=5,lights=15"（单位 Hz）"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        rates[name.strip()] = float(value)
+    return rates
+
+
+class DetectorRunner:
+    """按配置创建检测器，每帧运行并计时、限频"""
+
+    def __init__(self, names: List[str], rates: Optional[Dict[str, float]] = None, executor=None):
+        """
+        :param names: 启用的检测器名称
+        :param rates: 检测器名称 -> 最高运行频率（Hz），未列出的每帧运行
+        :param executor: DetectorExecutor，为 None 时按顺序运行
+        """
+        rates = rates or {}
+        self.detectors = [create(name) for name in names]
+        self.intervals = {d.name: 1.0 / rates[d.name] for d in self.detectors if rates.get(d.name)}
+        self.executor = executor
+        self.last_results: Dict[str, Any] = {}
+        # 检测器名称 -> 上一次结果所属帧的 FrameContext.index
+        self._produced: Dict[str, int] = {}
+        # 检测器名称 -> 本次 run() 返回结果的帧龄，0 为本帧的结果；限频跳过或未按时完成时大于 0
+        self.ages: Dict[str, int] = {}
+        self._last_run: Dict[str, float] = {}
+        self.stats = {d.name: {'runs': 0, 'skipped': 0, 'last_ms': 0.0, 'total_ms': 0.0, 'max_ms': 0.0}
+                      for d in self.detectors}
+        for detector in self.detectors:
+            detector.setup()
+            if executor is not None:
+                executor.register(detector.name, lambda ctx, d=detector: self._call(d, ctx))
+
+    def _call(self, detector: Detector, ctx: FrameContext) -> Tuple[Any, Optional[int]]:
+        """运行或跳过一个检测器，返回 (结果, 结果所属帧的 index)"""
+        name = detector.name
+        stats = self.stats[name]
+        interval = self.intervals.get(name)
+        now = time.monotonic()
+        if interval and now - self._last_run.get(name, -interval) < interval:
+            stats['skipped'] += 1
+            return self.last_results.get(name), self._produced.get(name)
+        self._last_run[name] = now
+
+        start = time.perf_counter()
+        result = detector.process(ctx)
+        elapsed = (time.perf_counter() - start) * 1000
+        stats['runs'] += 1
+        stats['last_ms'] = elapsed
+        stats['total_ms'] += elapsed
+        stats['max_ms'] = max(stats['max_ms'], elapsed)
+        self.last_results[name] = result
+        self._produced[name] = ctx.index
+        return result, ctx.index
+
+    def run(self, ctx: FrameContext) -> Dict[str, Any]:
+        """运行所有检测器，返回 名称 -> 结果；各结果是否属于本帧见 ages"""
+        if self.executor is not None:
+            tagged = self.executor.run(ctx)
+        else:
+            tagged = {}
+            for detector in self.detectors:
+                try:
+                    tagged[detector.name] = self._call(detector, ctx)
+                except Exception as e:
+                    log_throttled(logger, f"detector.{detector.name}", f"检测器 {detector.name} 执行失败: {e}",
+                                  level=logging.ERROR)
+                    tagged[detector.name] = (self.last_results.get(detector.name), self._produced.get(detector.name))
+        results = {}
+        self.ages = {}
+        for name, item in tagged.items():
+            results[name], produced = item if item is not None else (None, None)
+            if produced is not None:
+                self.ages[name] = ctx.index - produced
+        return results
+
+    def report(self) -> str:
+        lines = []
+        for name, s in self.stats.items():
+            avg = s['total_ms'] / s['runs'] if s['runs'] else 0.0
+            lines.append(f"{name}: 运行 {s['runs']} 次, 限频跳过 {s['skipped']} 次, "
+                         f"平均 {avg:.2f} ms, 最长 {s['max_ms']:.2f} ms")
+        return "\n".join(lines)
+
+    def teardown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        for detector in self.detectors:
+            try:
+                detector.teardown()
+            except Exception as e:
+                logger.error(f"检测器 {detector.name} 清理失败: {e}")
+
+
+def from_config() -> DetectorRunner:
+    names = [name.strip() for name in config.DETECTORS.split(",") if name.strip()]
+    executor = None
+    if config.PARALLEL_DETECTORS:
+        from vision.executor import DetectorExecutor
+        executor = DetectorExecutor(deadline=config.DETECTOR_DEADLINE_MS / 1000)
+    return DetectorRunner(names, parse_rates(config.DETECTOR_RATES), executor)
@@ -0,0 +1,109 @@
+"""
+帧内并行执行检测器
+
+同一帧上相互独立的检测器（赛道线、红绿灯……）在线程池中并发运行，
+OpenCV 和 NumPy 的主要运算会释放 GIL，因此单帧耗时接近最慢的检测器而不是各检测器之和。
+超过截止时间仍未完成的检测器使用其上一次的结果，ages 记录每个结果是几次 run() 之前提交的帧上得到的。
+"""
+
+import concurrent.futures
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+from logutil import log_throttled
+
+logger = logging.getLogger(__name__)
+
+
+class DetectorExecutor:
+    """检测器线程池执行器"""
+
+    def __init__(self, deadline: float = 0.05, max_workers: Optional[int] = None):
+        """
+        :param deadline: 每帧等待检测器完成的最长时间（秒）
+        :param max_workers: 线程数，默认与检测器数量相同
+        """
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self._detectors: Dict[str, Callable[..., Any]] = {}
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # 上一帧未完成的任务，未完成前不会再次提交同一检测器，避免状态被并发修改
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self.last_results: Dict[str, Any] = {}
+        # 检测器名称 -> 当前结果的帧龄（0 为本次 run() 的帧，1 为上一次……），从未完成过的检测器不在其中
+        self.ages: Dict[str, int] = {}
+        self._runs = 0
+        # 检测器名称 -> 正在执行 / 已得到结果的任务提交时的 run() 序号
+        self._submitted: Dict[str, int] = {}
+        self._result_runs: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def register(self, name: str, detector: Callable[..., Any]):
+        """注册检测器，run() 的参数会原样传给每个检测器"""
+        self._detectors[name] = detector
+        self.stats[name] = {'runs': 0, 'missed': 0, 'errors': 0, 'last_ms': 0.0}
+
+    def _timed(self, name: str, detector: Callable[..., Any], args, kwargs):
+        start = time.perf_counter()
+        try:
+            return detector(*args, **kwargs)
+        finally:
+            self.stats[name]['last_ms'] = (time.perf_counter() - start) * 1000
+
+    def run(self, *args, **kwargs) -> Dict[str, Any]:
+        """
+        并发运行所有检测器并等待至截止时间
+
+        调用方需保证传入的帧在本次调用期间不被修改。
+
+        Returns:
+            检测器名称 -> 结果；未按时完成的检测器为其上一次的结果（从未完成过则为 None），
+            是否为本帧的结果见 ages
+        """
+        self._runs += 1
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers or max(len(self._detectors), 1),
+                thread_name_prefix="detector",
+            )
+
+        futures = {}
+        still_running = {}
+        for name, detector in self._detectors.items():
+            pending = self._pending.get(name)
+            if pending is not None:
+                if not pending.done():
+                    still_running[name] = pending
+                    continue
+                # 上一帧超时但之后完成的结果
+                self._collect(name, pending)
+            futures[name] = self._pool.submit(self._timed, name, detector, args, kwargs)
+            self._submitted[name] = self._runs
+            self.stats[name]['runs'] += 1
+
+        concurrent.futures.wait(futures.values(), timeout=self.deadline)
+
+        self._pending = still_running
+        for name, future in futures.items():
+            if future.done():
+                self._collect(name, future)
+            else:
+                self._pending[name] = future
+        for name in self._pending:
+            self.stats[name]['missed'] += 1
+
+        self.ages = {name: self._runs - run for name, run in self._result_runs.items()}
+        return dict(self.last_results)
+
+    def _collect(self, name: str, future: concurrent.futures.Future):
+        try:
+            self.last_results[name] = future.result()
+            self._result_runs[name] = self._submitted[name]
+        except Exception as e:
+            self.stats[name]['errors'] += 1
+            log_throttled(logger, f"detector.{name}", f"检测器 {name} 执行失败: {e}", level=logging.ERROR)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,44 +1,186 @@
 import cv2
 # from picamera2 import Picamera2
 import time
+from dataclasses import dataclass, field
+import numpy as np
+import config
+from vision.detectors import Detector, FrameContext, register
 
-# Load the Haar cascade classifier for face detection
-face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-
-# Configure and start the camera
-# picam2 = Picamera2()
-# picam2.configure(picam2.create_preview_configuration(main={"format": 'XRGB8888', "size": (640, 480)}))
-# picam2.start()
-
-print("Camera warming up...")
-time.sleep(2.0)
-
-cap = cv2.VideoCapture(1)
-
-try:
-    while True:
-        # Capture frame from the camera
-        # im = picam2.capture_array()
-        ret, im = cap.read()
-        if not ret:
-            break
-        
-        # Convert to grayscale for the classifier
-        grey = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        faces = face_detector.detectMultiScale(grey, 1.1, 5)
-        
-        # Draw rectangles around detected faces
-        for (x, y, w, h) in faces:
-            cv2.rectangle(im, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            
-        # Display the output
-        cv2.imshow("Camera", im)
-        
-        # Break the loop if 'q' is pressed
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-finally:
-    cv2.destroyAllWindows()
-    # picam2.stop()
\ No newline at end of file
+CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+
+@dataclass
+class FaceResult:
+    """人脸检测结果，框为原始帧坐标 (x, y, w, h)"""
+    boxes: np.ndarray = field(default_factory=lambda: np.empty((0, 4), dtype=np.int32))
+
+
+@register("face")
+class FaceDetector(Detector):
+    """
+    在缩小的灰度图上运行 Haar 级联人脸检测
+
+    每 detect_interval 次调用做一次完整检测，其余帧只在上次位置附近做模板匹配跟踪；
+    min_size/max_size 限制级联检测的尺度金字塔范围。
+    """
+
+    def __init__(self, scale: float = config.FACE_SCALE, scale_factor: float = 1.1, min_neighbors: int = 5,
+                 detect_interval: int = config.FACE_DETECT_INTERVAL, min_size: int = config.FACE_MIN_SIZE,
+                 max_size: int = config.FACE_MAX_SIZE, search_margin: float = 0.5, match_threshold: float = 0.6):
+        """
+        :param scale: 检测前的缩放比例
+        :param detect_interval: 每隔多少次调用做一次完整的级联检测，1 表示每次都检测
+        :param min_size: 最小人脸边长（原始帧像素），0 表示不限制
+        :param max_size: 最大人脸边长（原始帧像素），0 表示不限制
+        :param search_margin: 跟踪时搜索区域相对人脸尺寸向外扩展的比例
+        :param match_threshold: 模板匹配的最低相关系数，低于则丢弃该人脸
+        """
+        self.scale = scale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.detect_interval = max(1, detect_interval)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.search_margin = search_margin
+        self.match_threshold = match_threshold
+        self.face_detector = None
+        self._calls = 0
+        # 缩小后坐标系下的人脸框和模板
+        self._boxes: list = []
+        self._templates: list = []
+
+    def setup(self):
+        # Load the Haar cascade classifier for face detection
+        self.face_detector = cv2.CascadeClassifier(CASCADE_PATH)
+
+    def _size_limit(self, size: int):
+        if not size:
+            return (0, 0)
+        side = max(1, int(size * self.scale))
+        return (side, side)
+
+    def _detect(self, grey: np.ndarray):
+        faces = self.face_detector.detectMultiScale(
+            grey, self.scale_factor, self.min_neighbors,
+            minSize=self._size_limit(self.min_size), maxSize=self._size_limit(self.max_size))
+        self._boxes = [tuple(int(v) for v in face) for face in faces]
+        self._templates = [grey[y:y + h, x:x + w].copy() for x, y, w, h in self._boxes]
+
+    def _track(self, grey: np.ndarray):
+        """在上次位置附近做模板匹配"""
+        height, width = grey.shape[:2]
+        boxes, templates = [], []
+        for (x, y, w, h), template in zip(self._boxes, self._templates):
+            mx, my = int(w * self.search_margin), int(h * self.search_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            region = grey[y0:y1, x0:x1]
+            if region.shape[0] < h or region.shape[1] < w:
+                continue
+            scores = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+            _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+            if best < self.match_threshold:
+                continue
+            boxes.append((x0 + bx, y0 + by, w, h))
+            templates.append(template)
+        self._boxes, self._templates = boxes, templates
+
+    def process(self, ctx: FrameContext) -> FaceResult:
+        grey = ctx.gray(self.scale)
+        if self._calls % self.detect_interval == 0:
+            self._detect(grey)
+            self._calls = 0
+        elif self._boxes:
+            self._track(grey)
+        self._calls += 1
+        if not self._boxes:
+            return FaceResult()
+        return FaceResult((np.asarray(self._boxes) / self.scale).astype(np.int32))
+
+
+def benchmark(video_path: str, limit: int = 0):
+    """在录像上对比原脚本（全分辨率逐帧检测）与 FaceDetector 的帧率"""
+    def frames():
+        cap = cv2.VideoCapture(video_path)
+        count = 0
+        try:
+            while not limit or count < limit:
+                ret, im = cap.read()
+                if not ret:
+                    break
+                count += 1
+                yield im
+        finally:
+            cap.release()
+
+    baseline = cv2.CascadeClassifier(CASCADE_PATH)
+    start = time.perf_counter()
+    n = 0
+    for im in frames():
+        baseline.detectMultiScale(cv2.cvtColor(im, cv2.COLOR_BGR2GRAY), 1.1, 5)
+        n += 1
+    base_fps = n / (time.perf_counter() - start)
+
+    detector = FaceDetector()
+    detector.setup()
+    start = time.perf_counter()
+    n = 0
+    for im in frames():
+        detector.process(FrameContext(im, im, n))
+        n += 1
+    fast_fps = n / (time.perf_counter() - start)
+    print(f"{n} 帧: 原脚本 {base_fps:.1f} fps, FaceDetector {fast_fps:.1f} fps "
+          f"(scale={detector.scale}, interval={detector.detect_interval}, "
+          f"size={detector.min_size}-{detector.max_size})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="人脸检测")
+    parser.add_argument("--bench", metavar="VIDEO", help="在录像上对比帧率")
+    parser.add_argument("--limit", type=int, default=0, help="最多处理的帧数")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench, args.limit)
+        raise SystemExit(0)
+
+    face_detector = cv2.CascadeClassifier(CASCADE_PATH)
+
+    # Configure and start the camera
+    # picam2 = Picamera2()
+    # picam2.configure(picam2.create_preview_configuration(main={"format": 'XRGB8888', "size": (640, 480)}))
+    # picam2.start()
+
+    print("Camera warming up...")
+    time.sleep(2.0)
+
+    cap = cv2.VideoCapture(1)
+
+    try:
+        while True:
+            # Capture frame from the camera
+            # im = picam2.capture_array()
+            ret, im = cap.read()
+            if not ret:
+                break
+
+            # Convert to grayscale for the classifier
+            grey = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+
+            # Detect faces
+            faces = face_detector.detectMultiScale(grey, 1.1, 5)
+
+            # Draw rectangles around detected faces
+            for (x, y, w, h) in faces:
+                cv2.rectangle(im, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+            # Display the output
+            cv2.imshow("Camera", im)
+
+            # Break the loop if 'q' is pressed
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        cv2.destroyAllWindows()
+        # picam2.stop()
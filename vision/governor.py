@@ -0,0 +1,232 @@
+"""
+赛道检测的分辨率调节
+
+赛道检测默认在图像金字塔的第 PYRAMID_LEVEL 层（边长缩小 2^层数）上运行。
+ResolutionGovernor 根据检测耗时（指数平均）和 CPU 温度在 [PYRAMID_LEVEL, PYRAMID_MAX_LEVEL] 之间调整层级：
+耗时超过目标或温度达到软阈值时换到更粗的一层，温度达到硬阈值时直接用最粗的一层，
+耗时和温度都回落后再逐层恢复。树莓派升温降频时每帧耗时随之下降，控制命令的频率保持不变。
+
+温度从 sysfs 读取（毫摄氏度），测试时把 CPU_TEMP_PATH 指向普通文件即可，见 TempFileStandIn。
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def read_cpu_temp(path: str) -> Optional[float]:
+    """读取温度（摄氏度），文件不存在或内容无效时返回 None"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+class ResolutionGovernor:
+    """按帧耗时和 CPU 温度选择金字塔层级"""
+
+    def __init__(self, base_level: int = 1, max_level: int = 2, target_ms: float = 20.0,
+                 temp_path: str = "", temp_soft: float = 70.0, temp_hard: float = 80.0,
+                 temp_hysteresis: float = 5.0, hold: float = 2.0, temp_interval: float = 1.0,
+                 alpha: float = 0.1):
+        """
+        :param base_level: 默认层级（负载正常时使用）
+        :param max_level: 最粗的层级
+        :param target_ms: 每帧检测耗时目标
+        :param temp_path: 温度文件，为空则只按耗时调节
+        :param temp_soft: 达到该温度时至少粗一层
+        :param temp_hard: 达到该温度时使用最粗的一层
+        :param temp_hysteresis: 温度需回落到阈值以下多少度才解除
+        :param hold: 两次切换层级之间的最短间隔（秒），避免来回抖动
+        :param temp_interval: 读取温度的间隔（秒）
+        :param alpha: 耗时指数平均的系数
+        """
+        self.base_level = base_level
+        self.max_level = max(max_level, base_level)
+        self.target_ms = target_ms
+        self.temp_path = temp_path
+        self.temp_soft = temp_soft
+        self.temp_hard = temp_hard
+        self.temp_hysteresis = temp_hysteresis
+        self.hold = hold
+        self.temp_interval = temp_interval
+        self.alpha = alpha
+
+        self.level = base_level
+        self.frame_ms: Optional[float] = None
+        self._samples = 0
+        # 相邻两层的耗时比（细一层 / 粗一层），换到粗一层后实测得到，用于估计恢复后的耗时
+        self._ratios: Dict[int, float] = {}
+        self._left_ms: Optional[float] = None
+        self.temp: Optional[float] = None
+        # 温度要求的最低层级，温度回落超过滞回量后才下调
+        self._temp_floor = base_level
+        self._last_change = -hold
+        self._last_temp_read = -temp_interval
+        self._lock = threading.Lock()
+        self.stats = {'coarser': 0, 'finer': 0, 'thermal': 0}
+
+    def _read_temp(self, now: float):
+        if not self.temp_path or now - self._last_temp_read < self.temp_interval:
+            return
+        self._last_temp_read = now
+        self.temp = read_cpu_temp(self.temp_path)
+        if self.temp is None:
+            self._temp_floor = self.base_level
+            return
+        soft_level = min(self.base_level + 1, self.max_level)
+        held = self._temp_floor
+        if self.temp >= self.temp_hard or (held == self.max_level and self.temp >= self.temp_hard - self.temp_hysteresis):
+            self._temp_floor = self.max_level
+        elif self.temp >= self.temp_soft or (held > self.base_level and self.temp >= self.temp_soft - self.temp_hysteresis):
+            self._temp_floor = soft_level
+        else:
+            self._temp_floor = self.base_level
+
+    def record(self, frame_ms: float, now: Optional[float] = None) -> int:
+        """记录一帧的检测耗时，返回下一帧使用的层级"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.frame_ms is None:
+                self.frame_ms = frame_ms
+            else:
+                self.frame_ms += self.alpha * (frame_ms - self.frame_ms)
+            self._samples += 1
+            if self._left_ms is not None and self._samples >= 1 / self.alpha:
+                self._ratios[self.level - 1] = self._left_ms / self.frame_ms
+                self._left_ms = None
+            self._read_temp(now)
+
+            level = self.level
+            if level < self._temp_floor:
+                # 过热立即切换，不等待 hold
+                level = self._temp_floor
+                self.stats['thermal'] += 1
+            elif now - self._last_change >= self.hold:
+                if self.frame_ms > self.target_ms and level < self.max_level:
+                    level += 1
+                    self.stats['coarser'] += 1
+                elif level > max(self.base_level, self._temp_floor) \
+                        and self.frame_ms * self._ratios.get(level - 1, 4.0) < self.target_ms * 0.8:
+                    # 估计细一层的耗时（未实测时按像素数取 4 倍）仍在目标以内才恢复
+                    level -= 1
+                    self.stats['finer'] += 1
+            if level != self.level:
+                logger.info(f"赛道检测层级 {self.level} -> {level}（耗时 {self.frame_ms:.1f} ms，"
+                            f"温度 {self.temp if self.temp is not None else '-'}）")
+                # 逐层变粗时记下当前耗时，在新层级上平均稳定后得到两层的耗时比
+                self._left_ms = self.frame_ms if level == self.level + 1 else None
+                self.level = level
+                self._last_change = now
+                # 换层后耗时会突变，重新开始平均
+                self.frame_ms = None
+                self._samples = 0
+            return self.level
+
+
+class TempFileStandIn:
+    """用普通文件代替 sysfs 温度文件，set() 写入摄氏度"""
+
+    def __init__(self, temp: float = 45.0):
+        fd, self.path = tempfile.mkstemp(prefix="cpu_temp_")
+        os.close(fd)
+        self.set(temp)
+
+    def set(self, temp: float):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{int(temp * 1000)}\n")
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+_governor: Optional[ResolutionGovernor] = None
+
+
+def get_governor() -> ResolutionGovernor:
+    global _governor
+    if _governor is None:
+        _governor = ResolutionGovernor(
+            base_level=config.PYRAMID_LEVEL,
+            max_level=config.PYRAMID_MAX_LEVEL if config.GOVERNOR_ON else config.PYRAMID_LEVEL,
+            target_ms=config.GOVERNOR_TARGET_MS,
+            temp_path=config.CPU_TEMP_PATH if config.GOVERNOR_ON else "",
+            temp_soft=config.CPU_TEMP_SOFT,
+            temp_hard=config.CPU_TEMP_HARD,
+        )
+    return _governor
+
+
+if __name__ == "__main__":
+    # 模拟升温降频：先实测各层级的单帧检测耗时，再按温度曲线和降频倍数推演，
+    # 对比固定使用第 0 层与调节器的控制频率（每帧一条命令，上限为摄像头帧率）
+    import argparse
+    import cv2
+    import numpy as np
+    from vision import track_line
+
+    parser = argparse.ArgumentParser(description="分辨率调节器模拟")
+    parser.add_argument("--slowdown", type=float, default=5.0, help="本机到树莓派的耗时倍数")
+    parser.add_argument("--fps", type=float, default=30.0, help="摄像头帧率")
+    args = parser.parse_args()
+
+    w, h = config.SCREEN_WIDTH, config.SCREEN_HEIGHT
+    frame = np.zeros((h, w, 3), dtype=np.uint8)
+    cv2.line(frame, (w * 5 // 16, h), (w * 7 // 16, 100), (0, 220, 230), 10)
+    cv2.line(frame, (w * 11 // 16, h), (w * 9 // 16, 100), (0, 220, 230), 10)
+    costs = {}
+    for level in range(config.PYRAMID_MAX_LEVEL + 1):
+        track_line.handle_one_frame(frame, h, level=level)
+        start = time.perf_counter()
+        for _ in range(50):
+            track_line.handle_one_frame(frame, h, level=level)
+        costs[level] = (time.perf_counter() - start) / 50 * 1000 * args.slowdown
+    print("各层级单帧耗时（已乘倍数）: " + ", ".join(f"第 {k} 层 {v:.1f} ms" for k, v in costs.items()))
+
+    def throttle(temp: float) -> float:
+        # 树莓派 4：80°C 起降频到约 2/3，85°C 起降到约 2/5
+        return 2.5 if temp >= 85 else 1.5 if temp >= 80 else 1.0
+
+    def temperature(t: float) -> float:
+        # 前 60 s 从 50°C 升到 88°C，之后 60 s 回落到 58°C
+        return 50 + 38 * t / 60 if t < 60 else max(50.0, 88 - 30 * (t - 60) / 60)
+
+    standin = TempFileStandIn(temperature(0))
+    budget = 1000 / args.fps
+    try:
+        for title, governed in (("固定第 0 层", False), ("调节器", True)):
+            governor = ResolutionGovernor(base_level=0 if not governed else config.PYRAMID_LEVEL,
+                                          max_level=config.PYRAMID_MAX_LEVEL if governed else 0,
+                                          target_ms=budget * 0.8, temp_path=standin.path if governed else "",
+                                          temp_soft=config.CPU_TEMP_SOFT, temp_hard=config.CPU_TEMP_HARD,
+                                          temp_interval=0.0)
+            print(title)
+            now = 0.0
+            window_start, frames, levels = 0.0, 0, []
+            while now < 140:
+                temp = temperature(now)
+                standin.set(temp)
+                cost = costs[governor.level] * throttle(temp)
+                levels.append(governor.level)
+                governor.record(cost, now=now)
+                now += max(cost, budget) / 1000
+                frames += 1
+                if now - window_start >= 20:
+                    print(f"  {window_start:5.0f}-{now:3.0f} s  {temp:4.1f}°C  控制频率 {frames / (now - window_start):5.1f} Hz  "
+                          f"平均层级 {np.mean(levels):.2f}")
+                    window_start, frames, levels = now, 0, []
+            print(f"  切换统计: {governor.stats}")
+    finally:
+        standin.remove()
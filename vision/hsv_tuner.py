@@ -0,0 +1,307 @@
+"""
+黄色赛道 HSV 阈值离线调参
+
+输入录像和少量人工标注的中线，在进程池中搜索六个 HSV 上下界和模糊核大小，
+输出代价最小的参数。标注文件为 JSON 列表，坐标为 SCREEN_WIDTH x SCREEN_HEIGHT 下的像素：
+
+    [{"video": "recordings/run_0001.mp4", "frame": 120, "points": [[320, 479], [300, 200], [310, 100]]}, ...]
+
+points 是中线折线（从下往上），按行插值；代价为每个标注行上检测中点与标注中点的平均水平距离，
+未检测到的行按 1/4 图宽计。金字塔层级上只扫描部分行，只比较被扫描到的标注行。
+
+候选参数通过与车上相同的 track_line.handle_one_frame 在 PYRAMID_LEVEL 层上评估（提取方式、跟踪、
+逐行补检都与运行时一致），同一录像的标注帧按帧号顺序处理，每段录像开始时重置跟踪状态。
+
+模糊后的 HSV 只取决于模糊核和层级，每个（模糊核大小, 层级）只用 track_line.level_hsv 计算一次，
+层级为 PYRAMID_LEVEL 和回退、补检用的第 0 层；缩放后的帧和这些 HSV 以 .npy 写入缓存目录，
+工作进程以内存映射方式打开，每个候选参数只重新做阈值、闭运算、边缘提取和中线扫描。
+
+    python -m vision.hsv_tuner labels.json --samples 256 --refine 6
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+import config
+from vision import track_line
+from vision.params import params
+
+# 候选参数：(h_lower, h_upper, s_lower, s_upper, v_lower, v_upper, blur)
+Candidate = Tuple[int, int, int, int, int, int, int]
+
+BLUR_SIZES = (1, 3, 5, 7, 9, 11)
+_RANGES = ((0, 179), (0, 179), (0, 255), (0, 255), (0, 255), (0, 255))
+
+
+def load_labels(path: str, width: int, height: int) -> List[dict]:
+    """读取标注，把中线折线插值为每行的 x（未标注的行为 NaN）"""
+    with open(path) as f:
+        items = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    labels = []
+    for item in items:
+        pts = np.asarray(item['points'], dtype=np.float64)
+        pts = pts[np.argsort(pts[:, 1])]
+        rows = np.arange(height, dtype=np.float64)
+        xs = np.interp(rows, pts[:, 1], pts[:, 0], left=np.nan, right=np.nan)
+        video = item['video'] if os.path.isabs(item['video']) else os.path.join(base, item['video'])
+        labels.append({'video': video, 'frame': int(item['frame']), 'xs': xs})
+    return labels
+
+
+def read_frames(labels: Sequence[dict], size: Tuple[int, int]) -> np.ndarray:
+    """按标注读取并缩放帧，同一录像顺序读取一次"""
+    frames = np.empty((len(labels), size[1], size[0], 3), dtype=np.uint8)
+    by_video: Dict[str, List[int]] = {}
+    for i, label in enumerate(labels):
+        by_video.setdefault(label['video'], []).append(i)
+    for video, indices in by_video.items():
+        wanted = {labels[i]['frame']: i for i in indices}
+        cap = cv2.VideoCapture(video)
+        index = 0
+        try:
+            while wanted:
+                ret, frame = cap.read()
+                if not ret:
+                    raise ValueError(f"{video} 只有 {index} 帧，缺少标注的帧 {sorted(wanted)}")
+                i = wanted.pop(index, None)
+                if i is not None:
+                    frames[i] = cv2.resize(frame, size)
+                index += 1
+        finally:
+            cap.release()
+    return frames
+
+
+def _cache_key(labels: Sequence[dict], size) -> str:
+    h = hashlib.sha1()
+    for label in labels:
+        st = os.stat(label['video'])
+        h.update(f"{label['video']}|{st.st_size}|{st.st_mtime_ns}|{label['frame']}".encode())
+    h.update(f"{size}".encode())
+    return h.hexdigest()[:16]
+
+
+def cache_levels() -> Tuple[int, ...]:
+    """需要缓存 HSV 的层级：PYRAMID_LEVEL，以及整帧回退和逐行补检用的第 0 层"""
+    return tuple(sorted({config.PYRAMID_LEVEL, 0}))
+
+
+def _write_npy(path: str, shape: tuple, fill):
+    """先写临时文件再改名，中断时不会留下不完整的缓存"""
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=shape)
+    fill(out)
+    out.flush()
+    del out
+    os.replace(tmp, path)
+
+
+def build_cache(labels: Sequence[dict], size: Tuple[int, int], cache_dir: str,
+                blur_sizes: Sequence[int] = BLUR_SIZES,
+                levels: Optional[Sequence[int]] = None) -> Tuple[str, Dict[Tuple[int, int], str]]:
+    """
+    生成缩放后标注帧和各（模糊核大小, 层级）HSV 的缓存（已存在则复用）
+
+    Returns:
+        (帧的 .npy 路径, (模糊核大小, 层级) -> HSV 的 .npy 路径)
+    """
+    levels = cache_levels() if levels is None else levels
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _cache_key(labels, size)
+    frames_path = os.path.join(cache_dir, f"frames_{key}.npy")
+    hsv_paths = {(blur, level): os.path.join(cache_dir, f"hsv_{key}_b{blur}_l{level}.npy")
+                 for blur in blur_sizes for level in levels}
+
+    if os.path.exists(frames_path):
+        frames = np.load(frames_path, mmap_mode="r")
+    else:
+        frames = read_frames(labels, size)
+        _write_npy(frames_path, frames.shape, lambda out: out.__setitem__(slice(None), frames))
+
+    for (blur, level), path in hsv_paths.items():
+        if os.path.exists(path):
+            continue
+        scale = 1 << level
+        shape = (len(frames), size[1] // scale, size[0] // scale, 3)
+
+        def fill(out, blur=blur, level=level):
+            for i, frame in enumerate(frames):
+                out[i] = track_line.level_hsv(np.asarray(frame), level, blur)
+
+        _write_npy(path, shape, fill)
+    return frames_path, hsv_paths
+
+
+def sequences(labels: Sequence[dict]) -> List[List[int]]:
+    """按录像分组的标注下标，组内按帧号排序"""
+    by_video: Dict[str, List[int]] = {}
+    for i, label in enumerate(labels):
+        by_video.setdefault(label['video'], []).append(i)
+    return [sorted(indices, key=lambda i: labels[i]['frame']) for indices in by_video.values()]
+
+
+# 工作进程内的状态，由 _init_worker 设置
+_frames: Optional[np.ndarray] = None
+_hsv: Dict[Tuple[int, int], np.ndarray] = {}
+_label_xs: Optional[np.ndarray] = None
+_sequences: List[List[int]] = []
+
+
+def _init_worker(frames_path: str, hsv_paths: Dict[Tuple[int, int], str], label_xs: np.ndarray,
+                 seqs: List[List[int]]):
+    global _frames, _label_xs, _sequences
+    # 只读内存映射，各进程共享页缓存；帧只在没有缓存的层级（如鸟瞰图）才会被读到
+    _frames = np.load(frames_path, mmap_mode="r")
+    for key, path in hsv_paths.items():
+        _hsv[key] = np.load(path, mmap_mode="r")
+    _label_xs = label_xs
+    _sequences = seqs
+
+
+def frame_cost(line: track_line.LineResult, label_xs: np.ndarray, width: int) -> float:
+    """检测中线与标注中线在该层级扫描到的标注行上的平均水平距离"""
+    detected = np.full(len(label_xs), np.nan)
+    points = np.round(line.mid_points).astype(int) if line.mid_points is not None else np.empty((0, 2), int)
+    inside = (points[:, 1] >= 0) & (points[:, 1] < len(label_xs))
+    detected[points[inside, 1]] = points[inside, 0]
+    # 第 level 层的第 y 行对应原图的第 y * scale + (scale - 1) // 2 行
+    scale = 1 << line.level
+    scanned = np.arange(len(label_xs)) % scale == (scale - 1) // 2
+    rows = ~np.isnan(label_xs) & scanned
+    diff = np.abs(detected[rows] - label_xs[rows])
+    diff[np.isnan(diff)] = width / 4
+    return float(diff.mean()) if len(diff) else 0.0
+
+
+def candidate_params(candidate: Candidate) -> Dict[str, int]:
+    h_lo, h_hi, s_lo, s_hi, v_lo, v_hi, blur = candidate
+    return {'yellow_h_lower': h_lo, 'yellow_h_upper': h_hi, 'yellow_s_lower': s_lo, 'yellow_s_upper': s_hi,
+            'yellow_v_lower': v_lo, 'yellow_v_upper': v_hi, 'blur_ksize': blur}
+
+
+def evaluate(candidate: Candidate) -> float:
+    """候选参数在所有标注帧上的平均代价"""
+    # 参数只写入本进程的参数表
+    params.update(candidate_params(candidate))
+    blur = candidate[6]
+    levels = [level for b, level in _hsv if b == blur]
+    height, width = _frames.shape[1:3]
+    costs = []
+    for seq in _sequences:
+        track_line.reset_trackers()
+        for i in seq:
+            hsv = {level: np.asarray(_hsv[(blur, level)][i]) for level in levels}
+            line = track_line.handle_one_frame(np.asarray(_frames[i]), height, level=config.PYRAMID_LEVEL, hsv=hsv)
+            costs.append(frame_cost(line, _label_xs[i], width))
+    return float(np.mean(costs))
+
+
+def current_candidate() -> Candidate:
+    return (params["yellow_h_lower"], params["yellow_h_upper"], params["yellow_s_lower"],
+            params["yellow_s_upper"], params["yellow_v_lower"], params["yellow_v_upper"],
+            min(BLUR_SIZES, key=lambda b: abs(b - (params["blur_ksize"] | 1))))
+
+
+def _random_candidate(rng: random.Random) -> Candidate:
+    bounds = []
+    for lo, hi in _RANGES[0::2]:
+        a, b = sorted(rng.randint(lo, hi) for _ in range(2))
+        bounds += [a, b]
+    return tuple(bounds) + (rng.choice(BLUR_SIZES),)
+
+
+def _neighbors(candidate: Candidate, steps: Sequence[int]) -> List[Candidate]:
+    out = []
+    for dim, step in enumerate(steps[:6]):
+        for sign in (-1, 1):
+            c = list(candidate)
+            lo, hi = _RANGES[dim]
+            c[dim] = int(np.clip(c[dim] + sign * step, lo, hi))
+            # 保持下界不大于上界
+            pair = dim - dim % 2
+            if c[pair] <= c[pair + 1]:
+                out.append(tuple(c))
+    i = BLUR_SIZES.index(candidate[6])
+    for j in (i - 1, i + 1):
+        if 0 <= j < len(BLUR_SIZES):
+            out.append(candidate[:6] + (BLUR_SIZES[j],))
+    return [c for c in dict.fromkeys(out) if c != candidate]
+
+
+def tune(labels_path: str, samples: int = 256, refine: int = 6, workers: Optional[int] = None,
+         cache_dir: str = "hsv_cache", seed: int = 0) -> Tuple[Candidate, float, float]:
+    """
+    随机采样后做坐标方向的局部搜索
+
+    Returns:
+        (最优参数, 最优代价, 当前参数的代价)
+    """
+    size = (config.SCREEN_WIDTH, config.SCREEN_HEIGHT)
+    labels = load_labels(labels_path, *size)
+    start = time.perf_counter()
+    frames_path, hsv_paths = build_cache(labels, size, cache_dir)
+    print(f"HSV 缓存: {len(labels)} 帧 x {len(BLUR_SIZES)} 种模糊核 x 层级 {cache_levels()}，"
+          f"{time.perf_counter() - start:.1f} s")
+
+    label_xs = np.stack([label['xs'] for label in labels])
+    rng = random.Random(seed)
+    baseline = current_candidate()
+    evaluated: Dict[Candidate, float] = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                                initializer=_init_worker, initargs=(frames_path, hsv_paths, label_xs, sequences(labels))) as pool:
+        def run(candidates: Sequence[Candidate]):
+            todo = [c for c in dict.fromkeys(candidates) if c not in evaluated]
+            chunk = max(1, len(todo) // ((workers or os.cpu_count() or 1) * 4))
+            for c, cost in zip(todo, pool.map(evaluate, todo, chunksize=chunk)):
+                evaluated[c] = cost
+
+        start = time.perf_counter()
+        run([baseline] + [_random_candidate(rng) for _ in range(samples)])
+        best = min(evaluated, key=evaluated.get)
+        print(f"随机采样 {len(evaluated)} 组，{time.perf_counter() - start:.1f} s，当前最优代价 {evaluated[best]:.2f}")
+
+        steps = [16, 16, 32, 32, 32, 32]
+        for round_ in range(refine):
+            start = time.perf_counter()
+            run(_neighbors(best, steps))
+            new_best = min(evaluated, key=evaluated.get)
+            if new_best == best:
+                steps = [max(1, s // 2) for s in steps]
+            best = new_best
+            print(f"局部搜索第 {round_ + 1} 轮，{time.perf_counter() - start:.1f} s，"
+                  f"代价 {evaluated[best]:.2f}，步长 {steps}")
+
+    return best, evaluated[best], evaluated[baseline]
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="黄色赛道 HSV 阈值离线调参")
+    parser.add_argument("labels", help="标注 JSON 文件")
+    parser.add_argument("--samples", type=int, default=256, help="随机采样的候选数")
+    parser.add_argument("--refine", type=int, default=6, help="局部搜索轮数")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于 CPU 核数")
+    parser.add_argument("--cache-dir", default="hsv_cache")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    best, cost, baseline_cost = tune(args.labels, args.samples, args.refine, args.workers, args.cache_dir, args.seed)
+    h_lo, h_hi, s_lo, s_hi, v_lo, v_hi, blur = best
+    print(f"评估层级 PYRAMID_LEVEL={config.PYRAMID_LEVEL}，提取方式 LINE_EXTRACTOR={config.LINE_EXTRACTOR}")
+    print(f"\n当前参数代价 {baseline_cost:.2f} px，最优代价 {cost:.2f} px")
+    print(f"YELLOW_HSV_LOWER={h_lo},{s_lo},{v_lo}")
+    print(f"YELLOW_HSV_UPPER={h_hi},{s_hi},{v_hi}")
+    print(f"BLUR_KSIZE={blur}")
+    print(json.dumps({'type': 'set_params', 'values': candidate_params(best)}))
+
+
+if __name__ == "__main__":
+    _main()
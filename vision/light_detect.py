@@ -1,208 +1,217 @@
 import cv2
 import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
+from vision.params import Derived, params
+from vision.workspace import get_workspace
 
-# Global variables
-isFirstDetectedR = True
-isFirstDetectedG = True
-lastTrackBoxR = None
-lastTrackBoxG = None
-lastTrackNumR = 0
-lastTrackNumG = 0
+# We temporarily disable red light detection
+RED_LIGHT_ON = False
 
-def isIntersected(r1, r2):
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """
-    确定两个矩形区域是否相交
-    """
-    minX = max(r1[0], r2[0])
-    minY = max(r1[1], r2[1])
-    maxX = min(r1[0] + r1[2], r2[0] + r2[2])
-    maxY = min(r1[1] + r1[3], r2[1] + r2[3])
-    
-    if minX < maxX and minY < maxY:
-        return True
-    else:
-        return False
+    计算两组矩形 (x, y, w, h) 两两之间的交并比
 
-def processImgR(src, frame):
+    Returns:
+        形状为 (len(a), len(b)) 的数组
     """
-    处理红色图像
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    inter_w = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    inter_h = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    inter = inter_w * inter_h
+    union = (a[:, 2:3] * a[:, 3:4]) + (b[:, 2] * b[:, 3]) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+class TrafficLightTracker:
     """
-    global isFirstDetectedR, lastTrackBoxR, lastTrackNumR
-    
-    tmp = src.copy()
-    contours, hierarchy = cv2.findContours(tmp, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-    
-    result = None
-    resultNum = 0
-    area = 0
-    
-    if len(contours) > 0:
-        trackBox = [None] * len(contours)
-        result = [None] * len(contours)
-        
-        # 确定要跟踪的区域
-        for i in range(len(contours)):
-            # 获取凸包的点集
-            hull = cv2.convexHull(contours[i])
-            # 获取边界矩形
-            x, y, w, h = cv2.boundingRect(hull)
-            trackBox[i] = (x, y, w, h)
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
-            cv2.putText(frame, f"Red: {w}x{h}", (x, y-10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-        
-        if isFirstDetectedR:
-            lastTrackBoxR = trackBox.copy()
-            lastTrackNumR = len(contours)
-            isFirstDetectedR = False
-        else:
-            for i in range(len(contours)):
-                for j in range(lastTrackNumR):
-                    if isIntersected(trackBox[i], lastTrackBoxR[j]):
-                        result[resultNum] = trackBox[i]
-                        resultNum += 1
-                        break
-            
-            lastTrackBoxR = trackBox.copy()
-            lastTrackNumR = len(contours)
-    else:
-        isFirstDetectedR = True
-        result = None
-    
-    if result is not None:
-        for i in range(resultNum):
-            if result[i] is not None:
-                area += result[i][2] * result[i][3]  # width * height
-    
-    return area
+    单一颜色的红绿灯多目标跟踪
 
-def processImgG(src, frame):
-    """
-    处理绿色图像
+    每帧用连通域统计得到候选框并按面积过滤，与已有轨迹按交并比贪心匹配。
+    累计命中 min_hits 帧的轨迹才被确认，连续丢失超过 max_misses 帧的轨迹被删除。
     """
-    global isFirstDetectedG, lastTrackBoxG, lastTrackNumG
-    
-    tmp = src.copy()
-    contours, hierarchy = cv2.findContours(tmp, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-    
-    result = None
-    resultNum = 0
-    area = 0
-    
-    if len(contours) > 0:
-        trackBox = [None] * len(contours)
-        result = [None] * len(contours)
-        
-        # 确定要跟踪的区域
-        for i in range(len(contours)):
-            # 获取凸包的点集
-            hull = cv2.convexHull(contours[i])
-            # 获取边界矩形
-            x, y, w, h = cv2.boundingRect(hull)
-            trackBox[i] = (x, y, w, h)
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(frame, f"Green: {w}x{h}", (x, y-10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        if isFirstDetectedG:
-            lastTrackBoxG = trackBox.copy()
-            lastTrackNumG = len(contours)
-            isFirstDetectedG = False
-        else:
-            for i in range(len(contours)):
-                for j in range(lastTrackNumG):
-                    if isIntersected(trackBox[i], lastTrackBoxG[j]):
-                        result[resultNum] = trackBox[i]
-                        resultNum += 1
-                        break
-            
-            lastTrackBoxG = trackBox.copy()
-            lastTrackNumG = len(contours)
-    else:
-        isFirstDetectedG = True
-        result = None
-    
-    if result is not None:
-        for i in range(resultNum):
-            if result[i] is not None:
-                area += result[i][2] * result[i][3]  # width * height
-    
-    return area
-
-def handle_lights(frame: cv2.Mat) -> cv2.Mat:
-    global isFirstDetectedR, isFirstDetectedG, lastTrackBoxR, lastTrackBoxG, lastTrackNumR, lastTrackNumG
-    
-    redCount = 0
-    greenCount = 0
 
+    def __init__(self, iou_threshold: float = 0.1, min_hits: int = 2, max_misses: int = 2, min_area: int = 250):
+        """
+        :param iou_threshold: 匹配所需的最小交并比
+        :param min_hits: 确认轨迹所需的命中帧数
+        :param max_misses: 允许的最大连续丢失帧数
+        :param min_area: 候选连通域的最小像素面积（15x15 膨胀后的单个噪点为 225）
+        """
+        self.iou_threshold = iou_threshold
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.min_area = min_area
+        self._next_id = 0
+        self.reset()
+
+    def reset(self):
+        self.boxes = np.empty((0, 4), dtype=np.int32)
+        self.ids = np.empty(0, dtype=np.int32)
+        self.hits = np.empty(0, dtype=np.int32)
+        self.misses = np.empty(0, dtype=np.int32)
+
+    def detect(self, mask: np.ndarray) -> np.ndarray:
+        """从二值图中提取候选框 (x, y, w, h)"""
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        stats = stats[1:]  # 去掉背景
+        return stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area, :4]
+
+    def _match(self, detections: np.ndarray):
+        """按交并比从大到小贪心匹配，返回 (轨迹下标, 检测下标) 列表"""
+        if len(self.boxes) == 0 or len(detections) == 0:
+            return []
+        iou = iou_matrix(self.boxes, detections)
+        pairs = []
+        used_tracks = set()
+        used_dets = set()
+        for flat in np.argsort(-iou, axis=None):
+            t, d = divmod(int(flat), iou.shape[1])
+            if iou[t, d] < self.iou_threshold or iou[t, d] == 0:
+                break
+            if t in used_tracks or d in used_dets:
+                continue
+            used_tracks.add(t)
+            used_dets.add(d)
+            pairs.append((t, d))
+        return pairs
+
+    def update(self, mask: np.ndarray) -> np.ndarray:
+        """
+        处理一帧
+
+        Returns:
+            已确认轨迹的 (id, x, y, w, h) 数组
+        """
+        detections = self.detect(mask)
+        pairs = self._match(detections)
+
+        matched = np.zeros(len(self.boxes), dtype=bool)
+        det_used = np.zeros(len(detections), dtype=bool)
+        if pairs:
+            t_idx, d_idx = np.array(pairs).T
+            self.boxes[t_idx] = detections[d_idx]
+            self.hits[t_idx] += 1
+            self.misses[t_idx] = 0
+            matched[t_idx] = True
+            det_used[d_idx] = True
+
+        # 未匹配的轨迹：丢失计数加一，短暂丢失后重新匹配时无需再次确认
+        self.misses[~matched] += 1
+        keep = self.misses <= self.max_misses
+        self.boxes, self.ids, self.hits, self.misses = self.boxes[keep], self.ids[keep], self.hits[keep], self.misses[keep]
+
+        # 未匹配的检测：新建轨迹
+        new_boxes = detections[~det_used]
+        if len(new_boxes):
+            new_ids = np.arange(self._next_id, self._next_id + len(new_boxes), dtype=np.int32)
+            self._next_id += len(new_boxes)
+            self.boxes = np.vstack([self.boxes, new_boxes.astype(np.int32)])
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.hits = np.concatenate([self.hits, np.ones(len(new_boxes), dtype=np.int32)])
+            self.misses = np.concatenate([self.misses, np.zeros(len(new_boxes), dtype=np.int32)])
+
+        confirmed = (self.hits >= self.min_hits) & (self.misses == 0)
+        return np.column_stack([self.ids[confirmed], self.boxes[confirmed]])
+
+    @staticmethod
+    def area(tracks: np.ndarray) -> int:
+        """已确认轨迹的外接矩形面积之和"""
+        if len(tracks) == 0:
+            return 0
+        return int(np.sum(tracks[:, 3] * tracks[:, 4]))
+
+
+red_tracker = TrafficLightTracker()
+green_tracker = TrafficLightTracker()
+
+
+def _no_tracks() -> np.ndarray:
+    return np.empty((0, 5), dtype=np.int32)
+
+
+@dataclass
+class LightResult:
+    """红绿灯检测结果，轨迹为 (id, x, y, w, h)，坐标为输入帧坐标"""
+    red_count: int = 0
+    green_count: int = 0
+    red_tracks: np.ndarray = field(default_factory=_no_tracks)
+    green_tracks: np.ndarray = field(default_factory=_no_tracks)
+
+def _brightness_lut() -> np.ndarray:
     # 亮度参数
-    a = 0.3
-    b = (1 - a) * 125
+    a, b = params["light_brightness_a"], params["light_brightness_b"]
+    values = a * np.arange(256, dtype=np.float32) + b
+    return np.clip(values, 0, 255).astype(np.uint8)
 
-    # 调整亮度
-    img = frame.copy()
-    img = img.astype(np.float32)
-    img = a * img + b
-    img = np.clip(img, 0, 255).astype(np.uint8)
+# 查找表和膨胀核只在对应参数变化时重建
+_lut = Derived(params, ("light_brightness_a", "light_brightness_b"), _brightness_lut)
+_kernel = Derived(params, ("light_kernel",),
+                  lambda: cv2.getStructuringElement(cv2.MORPH_RECT, (params["light_kernel"],) * 2))
 
-    # 转换为YCrCb颜色空间
-    imgYCrCb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)
+def handle_lights(frame: cv2.Mat) -> LightResult:
+    """检测红绿灯，不修改输入帧；叠加绘制见 vision.overlay"""
+    result = LightResult()
 
-    imgRed = np.zeros((imgYCrCb.shape[0], imgYCrCb.shape[1]), dtype=np.uint8)
-    imgGreen = np.zeros((imgYCrCb.shape[0], imgYCrCb.shape[1]), dtype=np.uint8)
+    ws = get_workspace()
+    shape = frame.shape[:2]
+
+    # 调整亮度：a * x + b 预先做成查找表
+    lut = _lut.get()
+    img = cv2.LUT(frame, lut, dst=ws.buffer("light_bright", frame.shape))
+
+    # 转换为YCrCb颜色空间
+    imgYCrCb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb, dst=ws.buffer("light_ycrcb", frame.shape))
 
-    # 分解YCrCb的三个成分
-    planes = cv2.split(imgYCrCb)
-    
     # 根据Cr分量拆分红色和绿色
-    Cr_channel = planes[1]
-    
-    # RED, 145<Cr<470 红色
-    imgRed[(Cr_channel > 145) & (Cr_channel < 470)] = 255
-    
-    # GREEN 95<Cr<110 绿色
-    imgGreen[(Cr_channel > 95) & (Cr_channel < 110)] = 255
+    Cr_channel = cv2.extractChannel(imgYCrCb, 1, dst=ws.buffer("light_cr", shape))
+
+    # 膨胀（原先的 1x1 腐蚀不改变图像，已省略）
+    kernel = _kernel.get()
 
-    # 膨胀和腐蚀
-    kernel = np.ones((15, 15), np.uint8)
-    imgRed = cv2.dilate(imgRed, kernel, iterations=1)
-    imgRed = cv2.erode(imgRed, np.ones((1, 1), np.uint8), iterations=1)
-    imgGreen = cv2.dilate(imgGreen, kernel, iterations=1)
-    imgGreen = cv2.erode(imgGreen, np.ones((1, 1), np.uint8), iterations=1)
+    if RED_LIGHT_ON:
+        # RED, 145<Cr<470 红色
+        imgRed = cv2.threshold(Cr_channel, 145, 255, cv2.THRESH_BINARY, dst=ws.buffer("light_red", shape))[1]
+        imgRed = cv2.dilate(imgRed, kernel, dst=ws.buffer("light_red_dilated", shape), iterations=1)
+        result.red_tracks = red_tracker.update(imgRed)
+        result.red_count = TrafficLightTracker.area(result.red_tracks)
 
-    # We temporarily disable red light detection
-    redCount = 0
-    # redCount = processImgR(imgRed, frame)
-    greenCount = processImgG(imgGreen, frame)
+    # GREEN 95<Cr<110 绿色
+    imgGreen = cv2.inRange(Cr_channel, 96, 109, dst=ws.buffer("light_green", shape))
+    imgGreen = cv2.dilate(imgGreen, kernel, dst=ws.buffer("light_green_dilated", shape), iterations=1)
+    result.green_tracks = green_tracker.update(imgGreen)
+    result.green_count = TrafficLightTracker.area(result.green_tracks)
 
-    return redCount, greenCount
+    return result
 
-def process_signal(frame: cv2.Mat, redCount: int, greenCount: int, threshold: int = 500) -> tuple[int, str]:
+def process_signal(redCount: int, greenCount: int, threshold: Optional[int] = None) -> tuple[int, str]:
     """
     处理红绿灯信号，根据检测到的红色和绿色灯光数量确定信号值
     
     Args:
-        frame: 用于绘制状态文本的帧
         redCount: 红色灯光检测数量
         greenCount: 绿色灯光检测数量
-        threshold: 信号有效阈值，默认500
+        threshold: 信号有效阈值，默认为运行时参数 signal_threshold
     
     Returns:
         tuple[int, str]: (signal_v, signal_cmd)
             signal_v: -1表示无效，0表示红灯，1表示绿灯
             signal_cmd: 空字符串表示无效，否则为"sig:0"或"sig:1"
     """
+    if threshold is None:
+        threshold = params["signal_threshold"]
     signal_v = -1
     signal_cmd = ""
 
-    if redCount == 0 and greenCount == 0:
-        cv2.putText(frame, "lights out", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-    elif redCount > greenCount and redCount > threshold:  # threshold
+    if redCount > greenCount and redCount > threshold:  # threshold
         signal_v = 0
     elif redCount < greenCount and greenCount > threshold:
         signal_v = 1
-    else:
-        cv2.putText(frame, f"slight {redCount}/{greenCount}", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
 
     if signal_v != -1:
         # it's valid, we should send the signal to the Slave
@@ -0,0 +1,91 @@
+"""
+调试叠加层绘制
+
+检测模块只返回结构化结果，只有在需要输出画面（控制台推流、imshow 或录像）时
+才在编码用的拷贝上绘制，无画面输出时不产生任何绘制开销。
+"""
+
+import cv2
+import numpy as np
+import config
+from vision.workspace import get_workspace
+
+
+def needed() -> bool:
+    """当前配置下是否有画面的消费者"""
+    return config.FRAME_OUTPUT_METHOD in (1, 2) or bool(config.RECORD_VIDEO)
+
+
+def draw_line(frame, line):
+    """赛道线：边缘涂红、ROI 区域、每行中点"""
+    if line.edges is not None:
+        workspace = get_workspace()
+        edges = line.edges
+        if edges.shape != frame.shape[:2]:
+            # 金字塔层级上提取的边缘按最近邻放大回帧分辨率
+            height, width = frame.shape[:2]
+            edges = cv2.resize(edges, (width, height), dst=workspace.buffer("overlay_edges", (height, width)),
+                               interpolation=cv2.INTER_NEAREST)
+        # 纯红图像按分辨率只生成一次
+        red = workspace.const(("red_image", frame.shape), lambda: np.full(frame.shape, (0, 0, 255), dtype=np.uint8))
+        cv2.copyTo(red, edges, frame)
+
+    # Draw ROI region
+    if line.roi_pts is not None:
+        cv2.polylines(frame, [line.roi_pts], isClosed=True, color=(255, 0, 55), thickness=1)
+
+    # 画出每行中点轨迹
+    if line.mid_points is not None and len(line.mid_points):
+        height, width = frame.shape[:2]
+        xs, ys = line.mid_points[:, 0], line.mid_points[:, 1]
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        frame[ys[inside], xs[inside]] = 255
+
+    cv2.putText(frame, f"dir: {line.direction}", (10, 18), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (155, 55, 0), 1)
+    cv2.putText(frame, f"error: {line.error}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 30), 1)
+
+
+def _draw_tracks(frame, tracks, label: str, color: tuple, scale: tuple[float, float]):
+    sx, sy = scale
+    for track_id, x, y, w, h in tracks:
+        x, y, w, h = int(x * sx), int(y * sy), int(w * sx), int(h * sy)
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(frame, f"{label}#{track_id}: {w}x{h}", (x, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+
+def draw_lights(frame, lights, signal_v: int, scale: tuple[float, float] = (1.0, 1.0)):
+    """
+    红绿灯：轨迹框和信号状态
+
+    :param scale: 检测帧到绘制帧的缩放比例 (x, y)
+    """
+    _draw_tracks(frame, lights.red_tracks, "Red", (0, 0, 255), scale)
+    _draw_tracks(frame, lights.green_tracks, "Green", (0, 255, 0), scale)
+
+    if lights.red_count == 0 and lights.green_count == 0:
+        cv2.putText(frame, "lights out", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+    elif signal_v == -1:
+        cv2.putText(frame, f"slight {lights.red_count}/{lights.green_count}", (10, 42), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+
+
+def draw_faces(frame, faces, scale: tuple[float, float] = (1.0, 1.0)):
+    sx, sy = scale
+    for x, y, w, h in faces.boxes:
+        x, y, w, h = int(x * sx), int(y * sy), int(w * sx), int(h * sy)
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+
+def render(frame, line=None, lights=None, signal_v: int = -1, light_scale: tuple[float, float] = (1.0, 1.0), faces=None):
+    """
+    在 frame 上绘制所有检测结果（调用方应传入拷贝），返回 frame
+
+    :param light_scale: 原始帧到 frame 的缩放比例 (x, y)，红绿灯和人脸在原始帧上检测
+    """
+    if line is not None:
+        draw_line(frame, line)
+    if lights is not None:
+        draw_lights(frame, lights, signal_v, light_scale)
+    if faces is not None:
+        draw_faces(frame, faces, light_scale)
+    return frame
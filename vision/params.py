@@ -0,0 +1,171 @@
+"""
+运行时参数
+
+视觉参数集中保存在 ParamStore 中，初始值来自 config（环境变量），
+运行时可通过 WebSocket（params / set_params 消息）或调试滑条修改。
+每次修改都会递增版本号，Derived 据此只在相关参数变化时重新计算派生对象
+（HSV 上下界、亮度查找表、卷积核、ROI 掩膜），每帧不再有参数读取和重建的开销。
+
+注意：VISION_WORKER 模式下视觉处理在独立进程中，运行时修改不会同步到工作进程。
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+import config
+
+
+@dataclass
+class ParamSpec:
+    name: str
+    default: Any
+    type: type
+    min: Optional[float] = None
+    max: Optional[float] = None
+    help: str = ""
+
+
+def _triple(text: str) -> Tuple[int, int, int]:
+    h, s, v = (int(x) for x in text.split(","))
+    return h, s, v
+
+
+class ParamStore:
+    """带版本号的参数表，读取无锁，修改加锁"""
+
+    def __init__(self):
+        self._specs: Dict[str, ParamSpec] = {}
+        self._values: Dict[str, Any] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 任一参数变化都会递增，Derived 用它做快速判断
+        self.version = 0
+
+    def define(self, name: str, default, type_=None, min=None, max=None, help: str = ""):
+        spec = ParamSpec(name, default, type_ or type(default), min, max, help)
+        self._specs[name] = spec
+        self._values[name] = self._coerce(spec, default)
+        self._versions[name] = 0
+
+    @staticmethod
+    def _coerce(spec: ParamSpec, value):
+        value = spec.type(value)
+        if spec.min is not None and value < spec.min:
+            raise ValueError(f"{spec.name} 不能小于 {spec.min}")
+        if spec.max is not None and value > spec.max:
+            raise ValueError(f"{spec.name} 不能大于 {spec.max}")
+        return value
+
+    def get(self, name: str):
+        return self._values[name]
+
+    def __getitem__(self, name: str):
+        return self._values[name]
+
+    def set(self, name: str, value) -> bool:
+        """修改参数，返回是否发生了变化；参数不存在或取值非法时抛出 KeyError / ValueError"""
+        return self.update({name: value})
+
+    def update(self, values: Dict[str, Any]) -> bool:
+        """批量修改（先全部校验再生效），返回是否有参数发生变化"""
+        for name in values:
+            if name not in self._specs:
+                raise KeyError(f"未知参数: {name}")
+        coerced = {name: self._coerce(self._specs[name], value) for name, value in values.items()}
+        with self._lock:
+            changed = [name for name, value in coerced.items() if self._values[name] != value]
+            for name in changed:
+                self._values[name] = coerced[name]
+                self._versions[name] += 1
+            if changed:
+                self.version += 1
+        return bool(changed)
+
+    def versions(self, names: Iterable[str]) -> tuple:
+        return tuple(self._versions[name] for name in names)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self._values)
+
+    def describe(self) -> Dict[str, Dict[str, Any]]:
+        """参数说明，供前端生成调参界面"""
+        return {
+            name: {'value': self._values[name], 'default': spec.default, 'min': spec.min,
+                   'max': spec.max, 'type': spec.type.__name__, 'help': spec.help}
+            for name, spec in self._specs.items()
+        }
+
+
+class Derived:
+    """
+    由参数计算出的对象，只在依赖的参数变化时重新计算
+
+    调用参数（如分辨率、金字塔层级）不同的结果分别缓存，切换回来时不再重新计算；
+    依赖的参数变化时全部作废。
+
+        bounds = Derived(store, ("a", "b"), lambda: make(store["a"], store["b"]))
+        bounds.get()
+    """
+
+    def __init__(self, store: ParamStore, names: Tuple[str, ...], factory: Callable[..., Any],
+                 max_entries: int = 8):
+        """
+        :param max_entries: 最多缓存的调用参数组合数，超出时清空
+        """
+        self.store = store
+        self.names = tuple(names)
+        self.factory = factory
+        self.max_entries = max_entries
+        self.recomputes = 0
+        self._store_version = -1
+        self._versions: Optional[tuple] = None
+        self._values: Dict[tuple, Any] = {}
+
+    def get(self, *args):
+        # 先记下版本号再读取参数：计算期间发生的修改使版本号再次变化，下次调用会重新检查
+        store_version = self.store.version
+        if store_version != self._store_version:
+            versions = self.store.versions(self.names)
+            if versions != self._versions:
+                self._values.clear()
+                self._versions = versions
+            self._store_version = store_version
+        try:
+            return self._values[args]
+        except KeyError:
+            pass
+        if len(self._values) >= self.max_entries:
+            self._values.clear()
+        value = self._values[args] = self.factory(*args)
+        self.recomputes += 1
+        return value
+
+
+params = ParamStore()
+
+_yl = _triple(config.YELLOW_HSV_LOWER)
+_yu = _triple(config.YELLOW_HSV_UPPER)
+params.define("yellow_h_lower", _yl[0], int, 0, 179, "黄色赛道 H 下界")
+params.define("yellow_h_upper", _yu[0], int, 0, 179, "黄色赛道 H 上界")
+params.define("yellow_s_lower", _yl[1], int, 0, 255, "黄色赛道 S 下界")
+params.define("yellow_s_upper", _yu[1], int, 0, 255, "黄色赛道 S 上界")
+params.define("yellow_v_lower", _yl[2], int, 0, 255, "黄色赛道 V 下界")
+params.define("yellow_v_upper", _yu[2], int, 0, 255, "黄色赛道 V 上界")
+params.define("blur_ksize", config.BLUR_KSIZE, int, 1, 31, "赛道检测高斯模糊核边长（取奇数）")
+params.define("lane_min_width", 2, int, 1, 640, "游程提取：赛道线最小宽度（像素）")
+params.define("lane_max_width", 40, int, 1, 640, "游程提取：赛道线最大宽度（像素）")
+params.define("roi_top", config.ROI_TOP, int, 0, 2000, "ROI 上边界（从上往下第几行）")
+params.define("light_brightness_a", config.LIGHT_BRIGHTNESS_A, float, 0.0, 4.0, "红绿灯亮度调整 a * x + b 的 a")
+params.define("light_brightness_b", config.LIGHT_BRIGHTNESS_B, float, -255.0, 255.0, "红绿灯亮度调整 a * x + b 的 b")
+params.define("light_kernel", 15, int, 1, 63, "红绿灯膨胀核边长")
+params.define("signal_threshold", config.SIGNAL_THRESHOLD, int, 0, None, "红绿灯信号有效的最小面积")
+
+# 调试滑条（SHOW_TRACKBAR）名称 -> 参数名
+TRACKBARS = {
+    "H Lower": "yellow_h_lower",
+    "H Upper": "yellow_h_upper",
+    "S Lower": "yellow_s_lower",
+    "S Upper": "yellow_s_upper",
+    "V Lower": "yellow_v_lower",
+    "V Upper": "yellow_v_upper",
+}
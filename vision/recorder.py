@@ -0,0 +1,166 @@
+"""
+异步录像
+
+录像在独立线程中编码写盘，主循环只把帧放入有界队列，不会增加转向延迟。
+队列满时丢弃新帧并计数；按时长或文件大小切分片段；
+可选同时保存未叠加的原始帧，以及每帧元数据（误差、信号、时间戳）的 JSON Lines 旁路文件。
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class VideoRecorder:
+    """后台线程录像器"""
+
+    def __init__(self, output_dir: str, frame_size: tuple[int, int], fps: float = 30.0,
+                 fourcc: str = "MJPG", queue_size: int = 64, segment_seconds: float = 300.0,
+                 segment_bytes: int = 0, save_raw: bool = False, save_meta: bool = True,
+                 prefix: str = "record"):
+        """
+        :param output_dir: 输出目录
+        :param frame_size: 帧尺寸 (宽, 高)
+        :param queue_size: 帧队列长度，满时丢帧
+        :param segment_seconds: 片段时长（秒），0 表示不按时长切分
+        :param segment_bytes: 片段大小上限（字节），0 表示不按大小切分
+        :param save_raw: 是否同时保存原始帧
+        :param save_meta: 是否保存每帧元数据旁路文件
+        """
+        self.output_dir = output_dir
+        self.frame_size = frame_size
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.save_raw = save_raw
+        self.save_meta = save_meta
+        self.prefix = prefix
+
+        self.frame_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self._writer: Optional[cv2.VideoWriter] = None
+        self._raw_writer: Optional[cv2.VideoWriter] = None
+        self._meta_file = None
+        self._segment_path: Optional[str] = None
+        self._segment_start = 0.0
+        self._segment_frames = 0
+        self._segment_index = 0
+
+        self.stats = {
+            'frames_queued': 0,
+            'frames_written': 0,
+            'frames_dropped': 0,
+            'segments': 0,
+        }
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._write_loop, name="video-recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, frame, meta: Optional[Dict[str, Any]] = None, raw=None) -> bool:
+        """
+        提交一帧（不阻塞）。调用方提交后不应再修改 frame/raw。
+
+        Returns:
+            是否成功入队，队列满时返回 False 并计入丢帧
+        """
+        if not self.running:
+            return False
+        try:
+            self.frame_queue.put_nowait((frame, raw, meta, time.time()))
+            self.stats['frames_queued'] += 1
+            return True
+        except queue.Full:
+            self.stats['frames_dropped'] += 1
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        """写完队列中剩余的帧并关闭文件"""
+        if not self.running:
+            return
+        self.running = False
+        # 哨兵放在队尾，保证之前入队的帧全部写完
+        self.frame_queue.put(None)
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                logger.warning("录像线程未能在超时内写完剩余帧")
+                return
+        self._close_segment()
+        logger.info(f"录像已停止: 写入 {self.stats['frames_written']} 帧，丢弃 {self.stats['frames_dropped']} 帧，"
+                    f"共 {self.stats['segments']} 个片段")
+
+    def _open_segment(self):
+        self._segment_index += 1
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.output_dir, f"{self.prefix}_{stamp}_{self._segment_index:03d}")
+        self._segment_path = f"{base}.avi"
+        self._writer = cv2.VideoWriter(self._segment_path, self.fourcc, self.fps, self.frame_size)
+        if self.save_raw:
+            self._raw_writer = cv2.VideoWriter(f"{base}_raw.avi", self.fourcc, self.fps, self.frame_size)
+        if self.save_meta:
+            self._meta_file = open(f"{base}.jsonl", "w", encoding="utf-8")
+        self._segment_start = time.monotonic()
+        self._segment_frames = 0
+        self.stats['segments'] += 1
+
+    def _close_segment(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        if self._raw_writer is not None:
+            self._raw_writer.release()
+            self._raw_writer = None
+        if self._meta_file is not None:
+            self._meta_file.close()
+            self._meta_file = None
+
+    def _should_rotate(self) -> bool:
+        if self._writer is None:
+            return True
+        if self.segment_seconds and time.monotonic() - self._segment_start >= self.segment_seconds:
+            return True
+        # 文件大小每 30 帧检查一次
+        if self.segment_bytes and self._segment_frames % 30 == 0 and self._segment_frames:
+            try:
+                return os.path.getsize(self._segment_path) >= self.segment_bytes
+            except OSError:
+                return False
+        return False
+
+    def _write_loop(self):
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                break
+            frame, raw, meta, wall_time = item
+            try:
+                if self._should_rotate():
+                    self._close_segment()
+                    self._open_segment()
+                self._writer.write(frame)
+                if self._raw_writer is not None and raw is not None:
+                    self._raw_writer.write(raw)
+                if self._meta_file is not None:
+                    record = {'segment_frame': self._segment_frames, 'wall_time': wall_time}
+                    if meta:
+                        record.update(meta)
+                    self._meta_file.write(json.dumps(record, default=float) + "\n")
+                self._segment_frames += 1
+                self.stats['frames_written'] += 1
+            except Exception as e:
+                logger.error(f"录像写入失败: {e}")
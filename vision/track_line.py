@@ -1,59 +1,83 @@
+import time
 import cv2
 import numpy as np
 from cv2.mat_wrapper import Mat
+from dataclasses import dataclass
+from typing import Dict, Optional
 import config
+from vision import birdseye
+from vision.governor import get_governor
+from vision.params import Derived, params
+from vision.workspace import get_workspace
 
-# ROI 从上往下第 x 行以下为ROI
-ROI_TOP_VERT = 100
+def _roi_top() -> int:
+    # ROI 从上往下第 x 行以下为ROI
+    return params["roi_top"]
+
+def _yellow_bounds():
+    lower = np.array([params["yellow_h_lower"], params["yellow_s_lower"], params["yellow_v_lower"]], dtype=np.uint8)
+    upper = np.array([params["yellow_h_upper"], params["yellow_s_upper"], params["yellow_v_upper"]], dtype=np.uint8)
+    return lower, upper
+
+# 黄色的HSV范围，参数变化时才重建（调试滑条通过回调写入参数）
+_yellow = Derived(params, tuple(f"yellow_{c}_{b}" for c in "hsv" for b in ("lower", "upper")), _yellow_bounds)
 
 # HSV 提取黄色赛道线
-def get_yellow_mask(hsv):
+def get_yellow_mask(hsv, out=None):
     
     # 黄色的HSV范围
-    if(config.SHOW_TRACKBAR):
-        h_lower = cv2.getTrackbarPos("H Lower", "Video Trackbar")
-        h_upper = cv2.getTrackbarPos("H Upper", "Video Trackbar")
-        s_lower = cv2.getTrackbarPos("S Lower", "Video Trackbar")
-        s_upper = cv2.getTrackbarPos("S Upper", "Video Trackbar")
-        v_lower = cv2.getTrackbarPos("V Lower", "Video Trackbar")
-        v_upper = cv2.getTrackbarPos("V Upper", "Video Trackbar")
-        lower_yellow = np.array([h_lower, s_lower, v_lower])
-        upper_yellow = np.array([h_upper, s_upper, v_upper])
-    else:
-        lower_yellow = np.array([10, 40, 120])
-        upper_yellow = np.array([38, 255, 255])
+    lower_yellow, upper_yellow = _yellow.get()
+    return threshold_yellow(hsv, lower_yellow, upper_yellow, out)
+
+def threshold_yellow(hsv, lower_yellow, upper_yellow, out=None):
+    """
+    按给定的上下界提取黄色并做一次闭运算（离线调参也使用这个函数）
 
-    mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
+    :param out: 输出缓冲区，为 None 时使用工作区中按形状缓存的缓冲区（形状每次不同的输入应传入 out）
+    """
+    ws = get_workspace()
+    mask = cv2.inRange(hsv, lower_yellow, upper_yellow, dst=ws.buffer("yellow", hsv.shape[:2]) if out is None else out)
 
     # kernel = np.ones((5, 5), np.uint8)
     # mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)  # 去噪点
     # mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel) # 填补空洞
 
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    mask = cv2.dilate(mask, kernel, iterations=1)
-    mask = cv2.erode(mask, kernel, iterations=1)
+    kernel = ws.kernel(cv2.MORPH_RECT, (3, 3))
+    dilated = cv2.dilate(mask, kernel, dst=ws.buffer("yellow_dilated", mask.shape) if out is None else None, iterations=1)
+    mask = cv2.erode(dilated, kernel, dst=mask, iterations=1)
 
     # mask = cv2.medianBlur(mask, 9)  # 中值滤波
     return mask
 
-def get_roi(image: Mat):
-    height, width = image.shape[:2]
-    # 梯形ROI
-    mask = np.zeros(image.shape[:2], dtype=np.uint8)
-
+def _roi_points(height: int, width: int, roi_top: int) -> np.ndarray:
     # Define trapezoid points  左下 右下 右上 左上
     left_bottom = [0, height]
     right_bottom = [width, height]
-    left_top = [0, ROI_TOP_VERT]
-    right_top = [width, ROI_TOP_VERT]
+    left_top = [0, roi_top]
+    right_top = [width, roi_top]
     pts = np.array([left_bottom, right_bottom, right_top, left_top], np.int32)
-    pts = pts.reshape((-1, 1, 2))
+    return pts.reshape((-1, 1, 2))
 
-    # Fill the trapezoid area on mask
+def _make_roi(height: int, width: int, scale: int = 1):
+    pts = _roi_points(height, width, _roi_top() // scale)
+    mask = np.zeros((height, width), dtype=np.uint8)
     cv2.fillPoly(mask, [pts], 255)
+    return pts, mask
+
+# 梯形ROI，顶点和掩膜只在分辨率、金字塔层级或 roi_top 变化时生成
+_roi = Derived(params, ("roi_top",), _make_roi)
+
+def get_roi(image: Mat, scale: int = 1):
+    """
+    :param scale: image 相对原分辨率的缩小倍数（金字塔层级），roi_top 按比例换算
+    """
+    height, width = image.shape[:2]
+    ws = get_workspace()
+    pts, mask = _roi.get(height, width, scale)
 
     # Apply mask to image
-    roi = cv2.bitwise_and(image, image, mask=mask)
+    # 掩膜外的像素不会被写入，缓冲区以 0 初始化后始终保持为 0
+    roi = cv2.bitwise_and(image, image, dst=ws.buffer("roi", image.shape, zero=True), mask=mask)
 
     return roi, pts
 
@@ -62,79 +86,593 @@ def get_roi(image: Mat):
 从图像底部向上扫描（逐行）
 找出当前行左右赛道的边缘点 → 取两者中点 → 逐层向上平滑跟踪中线 → 得出最终中线。
 """
-def mid(follow: Mat, mask: Mat, screen_height: int) -> tuple[Mat, int]:
-    mid_points = np.empty((0, 2), int)
+def _full_scan(mask: Mat, screen_height: int):
+    """
+    全宽逐行扫描
 
-    half_width= follow.shape[1] // 2
+    Returns:
+        (行号, 左线位置, 右线位置, 中点)，未找到的一侧为 NaN，中点按原逻辑以图片边界补齐
+    """
+    width = mask.shape[1]
+    half_width = width // 2
     half = half_width  # 从下往上扫描赛道,最下端取图片中线为分割线
-    scan_times = 0
-    invaild_times = 0;
-    error = 0
-    for y in range(follow.shape[0] - 1, -1, -1):
-        have_left_lane = True
-        have_right_lane = True
-        scan_times += 1
-        if scan_times > screen_height - ROI_TOP_VERT:
-            break
+    n_rows = min(mask.shape[0], max(screen_height - _roi_top(), 0))
+    ys = np.arange(mask.shape[0] - 1, mask.shape[0] - 1 - n_rows, -1)
+    lefts = np.full(n_rows, np.nan)
+    rights = np.full(n_rows, np.nan)
+    mids = np.empty(n_rows)
+    for i, y in enumerate(ys):
         # 加入分割线左右各半张图片的宽度作为约束,减小邻近赛道的干扰
-        if (mask[y][max(0,half-half_width):half] == np.zeros_like(mask[y][max(0,half-half_width):half])).all():
+        if not mask[y, max(0, half - half_width):half].any():
             # 分割线左端无赛道
-            have_left_lane = False
-            left = max(0,half-half_width)  # 取图片左边界
+            left = max(0, half - half_width)  # 取图片左边界
         else:
-            left = np.average(np.where(mask[y][0:half] == 255))  # 计算分割线左端平均位置
-        if (mask[y][half:min(follow.shape[1],half+half_width)] == np.zeros_like(mask[y][half:min(follow.shape[1],half+half_width)])).all():
+            left = np.average(np.where(mask[y, 0:half] == 255))  # 计算分割线左端平均位置
+            lefts[i] = left
+        if not mask[y, half:min(width, half + half_width)].any():
             # 分割线右端无赛道
-            have_right_lane = False
-            right = min(follow.shape[1],half+half_width)  # 取图片右边界
+            right = min(width, half + half_width)  # 取图片右边界
         else:
-            right = np.average(np.where(mask[y][half:follow.shape[1]] == 255)) + half  # 计算分割线右端平均位置
+            right = np.average(np.where(mask[y, half:width] == 255)) + half  # 计算分割线右端平均位置
+            rights[i] = right
+
+        mids[i] = (left + right) / 2  # 计算拟合中点（保留小数，换算到原分辨率后再取整）
+        half = int(mids[i])  # 递归,从下往上确定拟合中点
+    return ys, lefts, rights, mids
+
+
+def row_runs(mask: Mat):
+    """
+    逐行游程编码：对每行的二值像素做差分，得到每段前景的起点和终点
+
+    Returns:
+        (行号, 起点, 终点)，终点不含，按行号、起点排序
+    """
+    height, width = mask.shape[:2]
+    ws = get_workspace()
+    padded = ws.buffer("runs_padded", (height, width + 2), np.int8, zero=True)
+    np.not_equal(mask, 0, out=padded[:, 1:-1].view(np.bool_))
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    ends = np.nonzero(d == -1)[1]
+    return rows, starts, ends
 
-        mid = (left + right) // 2  # 计算拟合中点
-        if not have_right_lane and not have_left_lane: # 左右两边都无赛道
-            # follow[y, int(mid)] = 0;
-            invaild_times += 1
+
+def lane_runs(mask: Mat):
+    """宽度在 lane_min_width..lane_max_width 之间的游程，返回 (行号, 中心)"""
+    rows, starts, ends = row_runs(mask)
+    widths = ends - starts
+    keep = (widths >= params["lane_min_width"]) & (widths <= params["lane_max_width"])
+    return rows[keep], (starts[keep] + ends[keep] - 1) / 2
+
+
+def _runs_scan(mask: Mat, screen_height: int):
+    """
+    与 _full_scan 相同的自下而上中线扫描，但直接使用每行赛道线段的中心，不需要 Canny 边缘
+
+    过宽（色块）和过窄（噪点）的段在 lane_runs 中已被滤除。
+    """
+    height, width = mask.shape[:2]
+    rows, centers = lane_runs(mask)
+    bounds = np.searchsorted(rows, np.arange(height + 1)).tolist()
+    centers = centers.tolist()
+
+    half = width // 2
+    n_rows = min(height, max(screen_height - _roi_top(), 0))
+    ys = np.arange(height - 1, height - 1 - n_rows, -1)
+    lefts = np.full(n_rows, np.nan)
+    rights = np.full(n_rows, np.nan)
+    mids = np.empty(n_rows)
+    for i, y in enumerate(ys.tolist()):
+        row = centers[bounds[y]:bounds[y + 1]]
+        left_c = [c for c in row if c < half]
+        right_c = [c for c in row if c >= half]
+        if left_c:
+            left = lefts[i] = sum(left_c) / len(left_c)
+        else:
+            left = 0
+        if right_c:
+            right = rights[i] = sum(right_c) / len(right_c)
         else:
-            error += half_width - int(mid)
-            # new_point = np.array([y, int(mid)])
-            # mid_points = np.vstack([mid_points, new_point])
-            follow[y, int(mid)] = 255  # 画出每行中点轨迹
+            right = width
+        mids[i] = (left + right) / 2
+        half = int(mids[i])
+    return ys, lefts, rights, mids
+
+
+def _finish_scan(width: int, ys, lefts, rights, mids, scale: int = 1, out_width: Optional[int] = None):
+    """
+    计算平均误差
+
+    :param width: 扫描图像的宽度
+    :param scale: 扫描图像相对输入帧的缩小倍数（金字塔层级），中点和误差换算回输入帧
+    :param out_width: 输入帧宽度，默认为 width * scale
+
+    中点在扫描层级上保留小数，换算到输入帧后只取整一次，各层级的误差没有随层级增大的取整偏差。
+
+    Returns:
+        (误差, 每行中点 (N, 2) 数组，列为 x, y，输入帧坐标)
+    """
+    out_width = width * scale if out_width is None else out_width
+    valid = ~(np.isnan(lefts) & np.isnan(rights))  # 左右两边都无赛道的行不计入
+    # 粗层级像素 x 的中心在输入帧的 (x + 0.5) * scale - 0.5
+    mid_cols = np.round((mids[valid] + 0.5) * scale - 0.5).astype(int)
+    points = np.column_stack([mid_cols, ys[valid] * scale + (scale - 1) // 2])
+    if len(mid_cols) == 0:
+        return 0, points
+    error = np.sum(out_width // 2 - mid_cols)
+    return error / len(mid_cols), points  # error为正数右转,为负数左转
+
+
+def mid(mask: Mat, screen_height: int):
+    """全宽扫描求中线，返回 (误差, 每行中点)"""
+    ys, lefts, rights, mids = _full_scan(mask, screen_height)
+    return _finish_scan(mask.shape[1], ys, lefts, rights, mids)
+
+
+def mid_runs(mask: Mat, screen_height: int):
+    """在二值掩膜上用游程求中线，返回值与 mid() 相同"""
+    ys, lefts, rights, mids = _runs_scan(mask, screen_height)
+    return _finish_scan(mask.shape[1], ys, lefts, rights, mids)
+
+
+class LineTracker:
+    """
+    跨帧中线跟踪
+
+    以上一帧每行的左右线位置为预测，只在预测位置附近的窗口内搜索，
+    置信度（找到赛道的行占比）不足时回退到全宽扫描。
+    左右窗口以预测的中点为界，赛道线在远处汇聚时两侧不会取到同一批像素；
+    使用游程扫描时窗口内同样只取宽度在 lane_min_width..lane_max_width 之间的线段。
+    """
+
+    def __init__(self, search_radius: int = 40, min_confidence: float = 0.6, rescan_interval: int = 30):
+        """
+        :param search_radius: 每行搜索窗口的半宽（像素）
+        :param min_confidence: 低于该置信度时回退到全宽扫描
+        :param rescan_interval: 每隔多少帧强制全宽扫描一次，用于重新捕获丢失的一侧赛道
+        """
+        self.search_radius = search_radius
+        self.min_confidence = min_confidence
+        self.rescan_interval = rescan_interval
+        self._offsets = np.arange(-search_radius, search_radius + 1)
+        self.ys = None
+        self.lefts = None
+        self.rights = None
+        self.confidence = 0.0
+        self.full_scans = 0
+        self._since_full_scan = 0
+
+    def reset(self):
+        self.ys = None
+        self.lefts = None
+        self.rights = None
+        self.confidence = 0.0
+
+    @staticmethod
+    def _confidence(lefts, rights) -> float:
+        if len(lefts) == 0:
+            return 0.0
+        return float(np.count_nonzero(~(np.isnan(lefts) & np.isnan(rights)))) / len(lefts)
+
+    def _search(self, mask: Mat, ys, pred, lower, upper):
+        """
+        在预测位置附近的窗口内求赛道像素平均位置，找不到的行为 NaN
+
+        :param lower: 每行窗口的左边界（含），upper 为右边界（不含）
+        """
+        width = mask.shape[1]
+        known = ~np.isnan(pred)
+        cols = np.where(known, pred, 0).astype(int)[:, None] + self._offsets
+        inside = (cols >= 0) & (cols < width) & known[:, None] & (cols >= lower[:, None]) & (cols < upper[:, None])
+        hits = (mask[ys[:, None], np.clip(cols, 0, width - 1)] != 0) & inside
+        counts = hits.sum(axis=1)
+        pos = np.full(len(ys), np.nan)
+        found = counts > 0
+        pos[found] = (hits * cols).sum(axis=1)[found] / counts[found]
+        return pos
+
+    def _search_runs(self, mask: Mat, ys, pred, lower, upper):
+        """
+        与 _search 相同，但取窗口内宽度在 lane_min_width..lane_max_width 之间的线段中心的平均值
+
+        窗口两侧各多取 lane_max_width 列：中心落在窗口内的线段若超出多取的范围，必然过宽，
+        因此不必对整幅掩膜做游程编码就能得到准确的宽度。
+        """
+        width = mask.shape[1]
+        n = len(ys)
+        min_width, max_width = params["lane_min_width"], params["lane_max_width"]
+        extent = self.search_radius + max_width
+        known = ~np.isnan(pred)
+        base = np.where(known, pred, 0).astype(int)
+        cols = base[:, None] + np.arange(-extent, extent + 1)
+        inside = (cols >= 0) & (cols < width) & known[:, None]
+        padded = np.zeros((n, cols.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = (mask[ys[:, None], np.clip(cols, 0, width - 1)] != 0) & inside
+        d = np.diff(padded, axis=1)
+        rows, starts = np.nonzero(d == 1)
+        ends = np.nonzero(d == -1)[1]
+        widths = ends - starts
+        centers = base[rows] - extent + (starts + ends - 1) / 2
+        ok = (widths >= min_width) & (widths <= max_width) & (np.abs(centers - pred[rows]) <= self.search_radius) \
+            & (centers >= lower[rows]) & (centers < upper[rows])
+        counts = np.bincount(rows[ok], minlength=n)
+        sums = np.bincount(rows[ok], weights=centers[ok], minlength=n)
+        pos = np.full(n, np.nan)
+        found = counts > 0
+        pos[found] = sums[found] / counts[found]
+        return pos
+
+    def update(self, mask: Mat, screen_height: int, full_scan=_full_scan):
+        """
+        跟踪当前帧中线，返回值与 mid() 相同
+
+        :param full_scan: 跟踪丢失时使用的全宽扫描（_full_scan 或 _runs_scan）
+        """
+        return _finish_scan(mask.shape[1], *self.track(mask, screen_height, full_scan))
+
+    def track(self, mask: Mat, screen_height: int, full_scan=_full_scan):
+        """跟踪当前帧中线，返回值与 _full_scan() 相同；返回的 lefts / rights 即跟踪状态"""
+        ys = None
+        n_rows = min(mask.shape[0], max(screen_height - _roi_top(), 0))
+        if self.ys is not None and self.confidence >= self.min_confidence \
+                and self._since_full_scan < self.rescan_interval \
+                and len(self.ys) == n_rows and self.ys[0] == mask.shape[0] - 1:
+            ys = self.ys
+            # 两侧都有预测的行以预测中点为界，只有一侧时该侧窗口不受限
+            split = (self.lefts + self.rights) / 2
+            both = ~np.isnan(split)
+            upper = np.where(both, split, np.inf)
+            lower = np.where(both, split, -np.inf)
+            search = self._search_runs if full_scan is _runs_scan else self._search
+            lefts = search(mask, ys, self.lefts, np.full(len(ys), -np.inf), upper)
+            rights = search(mask, ys, self.rights, lower, np.full(len(ys), np.inf))
+            if self._confidence(lefts, rights) < self.min_confidence:
+                ys = None  # 跟踪丢失，本帧回退到全宽扫描
+            else:
+                # 缺失的一侧按原逻辑取图片边界
+                mids = (np.where(np.isnan(lefts), 0, lefts) + np.where(np.isnan(rights), mask.shape[1], rights)) / 2
+
+        if ys is None:
+            ys, lefts, rights, mids = full_scan(mask, screen_height)
+            self.full_scans += 1
+            self._since_full_scan = 0
+        else:
+            self._since_full_scan += 1
+
+        self.ys, self.lefts, self.rights = ys, lefts, rights
+        self.confidence = self._confidence(lefts, rights)
+        return ys, lefts, rights, mids
+
+
+@dataclass
+class LineResult:
+    """赛道线检测结果，坐标均为输入帧坐标"""
+    direction: str
+    error: float
+    # ROI（或鸟瞰标定区域）多边形
+    roi_pts: Optional[np.ndarray] = None
+    # 边缘图（工作区缓冲区，下一帧会被覆盖），在金字塔层级上检测时尺寸小于输入帧
+    edges: Optional[np.ndarray] = None
+    # 每行中点 (N, 2)，列为 x, y
+    mid_points: Optional[np.ndarray] = None
+    # 检测使用的金字塔层级（回退到原分辨率的帧为 0）
+    level: int = 0
+    # 所属帧的采集时间（time.monotonic()），由调用方填写
+    capture_time: Optional[float] = None
+
+
+def _direction(error: float) -> str:
+    if error > 0:
+        return "left"
+    return "right"
 
-        half = int(mid)  # 递归,从下往上确定拟合中点
-        
-    # print(f"invaild: {scan_times - invaild_times}")
 
-    # print(f"{curv} : {direction}")
-    return error / (scan_times - invaild_times) # error为正数右转,为负数左转
+_line_tracker = LineTracker()
+_birdseye_tracker = LineTracker()
+# 金字塔各层级的跟踪状态，第 0 层即 _line_tracker
+_level_trackers = {0: _line_tracker}
 
-def handle_one_frame(frame: Mat, screen_height: int) -> Mat:
+
+def reset_trackers():
+    """清空所有跟踪状态（离线评估在每段录像开始时调用）"""
+    for tracker in _level_trackers.values():
+        tracker.reset()
+    _birdseye_tracker.reset()
+
+
+# 金字塔检测统计：回退到原分辨率的帧数、逐行补检的帧数和行数
+pyramid_stats = {'frames': 0, 'frame_escalations': 0, 'row_refines': 0, 'rows_refined': 0}
+
+
+def _extract(yellow_mask: Mat, ws, name: str) -> Mat:
+    """游程提取直接使用二值掩膜，否则做 Canny"""
+    if config.LINE_EXTRACTOR == "runs":
+        return yellow_mask
+    return cv2.Canny(yellow_mask, 50, 100, edges=ws.buffer(name, yellow_mask.shape[:2]))
+
+
+def _scan(tracker: LineTracker, edges: Mat, screen_height: int):
+    """求每行左右线和中点，返回值与 _full_scan() 相同"""
+    full_scan = _runs_scan if config.LINE_EXTRACTOR == "runs" else _full_scan
+    if config.LINE_TRACKING:
+        return tracker.track(edges, screen_height, full_scan)
+    return full_scan(edges, screen_height)
+
+
+def _centerline(tracker: LineTracker, edges: Mat, screen_height: int):
+    return _finish_scan(edges.shape[1], *_scan(tracker, edges, screen_height))
+
+
+def _handle_birdseye(frame: Mat, screen_height: int) -> LineResult:
+    """在鸟瞰图（地面坐标）中测量中线误差，误差换算回原图宽度的像素量纲"""
+    height, width = frame.shape[:2]
+    roi_top = _roi_top()
+    warp = birdseye.get_birdseye(width, height, roi_top)
+    # 只对 ROI 做低分辨率变换，再在小图上转换颜色空间
+    ws = get_workspace()
+    out_w, out_h = warp.out_size
+    ground = warp.warp(frame, dst=ws.buffer("ground", (out_h, out_w, 3)))
+    hsv = cv2.cvtColor(ground, cv2.COLOR_BGR2HSV, dst=ws.buffer("ground_hsv", ground.shape))
+    hsv = cv2.GaussianBlur(hsv, (7, 7), 0, dst=ws.buffer("ground_blur", ground.shape))
+    edges = _extract(get_yellow_mask(hsv), ws, "ground_edges")
+
+    # 鸟瞰图整幅都是 ROI，扫描全部行
+    ground_height = edges.shape[0] + roi_top
+    error, points = _centerline(_birdseye_tracker, edges, ground_height)
+    error *= warp.scale_x(width)
+
+    return LineResult(
+        direction=_direction(error),
+        error=error,
+        roi_pts=warp.src_points.astype(np.int32).reshape(-1, 1, 2),
+        mid_points=warp.to_frame(points),
+    )
+
+
+def _blur_ksize(scale: int, blur_ksize: Optional[int] = None) -> int:
+    # 模糊核按层级缩小，保持相同的物理尺度
+    return ((params["blur_ksize"] if blur_ksize is None else blur_ksize) // scale) | 1
+
+
+def level_hsv(frame: Mat, level: int, blur_ksize: Optional[int] = None) -> Mat:
+    """
+    金字塔第 level 层模糊后的 HSV 图像（结果在工作区缓冲区中，下次调用会被覆盖）
+
+    :param blur_ksize: 原分辨率的模糊核边长，默认取参数 blur_ksize（离线调参按候选值预先计算时传入）
+    """
+    ws = get_workspace()
+    scale = 1 << level
+    if level:
+        height, width = frame.shape[:2]
+        size = (width // scale, height // scale)
+        frame = cv2.resize(frame, size, dst=ws.buffer("pyramid", (size[1], size[0], 3)),
+                           interpolation=cv2.INTER_AREA)
+
+    # 缓冲区按形状区分，各层级互不覆盖
     # BGR to HSV
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=ws.buffer("hsv", frame.shape))
     # 高斯模糊  
-    hsv = cv2.GaussianBlur(hsv, (7, 7), 0)
+    ksize = _blur_ksize(scale, blur_ksize)
+    return cv2.GaussianBlur(hsv, (ksize, ksize), 0, dst=ws.buffer("hsv_blur", frame.shape))
+
+
+def _detect(frame: Mat, screen_height: int, level: int, hsv: Optional[Dict[int, Mat]] = None):
+    """
+    在金字塔第 level 层上检测
+
+    :param hsv: 见 handle_one_frame()
+    Returns:
+        (行号, 左线, 右线, 中点, 边缘图, ROI 顶点)，均为该层坐标
+    """
+    ws = get_workspace()
+    scale = 1 << level
+    if level:
+        # 与鸟瞰图相同，换算 screen_height 使扫描行数（screen_height - roi_top）按比例缩小
+        screen_height = _roi_top() + (screen_height - _roi_top()) // scale
+
+    if hsv is not None and level in hsv:
+        hsv = hsv[level]
+    else:
+        hsv = level_hsv(frame, level)
 
     # light_detect2.handle(frame, hsv)
 
-    roi, pts = get_roi(hsv)
+    roi, pts = get_roi(hsv, scale)
 
     yellow_mask = get_yellow_mask(roi)
 
-    edges = cv2.Canny(yellow_mask, 50, 100)
+    edges = _extract(yellow_mask, ws, "edges")
+    tracker = _level_trackers.get(level)
+    if tracker is None:
+        tracker = _level_trackers[level] = LineTracker(search_radius=max(_line_tracker.search_radius // scale, 4))
+    ys, lefts, rights, mids = _scan(tracker, edges, screen_height)
+    return ys, lefts, rights, mids, edges, pts
 
-    mask = edges != 0
-    frame[mask] = [0, 0, 255]
 
-    # Draw ROI region
-    cv2.polylines(frame, [pts], isClosed=True, color=(255, 0, 55), thickness=1)
+def _edge_bias() -> float:
+    """
+    赛道线位置相对线中心的偏差（像素）
 
-    error = mid(frame, edges, screen_height)
+    Canny 把上升沿标在前景左侧的背景像素、下降沿标在前景最右的像素上，两侧边缘的平均位置比线的中心偏左半个像素，
+    在粗层级上换算回原图后放大为 scale / 2；游程取线段中心，没有偏差。
+    """
+    return 0.0 if config.LINE_EXTRACTOR == "runs" else 0.5
 
-    if error > 0:
-        direction = "left"
+
+def _row_sides(line_img: Mat, row: int, split: float):
+    """单行中分割线左右两侧赛道的位置，找不到的一侧为 NaN"""
+    if config.LINE_EXTRACTOR == "runs":
+        _, cols = lane_runs(line_img[row:row + 1])
     else:
-        direction = "right"
-    
+        cols = np.flatnonzero(line_img[row])
+    left, right = cols[cols < split], cols[cols >= split]
+    return (left.mean() if len(left) else np.nan), (right.mean() if len(right) else np.nan)
+
+
+def _low_confidence_rows(lefts, rights) -> np.ndarray:
+    """
+    需要在原分辨率上补检的行：两侧都没找到，或某一侧没找到而该侧在其他行找到过
+    （整帧都没有的一侧多半在视野外，原分辨率也找不到）
+    """
+    missing_left = np.isnan(lefts)
+    missing_right = np.isnan(rights)
+    lost = missing_left & missing_right
+    if not missing_left.all():
+        lost |= missing_left
+    if not missing_right.all():
+        lost |= missing_right
+    return np.flatnonzero(lost)
+
+
+def _refine_rows(frame: Mat, scale: int, ys, lefts, rights, mids, hsv: Optional[Dict[int, Mat]] = None) -> int:
+    """
+    在原分辨率上补检粗层级中置信度低的行（原地修改 lefts / rights / mids）
+
+    只处理覆盖这些行的一段原图，缓冲区取原分辨率缓冲区的切片，段高每帧不同也不会新建缓冲区。
+    hsv 中有第 0 层时直接取其中的一段。
+
+    Returns:
+        补检的行数
+    """
+    rows = _low_confidence_rows(lefts, rights)
+    if not len(rows):
+        return 0
+    height, width = frame.shape[:2]
+    coarse_width = width // scale
+    ws = get_workspace()
+    ksize = _blur_ksize(1)
+    # 模糊、闭运算和 Canny 都需要上下相邻的像素
+    margin = ksize // 2 + 2
+    full_ys = np.minimum(ys[rows] * scale + scale // 2, height - 1)
+    top = max(int(full_ys.min()) - margin, 0)
+    bottom = min(int(full_ys.max()) + margin + 1, height)
+
+    band = slice(top, bottom)
+    if hsv is not None and 0 in hsv:
+        hsv = hsv[0][band]
+    else:
+        hsv = cv2.cvtColor(frame[band], cv2.COLOR_BGR2HSV, dst=ws.buffer("band_hsv", frame.shape)[band])
+        hsv = cv2.GaussianBlur(hsv, (ksize, ksize), 0, dst=ws.buffer("band_blur", frame.shape)[band])
+    line_img = get_yellow_mask(hsv, out=ws.buffer("band_yellow", (height, width))[band])
+    if config.LINE_EXTRACTOR != "runs":
+        line_img = cv2.Canny(line_img, 50, 100, edges=ws.buffer("band_edges", (height, width))[band])
+
+    bias = _edge_bias()
+    for i, y in zip(rows.tolist(), full_ys.tolist()):
+        # 与扫描相同，以下一行（更靠近车头）的中点为分割线
+        half = mids[i - 1] if i > 0 else coarse_width // 2
+        left, right = _row_sides(line_img, y - top, half * scale)
+        # 原图像素 x 的中心在粗层级的 (x + 0.5) / scale - 0.5；先修正原图上的边缘偏差，再换成粗层级上的同一约定
+        lefts[i] = (left + bias + 0.5) / scale - 0.5 - bias
+        rights[i] = (right + bias + 0.5) / scale - 0.5 - bias
+        mids[i] = ((0 if np.isnan(left) else lefts[i]) + (coarse_width if np.isnan(right) else rights[i])) / 2
+    return len(rows)
+
+
+def handle_one_frame(frame: Mat, screen_height: int, level: Optional[int] = None,
+                     hsv: Optional[Dict[int, Mat]] = None) -> LineResult:
+    """
+    检测赛道中线，不修改输入帧；叠加绘制见 vision.overlay
+
+    先在金字塔第 level 层上检测：置信度（找到赛道的行占比）低于 PYRAMID_MIN_CONFIDENCE 时整帧回退到原分辨率，
+    否则只在原分辨率上补检两侧都没找到赛道的行。
+
+    :param level: 金字塔层级，为 None 时由 vision.governor 按负载选择，并记录本帧耗时
+    :param hsv: 层级 -> 该层 level_hsv() 的结果，离线调参用预先计算的图像跳过缩放、颜色转换和模糊；
+                缺少的层级（如回退和补检用的第 0 层）仍从 frame 计算
+    """
+    if config.BIRDSEYE_ON:
+        return _handle_birdseye(frame, screen_height)
+
+    start = time.perf_counter()
+    governor = None
+    if level is None:
+        governor = get_governor()
+        level = governor.level
+
+    pyramid_stats['frames'] += 1
+    ys, lefts, rights, mids, edges, pts = _detect(frame, screen_height, level, hsv)
+    if level and LineTracker._confidence(lefts, rights) < config.PYRAMID_MIN_CONFIDENCE:
+        pyramid_stats['frame_escalations'] += 1
+        level = 0
+        ys, lefts, rights, mids, edges, pts = _detect(frame, screen_height, 0, hsv)
+    elif level:
+        refined = _refine_rows(frame, 1 << level, ys, lefts, rights, mids, hsv)
+        if refined:
+            pyramid_stats['row_refines'] += 1
+            pyramid_stats['rows_refined'] += refined
+            # 跟踪状态与 lefts / rights 是同一数组，补检后刷新置信度；不跟踪时跟踪器没有状态
+            tracker = _level_trackers[level]
+            if config.LINE_TRACKING and tracker.lefts is not None:
+                tracker.confidence = tracker._confidence(tracker.lefts, tracker.rights)
+
+    # 换算回输入帧的像素量纲
+    scale = 1 << level
+    error, points = _finish_scan(edges.shape[1], ys, lefts, rights, mids + _edge_bias(), scale, frame.shape[1])
+    if level:
+        pts = (pts * scale).astype(np.int32)
+
     # error = round(error)
 
-    return direction, error
+    if governor is not None:
+        governor.record((time.perf_counter() - start) * 1000)
+    return LineResult(direction=_direction(error), error=error, roi_pts=pts, edges=edges, mid_points=points,
+                      level=level)
+
+
+if __name__ == "__main__":
+    # 对比 Canny + mid 与游程提取的耗时，以及加入噪点和色块后的误差（理想中线误差为 0）
+    frame = np.zeros((config.SCREEN_HEIGHT, config.SCREEN_WIDTH, 3), dtype=np.uint8)
+    w, h = config.SCREEN_WIDTH, config.SCREEN_HEIGHT
+    cv2.line(frame, (w * 5 // 16, h), (w * 7 // 16, 100), (0, 220, 230), 10)
+    cv2.line(frame, (w * 11 // 16, h), (w * 9 // 16, 100), (0, 220, 230), 10)
+    noisy = frame.copy()
+    rng = np.random.default_rng(0)
+    ys, xs = rng.integers(100, h, 800), rng.integers(0, w, 800)
+    noisy[ys, xs] = (0, 220, 230)
+    cv2.circle(noisy, (w // 8, h * 3 // 4), 40, (0, 220, 230), -1)
+
+    # 远处汇聚到相距 40 像素的两条线，跟踪窗口（半宽 40）在顶部几行重叠
+    converging = np.zeros_like(frame)
+    cv2.line(converging, (w * 3 // 16, h), (w // 2 - 20, 100), (0, 220, 230), 10)
+    cv2.line(converging, (w * 13 // 16, h), (w // 2 + 20, 100), (0, 220, 230), 10)
+
+    for name, img in (("干净", frame), ("噪点+色块", noisy), ("汇聚", converging)):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = get_yellow_mask(get_roi(hsv)[0]).copy()
+        n = 200
+        start = time.perf_counter()
+        for _ in range(n):
+            error_canny, _ = mid(cv2.Canny(mask, 50, 100), h)
+        canny_ms = (time.perf_counter() - start) / n * 1000
+        start = time.perf_counter()
+        for _ in range(n):
+            error_runs, _ = mid_runs(mask, h)
+        runs_ms = (time.perf_counter() - start) / n * 1000
+        print(f"{name}: Canny+mid {canny_ms:.2f} ms 误差 {error_canny:.2f}，游程 {runs_ms:.2f} ms 误差 {error_runs:.2f}")
+        # 开启跟踪（LINE_TRACKING=1）时第 3 帧的误差和最上一行的左右线位置
+        for extractor, line_img, full_scan in (("Canny", cv2.Canny(mask, 50, 100), _full_scan),
+                                               ("游程", mask, _runs_scan)):
+            tracker = LineTracker()
+            for _ in range(3):
+                ys, lefts, rights, mids = tracker.track(line_img, h, full_scan)
+            error, _ = _finish_scan(w, ys, lefts, rights, mids)
+            print(f"  跟踪 {extractor}: 误差 {error:.2f}，最上一行左右线 {lefts[-1]:.1f} / {rights[-1]:.1f}")
 
+    # 金字塔各层级的整帧耗时（含颜色转换和模糊）与误差；远处赛道线只有 1 像素宽时粗层级丢失，误差应与第 0 层接近
+    thin = frame.copy()
+    cv2.line(thin, (w * 7 // 16, 100), (w * 6 // 16, h // 2), (0, 0, 0), 10)
+    cv2.line(thin, (w * 7 // 16, 100), (w * 6 // 16, h // 2), (0, 220, 230), 1)
+    for name, img in (("干净", frame), ("远处细线", thin)):
+        for level in (0, 1, 2):
+            before = dict(pyramid_stats)
+            n = 100
+            start = time.perf_counter()
+            for _ in range(n):
+                result = handle_one_frame(img, h, level=level)
+            ms = (time.perf_counter() - start) / n * 1000
+            refined = (pyramid_stats['rows_refined'] - before['rows_refined']) / n
+            escalated = pyramid_stats['frame_escalations'] - before['frame_escalations']
+            print(f"{name} 第 {level} 层: {ms:.2f} ms/帧 误差 {result.error:.2f}，"
+                  f"每帧补检 {refined:.1f} 行，回退原分辨率 {escalated} 帧")
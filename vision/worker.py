@@ -0,0 +1,262 @@
+"""
+独立进程中的视觉处理
+
+主进程只负责采集，把原始帧写入共享内存环形缓冲区；工作进程取最新的一帧运行
+track_line / light_detect，结果写入共享内存中的定长结构（顺序锁保护，不经过管道或队列）。
+视觉处理不再与服务器线程、串口接收线程争用同一个 GIL。
+"""
+
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+import numpy as np
+
+RESULT_DTYPE = np.dtype([
+    ('version', '<i8'),        # 顺序锁：奇数表示正在写入
+    ('seq', '<i8'),            # 结果对应的帧序号
+    ('error', '<f8'),
+    ('direction', 'i1'),       # 1 左转, -1 右转
+    ('red', '<i4'),
+    ('green', '<i4'),
+    ('capture_time', '<f8'),   # 主进程采集时间 time.monotonic()
+    ('done_time', '<f8'),      # 工作进程处理完成时间
+])
+
+
+class FrameRing:
+    """共享内存中的帧环形缓冲区"""
+
+    def __init__(self, shape: tuple, slots: int = 3, name: Optional[str] = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.shape))
+        # 头部：最新帧序号，以及每个槽位的帧序号和采集时间
+        self._header_bytes = 8 + slots * 16
+        size = self._header_bytes + slots * frame_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.latest = np.ndarray((1,), dtype='<i8', buffer=self.shm.buf, offset=0)
+        self.slot_seq = np.ndarray((slots,), dtype='<i8', buffer=self.shm.buf, offset=8)
+        self.slot_time = np.ndarray((slots,), dtype='<f8', buffer=self.shm.buf, offset=8 + slots * 8)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=self._header_bytes)
+        if name is None:
+            self.latest[0] = -1
+            self.slot_seq[:] = -1
+
+    def put(self, seq: int, frame: np.ndarray, capture_time: float):
+        slot = seq % self.slots
+        self.slot_seq[slot] = -1  # 写入期间标记为无效
+        np.copyto(self.frames[slot], frame)
+        self.slot_time[slot] = capture_time
+        self.slot_seq[slot] = seq
+        self.latest[0] = seq
+
+    def get_latest(self, out: np.ndarray):
+        """把最新一帧拷贝到 out，返回 (帧序号, 采集时间)；拷贝期间被覆盖则返回 (-1, 0)"""
+        seq = int(self.latest[0])
+        if seq < 0:
+            return -1, 0.0
+        slot = seq % self.slots
+        capture_time = float(self.slot_time[slot])
+        np.copyto(out, self.frames[slot])
+        if int(self.slot_seq[slot]) != seq:
+            return -1, 0.0
+        return seq, capture_time
+
+    def close(self, unlink: bool = False):
+        # 先释放所有视图
+        self.latest = self.slot_seq = self.slot_time = self.frames = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class ResultSlot:
+    """共享内存中的单条结果，顺序锁保证读到的是完整的一条"""
+
+    def __init__(self, name: Optional[str] = None):
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=RESULT_DTYPE.itemsize)
+        self.record = np.ndarray((1,), dtype=RESULT_DTYPE, buffer=self.shm.buf)
+        if name is None:
+            self.record[0] = 0
+            self.record['seq'] = -1
+
+    def write(self, **fields):
+        rec = self.record
+        rec['version'] += 1
+        for key, value in fields.items():
+            rec[key] = value
+        rec['version'] += 1
+
+    def read(self):
+        """返回结果的拷贝，写入过程中则返回 None"""
+        v1 = int(self.record['version'][0])
+        if v1 & 1:
+            return None
+        snapshot = self.record[0].copy()
+        if int(self.record['version'][0]) != v1:
+            return None
+        return snapshot
+
+    def close(self, unlink: bool = False):
+        self.record = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(ring_name, ring_shape, ring_slots, result_name, frame_ready, result_ready, stop, screen_size):
+    import cv2
+    from vision import light_detect, track_line
+
+    ring = FrameRing(ring_shape, ring_slots, name=ring_name)
+    result = ResultSlot(name=result_name)
+    frame = np.empty(ring_shape, dtype=np.uint8)
+    last_seq = -1
+    try:
+        while not stop.is_set():
+            if not frame_ready.wait(timeout=0.1):
+                continue
+            frame_ready.clear()
+            seq, capture_time = ring.get_latest(frame)
+            if seq < 0 or seq == last_seq:
+                continue
+            last_seq = seq
+
+            r_frame = cv2.resize(frame, screen_size)
+            line = track_line.handle_one_frame(r_frame, screen_size[1])
+            lights = light_detect.handle_lights(frame)
+
+            result.write(
+                seq=seq,
+                error=line.error,
+                direction=1 if line.direction == "left" else -1,
+                red=lights.red_count,
+                green=lights.green_count,
+                capture_time=capture_time,
+                done_time=time.monotonic(),
+            )
+            result_ready.set()
+    finally:
+        ring.close()
+        result.close()
+
+
+class VisionWorker:
+    """视觉工作进程的主进程一侧"""
+
+    def __init__(self, frame_shape: tuple, screen_size: tuple[int, int], slots: int = 3):
+        """
+        :param frame_shape: 摄像头原始帧形状 (高, 宽, 3)
+        :param screen_size: 赛道检测使用的分辨率 (宽, 高)
+        """
+        ctx = mp.get_context("spawn")
+        self.ring = FrameRing(frame_shape, slots)
+        self.result = ResultSlot()
+        self.frame_ready = ctx.Event()
+        self.result_ready = ctx.Event()
+        self.stop_event = ctx.Event()
+        self.seq = -1
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(self.ring.shm.name, self.ring.shape, slots, self.result.shm.name,
+                  self.frame_ready, self.result_ready, self.stop_event, tuple(screen_size)),
+            name="vision-worker",
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+
+    def submit(self, frame: np.ndarray, capture_time: float) -> int:
+        """提交一帧，返回帧序号"""
+        self.seq += 1
+        self.ring.put(self.seq, frame, capture_time)
+        self.frame_ready.set()
+        return self.seq
+
+    def latest(self, after_seq: int = -1, timeout: float = 0.0):
+        """
+        获取帧序号大于 after_seq 的最新结果
+
+        :param timeout: 最长等待时间，0 表示不等待
+        :return: RESULT_DTYPE 记录，没有新结果时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.result.read()
+            if snapshot is not None and snapshot['seq'] > after_seq:
+                return snapshot
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.result_ready.wait(timeout=remaining)
+            self.result_ready.clear()
+
+    def stop(self, timeout: float = 2.0):
+        self.stop_event.set()
+        if self.process.is_alive():
+            self.process.join(timeout=timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close(unlink=True)
+        self.result.close(unlink=True)
+
+
+def _cpu_times():
+    """读取 /proc/stat 中每个核心的 (忙, 总) 时间"""
+    times = []
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("cpu") and line[3].isdigit():
+                values = [int(v) for v in line.split()[1:]]
+                idle = values[3] + values[4]
+                times.append((sum(values) - idle, sum(values)))
+    return times
+
+
+def _utilization(before, after):
+    return [100.0 * (a[0] - b[0]) / max(a[1] - b[1], 1) for b, a in zip(before, after)]
+
+
+if __name__ == "__main__":
+    # 对比进程内处理和工作进程处理的单帧延迟与各核心占用
+    import cv2
+    import config
+    from vision import light_detect, track_line
+
+    frames = 200
+    size = (config.SCREEN_WIDTH, config.SCREEN_HEIGHT)
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    cv2.line(frame, (size[0] // 3, size[1]), (size[0] // 2 - 40, 100), (0, 220, 230), 10)
+    cv2.line(frame, (size[0] * 2 // 3, size[1]), (size[0] // 2 + 40, 100), (0, 220, 230), 10)
+
+    before = _cpu_times()
+    start = time.perf_counter()
+    latencies = []
+    for _ in range(frames):
+        t0 = time.monotonic()
+        track_line.handle_one_frame(cv2.resize(frame, size), size[1])
+        light_detect.handle_lights(frame)
+        latencies.append(time.monotonic() - t0)
+    elapsed = time.perf_counter() - start
+    print(f"进程内: {frames / elapsed:.1f} fps, 平均延迟 {np.mean(latencies) * 1e3:.2f} ms, "
+          f"核心占用 {['%.0f%%' % u for u in _utilization(before, _cpu_times())]}")
+
+    worker = VisionWorker(frame.shape, size)
+    worker.start()
+    worker.submit(frame, time.monotonic())
+    worker.latest(-1, timeout=30.0)  # 等待工作进程完成导入
+
+    before = _cpu_times()
+    start = time.perf_counter()
+    latencies = []
+    for _ in range(frames):
+        seq = worker.submit(frame, time.monotonic())
+        result = worker.latest(seq - 1, timeout=1.0)
+        if result is not None:
+            latencies.append(result['done_time'] - result['capture_time'])
+    elapsed = time.perf_counter() - start
+    print(f"工作进程: {frames / elapsed:.1f} fps, 平均延迟 {np.mean(latencies) * 1e3:.2f} ms, "
+          f"核心占用 {['%.0f%%' % u for u in _utilization(before, _cpu_times())]}")
+    worker.stop()
@@ -0,0 +1,103 @@
+"""
+视觉处理的预分配工作区
+
+常量掩膜、卷积核、查找表和各步骤的输出缓冲区按分辨率只创建一次，
+每帧通过 dst= 参数复用，稳态下每帧几乎不再分配内存。
+"""
+
+import contextlib
+import logging
+import tracemalloc
+import cv2
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Workspace:
+    """按名称和形状缓存缓冲区"""
+
+    def __init__(self):
+        self._buffers: dict = {}
+        self._consts: dict = {}
+        # 创建缓冲区的次数，稳态下应保持不变
+        self.allocations = 0
+
+    def buffer(self, name: str, shape: tuple, dtype=np.uint8, zero: bool = False) -> np.ndarray:
+        """
+        获取输出缓冲区，首次使用时分配
+
+        :param zero: 是否以 0 初始化（用于只写入部分像素的输出，如带掩膜的运算）
+        """
+        key = (name, tuple(shape), np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = np.zeros(shape, dtype) if zero else np.empty(shape, dtype)
+            self._buffers[key] = buf
+            self.allocations += 1
+        return buf
+
+    def const(self, key, factory):
+        """获取常量（掩膜、卷积核、查找表等），首次使用时由 factory 创建"""
+        value = self._consts.get(key)
+        if value is None:
+            value = factory()
+            self._consts[key] = value
+            self.allocations += 1
+        return value
+
+    def kernel(self, shape: int, size: tuple[int, int]) -> np.ndarray:
+        return self.const(("kernel", shape, size), lambda: cv2.getStructuringElement(shape, size))
+
+
+_workspace = Workspace()
+
+
+def get_workspace() -> Workspace:
+    return _workspace
+
+
+class AllocProbe:
+    """
+    调试用：统计每帧的内存分配
+
+    通过 tracemalloc 记录每帧相对帧开始时的峰值增量（NumPy/OpenCV 的数组分配都会被跟踪），
+    以及工作区新建缓冲区的次数。
+    """
+
+    def __init__(self, report_every: int = 100):
+        self.report_every = report_every
+        self.frames = 0
+        self.total_peak_bytes = 0
+        self._last_allocations = 0
+
+    @contextlib.contextmanager
+    def frame(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        ws = get_workspace()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            self.frames += 1
+            self.total_peak_bytes += peak - start
+            if self.frames % self.report_every == 0:
+                new_buffers = ws.allocations - self._last_allocations
+                self._last_allocations = ws.allocations
+                logger.info(f"[alloc] 近 {self.report_every} 帧平均每帧峰值分配 {self.total_peak_bytes / self.report_every / 1024:.1f} KiB，"
+                            f"工作区新建缓冲区 {new_buffers} 个")
+                self.total_peak_bytes = 0
+
+
+_probe = AllocProbe()
+
+
+def alloc_probe():
+    """主循环中包裹每帧的处理；未开启 VISION_ALLOC_DEBUG 时不做任何事"""
+    if config.VISION_ALLOC_DEBUG:
+        return _probe.frame()
+    return contextlib.nullcontext()